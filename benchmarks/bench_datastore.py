@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+
+
+'''
+Datastore contention benchmark: lost updates and throughput of concurrent read-modify-writes
+  'writers' threads each increment the same holding registers 'ops' times, either with a plain
+  read + write (what the behaviors did before) or with update_hr_register, while 'readers' threads
+  keep taking multi-table snapshots. Reports lost increments, write and snapshot rates for the
+  list and array datablocks.
+
+  python bench_datastore.py --writers 4 --readers 2 --ops 20000
+'''
+import sys, os, argparse, json
+from threading import Thread, Event
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+from datastore import PLCSlaveContext, read_hr_register, write_hr_register, update_hr_register, snapshot_registers
+from datablock import make_datablock
+
+TABLES = ('di', 'co', 'hr', 'ir')
+
+def build_slave(kind, size):
+    tables = dict((table, make_datablock(table, 1, [0] * size, kind)) for table in TABLES)
+    return PLCSlaveContext(di=tables['di'], co=tables['co'], hr=tables['hr'], ir=tables['ir'])
+
+def increment(values):
+    return [v + 1 for v in values]
+
+def plain_writer(slave, address, count, ops):
+    for i in range(ops):
+        values = read_hr_register(slave, 0x00, address, count)
+        write_hr_register(slave, 0x00, address, increment(values))
+
+def atomic_writer(slave, address, count, ops):
+    for i in range(ops):
+        update_hr_register(slave, 0x00, address, count, increment)
+
+def reader(slave, done, snapshots):
+    while not done.is_set():
+        snapshot_registers(slave, 0x00, TABLES)
+        snapshots[0] += 1
+
+def run(mode, kind, writers, readers, ops, size, count):
+    slave = build_slave(kind, size)
+    target = atomic_writer if mode == 'update' else plain_writer
+    done = Event()
+    snapshots = [0]
+    reader_threads = [Thread(target=reader, args=(slave, done, snapshots)) for i in range(readers)]
+    writer_threads = [Thread(target=target, args=(slave, 0x00, count, ops)) for i in range(writers)]
+    for thread in reader_threads:
+        thread.start()
+    start = time()
+    for thread in writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time() - start
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+
+    # registers wrap at 16 bits in the array datablock
+    expected = (writers * ops) & 0xFFFF if kind == 'array' else writers * ops
+    final = list(read_hr_register(slave, 0x00, 0x00, count))
+    lost = sum((expected - v) & 0xFFFF if kind == 'array' else expected - v for v in final) // count
+    return {'mode': mode, 'datablock': kind, 'writers': writers, 'readers': readers, 'ops': writers * ops,
+            'lost_updates': lost, 'elapsed_sec': elapsed, 'writes_per_sec': writers * ops / elapsed,
+            'snapshots_per_sec': snapshots[0] / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure lost updates and throughput of concurrent datastore read-modify-writes")
+    parser.add_argument("--writers", type = int, default = 4, help = "Threads incrementing the same registers")
+    parser.add_argument("--readers", type = int, default = 2, help = "Threads taking multi-table snapshots meanwhile")
+    parser.add_argument("--ops", type = int, default = 20000, help = "Increments per writer thread")
+    parser.add_argument("--size", type = int, default = 1000, help = "Registers per table")
+    parser.add_argument("--count", type = int, default = 4, help = "Registers per increment")
+    parser.add_argument("--modes", default = 'plain,update', help = "Comma separated modes to run (plain, update)")
+    parser.add_argument("--datablocks", default = 'list,array', help = "Comma separated datablocks to run (list, array)")
+    parser.add_argument("--json", help = "Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for kind in args.datablocks.split(','):
+        for mode in args.modes.split(','):
+            result = run(mode, kind, args.writers, args.readers, args.ops, args.size, args.count)
+            results.append(result)
+            print("%-6s %-6s writers=%-3d readers=%-3d lost=%-8d writes=%10.0f/s snapshots=%8.0f/s" % (result['mode'], result['datablock'], result['writers'], result['readers'], result['lost_updates'], result['writes_per_sec'], result['snapshots_per_sec']))
+
+    if args.json:
+        out = open(args.json, 'w')
+        json.dump(results, out, indent=2)
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Startup time and memory benchmark: one process per PLC vs. one multi-PLC host
+  Builds a throw-away fleet (config + backups) in a temp directory, starts it
+  the way startup_plc.sh does (async_plc.py per PLC) and through plc_host.py,
+  then reports how long it took until every PLC answered a Modbus read and
+  the total RSS of the processes involved.
+
+  python bench_host_modes.py --c ../configs/test_config.yaml --plcs 200
+'''
+import sys, os, argparse, json, shutil, socket, struct, subprocess, tempfile
+import copy, yaml
+from time import time, sleep
+
+PLC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc')
+
+'''
+@brief write the fleet config and the initial backups (same layout as master.py) into work_dir
+- If num_of_plc is given, 'PLC 0' is cloned that many times with consecutive ports starting at base_port
+'''
+def build_fleet(config_yaml, work_dir, num_of_plc, base_port):
+    fleet = {'MASTER': {'num_of_PLC': config_yaml['MASTER']['num_of_PLC']}}
+    if num_of_plc is None:
+        for i in range(fleet['MASTER']['num_of_PLC']):
+            fleet['PLC ' + str(i)] = copy.deepcopy(config_yaml['PLC ' + str(i)])
+    else:
+        fleet['MASTER']['num_of_PLC'] = num_of_plc
+        for i in range(num_of_plc):
+            plc = copy.deepcopy(config_yaml['PLC 0'])
+            plc['SERVER']['port'] = base_port + i
+            fleet['PLC ' + str(i)] = plc
+
+    backup_dir = os.path.join(work_dir, 'backups')
+    os.mkdir(backup_dir)
+    for i in range(fleet['MASTER']['num_of_PLC']):
+        plc = fleet['PLC ' + str(i)]
+        plc['SERVER']['address'] = '127.0.0.1'
+        plc['LOGGING']['file'] = os.path.join(work_dir, 'logging_' + str(i) + '.log')
+        datastore = plc['DATASTORE']
+        backup_dict = {'DATASTORE': {}}
+        for table in ('hr', 'ir', 'co', 'di'):
+            backup_dict['DATASTORE'][table] = {'start_addr': 1, 'values': datastore[table]['values']}
+        backup = open(os.path.join(backup_dir, 'backup_' + str(i) + '.yaml'), 'w')
+        yaml.dump(backup_dict, backup)
+        backup.close()
+
+    config_filename = os.path.join(work_dir, 'config.yaml')
+    stream = open(config_filename, 'w')
+    yaml.dump(fleet, stream)
+    stream.close()
+    return fleet, config_filename, backup_dir
+
+'''
+@brief returns True once the PLC listening on port answers a read holding registers request
+'''
+def modbus_ready(port):
+    try:
+        sock = socket.create_connection(('127.0.0.1', port), timeout=1)
+    except socket.error:
+        return False
+    try:
+        # MBAP header (transaction 1, protocol 0, length 6, unit 0) + fc 3, address 0, count 1
+        sock.sendall(struct.pack('>HHHBBHH', 1, 0, 6, 0, 3, 0, 1))
+        return len(sock.recv(256)) > 0
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+'''
+@brief resident set size of a process in kB, read from /proc
+'''
+def rss_kb(pid):
+    try:
+        status = open('/proc/' + str(pid) + '/status')
+    except IOError:
+        return 0
+    rss = 0
+    for line in status:
+        if line.startswith('VmRSS:'):
+            rss = int(line.split()[1])
+    status.close()
+    return rss
+
+'''
+@brief start the fleet in the given mode, wait for every tcp PLC to answer, and sample memory
+'''
+def run_mode(mode, fleet, config_filename, backup_dir, timeout, settle):
+    num_of_plc = fleet['MASTER']['num_of_PLC']
+    ports = [int(fleet['PLC ' + str(i)]['SERVER']['port']) for i in range(num_of_plc)
+             if fleet['PLC ' + str(i)]['SERVER']['type'] == 'tcp']
+    devnull = open(os.devnull, 'w')
+    procs = []
+    start = time()
+    if mode == 'process':
+        for i in range(num_of_plc):
+            procs.append(subprocess.Popen([sys.executable, os.path.join(PLC_DIR, 'async_plc.py'), '--n', str(i), '--c', config_filename, '--b', backup_dir], stdout=devnull, stderr=devnull))
+    else:
+        procs.append(subprocess.Popen([sys.executable, os.path.join(PLC_DIR, 'plc_host.py'), '--c', config_filename, '--b', backup_dir], stdout=devnull, stderr=devnull))
+
+    pending = list(ports)
+    while pending and time() - start < timeout:
+        pending = [port for port in pending if not modbus_ready(port)]
+        if pending:
+            sleep(0.05)
+    startup = time() - start
+    sleep(settle)
+    result = {'mode': mode, 'plcs': num_of_plc, 'processes': len(procs),
+              'ready': len(ports) - len(pending), 'startup_sec': round(startup, 3),
+              'rss_total_kb': sum(rss_kb(p.pid) for p in procs)}
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+    devnull.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compare startup time and memory of per-process PLCs vs. the multi-PLC host")
+    parser.add_argument("--c", "--config_filename", required = True, help = "Master config file to benchmark")
+    parser.add_argument("--plcs", type = int, default = None, help = "Clone 'PLC 0' this many times instead of using the config's own PLC sections")
+    parser.add_argument("--base_port", type = int, default = 15020, help = "First port used when cloning with --plcs")
+    parser.add_argument("--modes", default = 'process,host', help = "Comma separated modes to run (process, host)")
+    parser.add_argument("--timeout", type = float, default = 300, help = "Seconds to wait for the fleet to answer")
+    parser.add_argument("--settle", type = float, default = 2, help = "Seconds to wait after startup before sampling RSS")
+    parser.add_argument("--json", help = "Also write the results to this file")
+    args = parser.parse_args()
+
+    stream = open(args.c, 'r')
+    config_yaml = yaml.safe_load(stream)
+    stream.close()
+
+    results = []
+    for mode in args.modes.split(','):
+        # fresh backups for every mode so both start from the same state
+        work_dir = tempfile.mkdtemp(prefix='scadasim_bench_')
+        try:
+            fleet, config_filename, backup_dir = build_fleet(config_yaml, work_dir, args.plcs, args.base_port)
+            result = run_mode(mode, fleet, config_filename, backup_dir, args.timeout, args.settle)
+        finally:
+            shutil.rmtree(work_dir)
+        results.append(result)
+        print("%-8s plcs=%-5d procs=%-5d ready=%-5d startup=%8.3fs rss=%10d kB" % (result['mode'], result['plcs'], result['processes'], result['ready'], result['startup_sec'], result['rss_total_kb']))
+
+    if args.json:
+        out = open(args.json, 'w')
+        json.dump(results, out, indent=2)
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+
+
+'''
+Modbus load benchmark: request throughput and latency of the simulated PLCs under client load
+  Builds a throw-away fleet from a master config, starts it on localhost (plc_host.py or one
+  async_plc.py per PLC) and drives it with concurrent Modbus TCP or UDP clients sending a
+  weighted mix of function codes. Reports per function code throughput and p50/p99/p999
+  latency, the behavior tick lag seen through a probe register, and the CPU and RSS of the
+  PLC processes. Results can be written as JSON to compare releases.
+
+  python bench_modbus_load.py --c ../configs/test_config.yaml --plcs 20 --clients 16 --duration 30
+
+  Tick lag: every PLC gets one extra holding register with a 'linear' behavior adding 1 every
+  --probe_interval seconds. The lag is how much later than scheduled its ticks ran on average
+  during the measurement window.
+'''
+import sys, os, argparse, json, platform, random, shutil, socket, struct, subprocess, tempfile
+import copy, yaml
+from threading import Thread, Event
+from time import time, sleep
+from bench_host_modes import PLC_DIR, build_fleet, modbus_ready, rss_kb
+
+FUNCTION_NAMES = {1: 'read_coils', 2: 'read_discrete_inputs', 3: 'read_holding_registers', 4: 'read_input_registers',
+                  5: 'write_single_coil', 6: 'write_single_register', 15: 'write_multiple_coils', 16: 'write_multiple_registers'}
+
+'''
+@brief parse a function code mix such as '3:40,4:10,16:5' into [(function code, weight)]
+'''
+def parse_mix(spec):
+    mix = []
+    for part in spec.split(','):
+        fc, weight = part.split(':')
+        if int(fc) not in FUNCTION_NAMES:
+            raise ValueError("Unsupported function code " + fc)
+        mix.append((int(fc), float(weight)))
+    return mix
+
+'''
+@brief request PDU for function code fc at address, reading or writing count registers/coils
+'''
+def build_pdu(fc, address, count, rng):
+    if fc in (1, 2, 3, 4):
+        return struct.pack('>BHH', fc, address, count)
+    if fc == 5:
+        return struct.pack('>BHH', fc, address, 0xFF00 if rng.random() < 0.5 else 0x0000)
+    if fc == 6:
+        return struct.pack('>BHH', fc, address, rng.randint(0, 0xFFFF))
+    if fc == 15:
+        coils = bytearray(rng.randint(0, 0xFF) for i in range((count + 7) // 8))
+        return struct.pack('>BHHB', fc, address, count, len(coils)) + bytes(coils)
+    values = [rng.randint(0, 0xFFFF) for i in range(count)]
+    return struct.pack('>BHHB', fc, address, count, 2 * count) + struct.pack('>' + 'H' * count, *values)
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise socket.error("connection closed")
+        data += chunk
+    return data
+
+'''
+@brief one Modbus client: a connection to one PLC, sending requests from the mix until stop is set
+- Latencies (in seconds) are only recorded while 'measuring' is set, per function code
+'''
+class LoadClient(Thread):
+
+    def __init__(self, port, protocol, mix, address, count, unit, seed, measuring, stop):
+        Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.protocol = protocol
+        self.functions = [fc for fc, weight in mix]
+        total = sum(weight for fc, weight in mix)
+        self.cumulative = []
+        running = 0.0
+        for fc, weight in mix:
+            running += weight / total
+            self.cumulative.append(running)
+        self.address = address
+        self.count = count
+        self.unit = unit
+        self.rng = random.Random(seed)
+        self.measuring = measuring
+        self.stop = stop
+        self.latencies = dict((fc, []) for fc in self.functions)
+        self.errors = dict((fc, 0) for fc in self.functions)
+
+    def pick(self):
+        r = self.rng.random()
+        for fc, edge in zip(self.functions, self.cumulative):
+            if r <= edge:
+                return fc
+        return self.functions[-1]
+
+    def run(self):
+        if self.protocol == 'udp':
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect(('127.0.0.1', self.port))
+        else:
+            sock = socket.create_connection(('127.0.0.1', self.port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(2)
+        transaction = 0
+        try:
+            while not self.stop.is_set():
+                fc = self.pick()
+                pdu = build_pdu(fc, self.address, self.count, self.rng)
+                transaction = (transaction + 1) & 0xFFFF
+                request = struct.pack('>HHHB', transaction, 0, len(pdu) + 1, self.unit) + pdu
+                start = time()
+                try:
+                    sock.sendall(request) if self.protocol == 'tcp' else sock.send(request)
+                    if self.protocol == 'udp':
+                        response = sock.recv(512)
+                    else:
+                        header = recv_exactly(sock, 7)
+                        response = header + recv_exactly(sock, struct.unpack('>H', header[4:6])[0] - 1)
+                except socket.timeout:
+                    if self.measuring.is_set():
+                        self.errors[fc] += 1
+                    continue
+                latency = time() - start
+                if self.measuring.is_set():
+                    # exception responses echo the function code with the high bit set
+                    if len(response) < 8 or bytearray(response)[7] & 0x80:
+                        self.errors[fc] += 1
+                    else:
+                        self.latencies[fc].append(latency)
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+'''
+@brief value of one holding register, read over a fresh connection (None if the PLC does not answer)
+'''
+def read_register(port, protocol, address, unit=0):
+    request = struct.pack('>HHHBBHH', 1, 0, 6, unit, 3, address, 1)
+    if protocol == 'udp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(('127.0.0.1', port))
+    else:
+        try:
+            sock = socket.create_connection(('127.0.0.1', port), timeout=1)
+        except socket.error:
+            return None
+    sock.settimeout(1)
+    try:
+        sock.send(request)
+        response = sock.recv(256)
+        if len(response) < 11 or bytearray(response)[7] != 3:
+            return None
+        return struct.unpack('>H', response[9:11])[0]
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+
+'''
+@brief user + system CPU seconds used so far by a process, read from /proc
+'''
+def cpu_seconds(pid):
+    try:
+        stat = open('/proc/' + str(pid) + '/stat')
+    except IOError:
+        return 0.0
+    fields = stat.read().rsplit(')', 1)[1].split()
+    stat.close()
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat, the 12th and 13th after the command name
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+'''
+@brief copy of the master config where every PLC serves 'protocol' on localhost, logs at logging_level and has a probe register
+- response_cache, if given, sets the size of every PLC's read response cache (see plc/server.py)
+- event_loop, if given, serves every PLC from an asyncio/uvloop event loop instead of the Twisted reactor (see plc/aioserver.py)
+- Returns the config and {plc id: address of its probe register}
+'''
+def prepare_config(config_yaml, protocol, probe_interval, logging_level, response_cache=None, event_loop=None):
+    config_yaml = copy.deepcopy(config_yaml)
+    probes = {}
+    for i in range(config_yaml['MASTER']['num_of_PLC']):
+        plc = config_yaml['PLC ' + str(i)]
+        plc['SERVER']['type'] = protocol
+        plc['SERVER']['framer'] = 'TCP'
+        if response_cache is not None:
+            plc['SERVER']['response_cache'] = response_cache
+        if event_loop is not None:
+            plc['SERVER']['event_loop'] = event_loop
+        # DEBUG logging of every request would be measured too (and pymodbus' UDP server can not log client addresses at DEBUG)
+        plc['LOGGING']['logging_level'] = logging_level
+        hr = plc['DATASTORE']['hr']
+        probes[i] = len(hr['values'])
+        hr['values'] = list(hr['values']) + [0]
+        hr['behavior_' + str(len(hr['values']))] = {'type': 'linear', 'variance': 1, 'address': probes[i], 'count': 1, 'time': probe_interval}
+    return config_yaml, probes
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure Modbus request throughput and latency of the simulated PLCs under load")
+    parser.add_argument("--c", "--config_filename", required = True, help = "Master config file to benchmark")
+    parser.add_argument("--plcs", type = int, default = None, help = "Clone 'PLC 0' this many times instead of using the config's own PLC sections")
+    parser.add_argument("--base_port", type = int, default = 15020, help = "First port used when cloning with --plcs")
+    parser.add_argument("--mode", default = 'host', choices = ['host', 'process'], help = "Run the fleet in one plc_host.py or one async_plc.py per PLC")
+    parser.add_argument("--protocol", default = 'tcp', choices = ['tcp', 'udp'], help = "Transport the clients (and servers) use")
+    parser.add_argument("--clients", type = int, default = 8, help = "Concurrent clients, spread round robin over the PLCs")
+    parser.add_argument("--mix", default = '3:40,4:10,1:10,2:10,6:15,16:5,5:5,15:5', help = "Function code mix as fc:weight pairs")
+    parser.add_argument("--address", type = int, default = 0, help = "Address every request starts at")
+    parser.add_argument("--count", type = int, default = 1, help = "Registers/coils per request")
+    parser.add_argument("--duration", type = float, default = 10, help = "Seconds to measure for")
+    parser.add_argument("--warmup", type = float, default = 2, help = "Seconds of load before measuring")
+    parser.add_argument("--probe_interval", type = float, default = 0.1, help = "Seconds between ticks of the tick lag probe behavior")
+    parser.add_argument("--logging_level", default = 'WARNING', help = "LOGGING level of the PLCs while benchmarking")
+    parser.add_argument("--seed", type = int, default = 1, help = "Seed for the request mix")
+    parser.add_argument("--timeout", type = float, default = 300, help = "Seconds to wait for the fleet to answer")
+    parser.add_argument("--response_cache", type = int, default = None, help = "Entries of every PLC's read response cache (0 disables it)")
+    parser.add_argument("--event_loop", default = None, choices = ['asyncio', 'uvloop'], help = "Serve every PLC from this event loop instead of the Twisted reactor (--mode process only, Python 3)")
+    parser.add_argument("--json", help = "Also write the results to this file")
+    args = parser.parse_args()
+    if args.event_loop is not None and args.mode != 'process':
+        parser.error("--event_loop needs --mode process: plc_host.py always runs the Twisted reactor")
+
+    stream = open(args.c, 'r')
+    config_yaml = yaml.safe_load(stream)
+    stream.close()
+    mix = parse_mix(args.mix)
+    if args.plcs is not None:
+        # clone 'PLC 0' first so the probe is only added once
+        config_yaml = {'MASTER': config_yaml['MASTER'], 'PLC 0': config_yaml['PLC 0']}
+        config_yaml['MASTER'] = dict(config_yaml['MASTER'], num_of_PLC=1)
+    config_yaml, probes = prepare_config(config_yaml, args.protocol, args.probe_interval, args.logging_level, args.response_cache, args.event_loop)
+
+    work_dir = tempfile.mkdtemp(prefix='scadasim_bench_')
+    devnull = open(os.devnull, 'w')
+    procs = []
+    try:
+        fleet, config_filename, backup_dir = build_fleet(config_yaml, work_dir, args.plcs, args.base_port)
+        num_of_plc = fleet['MASTER']['num_of_PLC']
+        if args.plcs is not None:
+            probes = dict((i, probes[0]) for i in range(num_of_plc))
+        ports = [int(fleet['PLC ' + str(i)]['SERVER']['port']) for i in range(num_of_plc)]
+        if args.mode == 'process':
+            for i in range(num_of_plc):
+                procs.append(subprocess.Popen([sys.executable, os.path.join(PLC_DIR, 'async_plc.py'), '--n', str(i), '--c', config_filename, '--b', backup_dir], stdout=devnull, stderr=devnull))
+        else:
+            procs.append(subprocess.Popen([sys.executable, os.path.join(PLC_DIR, 'plc_host.py'), '--c', config_filename, '--b', backup_dir], stdout=devnull, stderr=devnull))
+
+        start = time()
+        pending = list(range(num_of_plc))
+        while pending and time() - start < args.timeout:
+            if args.protocol == 'tcp':
+                pending = [i for i in pending if not modbus_ready(ports[i])]
+            else:
+                pending = [i for i in pending if read_register(ports[i], 'udp', 0) is None]
+            if pending:
+                sleep(0.05)
+        if pending:
+            print("PLCs " + ', '.join(str(i) for i in pending) + " did not answer within " + str(args.timeout) + "s")
+            return
+
+        measuring = Event()
+        stop = Event()
+        clients = [LoadClient(ports[i % num_of_plc], args.protocol, mix, args.address, args.count, 0, args.seed + i, measuring, stop) for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        sleep(args.warmup)
+
+        probe_start = dict((i, read_register(ports[i], args.protocol, probes[i])) for i in range(num_of_plc))
+        cpu_start = sum(cpu_seconds(p.pid) for p in procs)
+        measuring.set()
+        window_start = time()
+        sleep(args.duration)
+        measuring.clear()
+        window = time() - window_start
+        cpu_used = sum(cpu_seconds(p.pid) for p in procs) - cpu_start
+        probe_end = dict((i, read_register(ports[i], args.protocol, probes[i])) for i in range(num_of_plc))
+        rss_total = sum(rss_kb(p.pid) for p in procs)
+        stop.set()
+        for client in clients:
+            client.join(3)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+        devnull.close()
+        shutil.rmtree(work_dir)
+
+    functions = []
+    total_requests = 0
+    for fc, weight in mix:
+        latencies = sorted(sum((client.latencies[fc] for client in clients), []))
+        errors = sum(client.errors[fc] for client in clients)
+        total_requests += len(latencies)
+        result = {'fc': fc, 'name': FUNCTION_NAMES[fc], 'requests': len(latencies), 'errors': errors,
+                  'requests_per_sec': len(latencies) / window}
+        for label, fraction in (('p50_ms', 0.5), ('p99_ms', 0.99), ('p999_ms', 0.999)):
+            value = percentile(latencies, fraction)
+            result[label] = None if value is None else round(value * 1000, 3)
+        functions.append(result)
+        print("fc %-2d %-25s %8d req %9.1f req/s  p50 %8s ms  p99 %8s ms  p999 %8s ms  errors %d" % (fc, FUNCTION_NAMES[fc], result['requests'], result['requests_per_sec'], result['p50_ms'], result['p99_ms'], result['p999_ms'], errors))
+
+    # ticks the probe behaviors ran during the window vs. how many fit into it: the difference is time lost to lag
+    lags = []
+    for i in range(num_of_plc):
+        if probe_start[i] is not None and probe_end[i] is not None:
+            ticks = (probe_end[i] - probe_start[i]) & 0xFFFF
+            if ticks > 0:
+                lags.append(max(0.0, window / ticks - args.probe_interval))
+    results = {
+        'config': os.path.abspath(args.c), 'mode': args.mode, 'protocol': args.protocol, 'plcs': num_of_plc,
+        'clients': args.clients, 'mix': args.mix, 'event_loop': args.event_loop, 'duration_sec': round(window, 3), 'python': platform.python_version(),
+        'total_requests': total_requests, 'total_requests_per_sec': total_requests / window,
+        'functions': functions,
+        'tick_lag_mean_ms': round(1000 * sum(lags) / len(lags), 3) if lags else None,
+        'tick_lag_max_ms': round(1000 * max(lags), 3) if lags else None,
+        'cpu_percent': round(100 * cpu_used / window, 1), 'rss_total_kb': rss_total,
+    }
+    print("total %d req %.1f req/s  tick lag mean %s ms max %s ms  cpu %.1f%%  rss %d kB" % (total_requests, results['total_requests_per_sec'], results['tick_lag_mean_ms'], results['tick_lag_max_ms'], results['cpu_percent'], rss_total))
+
+    if args.json:
+        out = open(args.json, 'w')
+        json.dump(results, out, indent=2)
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
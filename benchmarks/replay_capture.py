@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Replay a Modbus traffic capture against a PLC fleet
+  Re-issues the requests of a capture (async_plc.py/plc_host.py --capture, see plc/capture.py) against
+  running PLC devices, at the captured pace (--speed 1), N times faster (--speed N) or as fast as
+  the fleet answers (--speed max), over a pool of --connections TCP connections per PLC device.
+  Every captured client connection is replayed on one pooled connection, so its requests keep their order.
+
+  python replay_capture.py --capture plc_0.cap --c ../configs/test_config.yaml --speed 10
+
+  Divergence: each response is compared with the captured one by shape - the function code (an exception
+  response has the high bit set) and the exception code or PDU length; write responses echo the request, so
+  they are compared in full. Read values are not compared, they depend on the behaviors.
+'''
+import sys, os, argparse, json, socket, struct
+import yaml
+from threading import Thread, Lock
+from time import time, sleep
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+from bench_host_modes import PLC_DIR
+from bench_modbus_load import FUNCTION_NAMES, recv_exactly, percentile
+sys.path.insert(0, PLC_DIR)
+from capture import read_capture, REQUEST, RESPONSE
+
+WRITE_FUNCTIONS = (5, 6, 15, 16)
+
+'''
+@brief [time, plc, connection, request frame, captured response frame or None] for every captured request
+- A response belongs to the request with the same transaction id on the same connection
+'''
+def load_exchanges(filename):
+    exchanges = []
+    pending = {}
+    for timestamp, connection, plc_id, kind, payload in read_capture(filename):
+        if kind == REQUEST and len(payload) >= 8:
+            exchange = [timestamp, plc_id, connection, payload, None]
+            exchanges.append(exchange)
+            pending[(connection, payload[:2])] = exchange
+        elif kind == RESPONSE:
+            exchange = pending.pop((connection, payload[:2]), None)
+            if exchange is not None:
+                exchange[4] = payload
+    return exchanges
+
+'''
+@brief what a response is compared by: (function code, exception code) for exceptions, the whole PDU for writes, else (function code, PDU length)
+'''
+def response_shape(frame):
+    pdu = bytearray(frame[7:])
+    if not pdu:
+        return None
+    if pdu[0] & 0x80:
+        return (pdu[0], pdu[1] if len(pdu) > 1 else None)
+    if pdu[0] in WRITE_FUNCTIONS:
+        return bytes(pdu)
+    return (pdu[0], len(pdu))
+
+'''
+@brief one pooled connection: sends the exchanges queued for it, in order, and records latency and divergence per function code
+'''
+class ReplayConnection(Thread):
+
+    def __init__(self, host, port, timeout, report):
+        Thread.__init__(self)
+        self.daemon = True
+        self.address = (host, port)
+        self.timeout = timeout
+        self.report = report
+        self.queue = Queue(maxsize=1024)
+
+    def run(self):
+        sock = None
+        transaction = 0
+        while True:
+            exchange = self.queue.get()
+            if exchange is None:
+                break
+            request, expected = exchange[3], exchange[4]
+            fc = bytearray(request)[7]
+            transaction = (transaction + 1) & 0xFFFF
+            # own transaction ids: captured clients may have reused theirs across what is now one connection
+            request = struct.pack('>H', transaction) + request[2:]
+            try:
+                if sock is None:
+                    sock = socket.create_connection(self.address, self.timeout)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                start = time()
+                sock.sendall(request)
+                header = recv_exactly(sock, 7)
+                response = header + recv_exactly(sock, struct.unpack('>H', header[4:6])[0] - 1)
+                latency = time() - start
+            except (socket.error, socket.timeout):
+                self.report.error(fc)
+                if sock is not None:
+                    sock.close()
+                sock = None
+                continue
+            self.report.result(fc, latency, response_shape(response) == response_shape(expected), exchange, response)
+        if sock is not None:
+            sock.close()
+
+'''
+@brief latencies, divergences and errors per function code, from every pooled connection
+'''
+class ReplayReport(object):
+
+    def __init__(self, examples):
+        self.latencies = {}
+        self.divergences = {}
+        self.errors = {}
+        self.examples = []
+        self.max_examples = examples
+        self._lock = Lock()
+
+    def result(self, fc, latency, matched, exchange, response):
+        with self._lock:
+            self.latencies.setdefault(fc, []).append(latency)
+            if not matched:
+                self.divergences[fc] = self.divergences.get(fc, 0) + 1
+                if len(self.examples) < self.max_examples:
+                    self.examples.append((exchange[1], exchange[2], exchange[3], exchange[4], response))
+
+    def error(self, fc):
+        with self._lock:
+            self.errors[fc] = self.errors.get(fc, 0) + 1
+
+'''
+@brief {plc id: (host, port)} from the master config, or base_port + plc id
+'''
+def plc_addresses(plc_ids, config_filename, host, base_port):
+    addresses = {}
+    config_yaml = None
+    if config_filename:
+        stream = open(config_filename, 'r')
+        config_yaml = yaml.safe_load(stream)
+        stream.close()
+    for plc_id in plc_ids:
+        if config_yaml is not None:
+            addresses[plc_id] = (host, int(config_yaml['PLC ' + str(plc_id)]['SERVER']['port']))
+        else:
+            addresses[plc_id] = (host, base_port + plc_id)
+    return addresses
+
+def hexlify(frame):
+    return ' '.join('%02x' % b for b in bytearray(frame)) if frame is not None else '-'
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay a Modbus traffic capture against a PLC fleet")
+    parser.add_argument("--capture", required = True, help = "Capture file written by async_plc.py/plc_host.py --capture")
+    parser.add_argument("--c", "--config_filename", default = None, help = "Master config to take the PLC ports from (else --base_port + PLC id)")
+    parser.add_argument("--host", default = '127.0.0.1', help = "Host the PLC devices listen on")
+    parser.add_argument("--base_port", type = int, default = 5020, help = "Port of PLC 0 without --c")
+    parser.add_argument("--speed", default = '1', help = "Replay pace: 1 as captured, N times faster, or 'max'")
+    parser.add_argument("--connections", type = int, default = 4, help = "Pooled connections per PLC device")
+    parser.add_argument("--timeout", type = float, default = 2, help = "Seconds to wait for a response")
+    parser.add_argument("--examples", type = int, default = 5, help = "Divergent exchanges to print")
+    parser.add_argument("--json", help = "Also write the results to this file")
+    args = parser.parse_args()
+    speed = None if args.speed == 'max' else float(args.speed)
+
+    exchanges = load_exchanges(args.capture)
+    # a request the captured server did not answer would only time out
+    unanswered = sum(1 for exchange in exchanges if exchange[4] is None)
+    exchanges = [exchange for exchange in exchanges if exchange[4] is not None]
+    if not exchanges:
+        print("No answered requests in " + args.capture)
+        return
+    addresses = plc_addresses(sorted(set(exchange[1] for exchange in exchanges)), args.c, args.host, args.base_port)
+
+    report = ReplayReport(args.examples)
+    pools = {}
+    for plc_id, (host, port) in addresses.items():
+        pools[plc_id] = [ReplayConnection(host, port, args.timeout, report) for i in range(args.connections)]
+        for connection in pools[plc_id]:
+            connection.start()
+
+    # dispatch at the captured offsets (scaled by speed); late is how far behind the schedule dispatching fell
+    capture_start = exchanges[0][0]
+    start = time()
+    late = 0.0
+    for exchange in exchanges:
+        if speed is not None:
+            wait = start + (exchange[0] - capture_start) / speed - time()
+            if wait > 0:
+                sleep(wait)
+            else:
+                late = max(late, -wait)
+        pool = pools[exchange[1]]
+        pool[exchange[2] % len(pool)].queue.put(exchange)
+    for pool in pools.values():
+        for connection in pool:
+            connection.queue.put(None)
+    for pool in pools.values():
+        for connection in pool:
+            connection.join()
+    elapsed = time() - start
+
+    capture_span = exchanges[-1][0] - capture_start
+    total = sum(len(latencies) for latencies in report.latencies.values())
+    functions = []
+    for fc in sorted(set(report.latencies) | set(report.errors)):
+        latencies = sorted(report.latencies.get(fc, []))
+        result = {'fc': fc, 'name': FUNCTION_NAMES.get(fc, 'fc_' + str(fc)), 'requests': len(latencies),
+                  'divergences': report.divergences.get(fc, 0), 'errors': report.errors.get(fc, 0)}
+        for label, fraction in (('p50_ms', 0.5), ('p99_ms', 0.99), ('p999_ms', 0.999)):
+            value = percentile(latencies, fraction)
+            result[label] = None if value is None else round(value * 1000, 3)
+        functions.append(result)
+        print("fc %-2d %-25s %8d req  p50 %8s ms  p99 %8s ms  p999 %8s ms  divergences %d  errors %d" % (fc, result['name'], result['requests'], result['p50_ms'], result['p99_ms'], result['p999_ms'], result['divergences'], result['errors']))
+    divergences = sum(report.divergences.values())
+    print("total %d req in %.2fs (%.1f req/s), captured over %.2fs: %.1fx, max dispatch lag %.3fs, %d divergences, %d errors, %d unanswered in the capture skipped"
+          % (total, elapsed, total / elapsed, capture_span, capture_span / elapsed if elapsed else 0, late, divergences, sum(report.errors.values()), unanswered))
+    for plc_id, connection, request, expected, response in report.examples:
+        print("divergence on PLC %d (captured connection %d)\n  request  %s\n  captured %s\n  replayed %s" % (plc_id, connection, hexlify(request), hexlify(expected), hexlify(response)))
+
+    if args.json:
+        stream = open(args.json, 'w')
+        json.dump({'capture': args.capture, 'speed': args.speed, 'connections': args.connections, 'functions': functions,
+                   'requests': total, 'seconds': elapsed, 'capture_seconds': capture_span, 'max_dispatch_lag': late,
+                   'divergences': divergences, 'unanswered': unanswered}, stream, indent=2)
+        stream.close()
+    if divergences:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
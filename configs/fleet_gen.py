@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Bulk config generator for large PLC fleets
+- Reads a fleet spec and streams the master config one section at a time to disk, writing the backup_N.yaml of every
+  PLC device next to it (what startup/master.py would otherwise create), so memory stays at one PLC section
+    python fleet_gen.py fleet_spec_example.yaml fleet_config.yaml --backup_dir /usr/local/bin/scadasim_pymodbus_plc/backups
+- Fleet spec (see fleet_spec_example.yaml):
+    MASTER: copied into the config; num_of_PLC is set to the size of the fleet
+    TEMPLATES: {name: PLC section}
+    FLEET: [{template: name, count: N, base_port: P}, ...] - PLC ids are handed out in order
+- Every string in a template may use {expressions} of
+    i     the PLC id
+    n     the index of the PLC device in its FLEET group
+    port  base_port + n
+    r     the register index, inside a 'values' or 'behaviors' generator
+  A string that is a single {expression} becomes its value (e.g. port: '{port}' is an int), others are formatted
+- Generators, in a DATASTORE table:
+    values: {count: N, value: <value or expression>}            N initial values
+    behaviors: {behavior: {...}, count: N, first: 1}            behavior_<first>..behavior_<first+N-1>, one per register
+                                                                (count defaults to the number of values)
+  Coils without a behavior get {'type': 'none'}; every holding register needs one
+- The spec is trusted input: expressions are evaluated with Python's eval, without builtins
+- Sections are written by a small emitter of its own (block mappings down to the DATASTORE tables, flow style below,
+  strings quoted JSON style unless plain is unambiguous): PyYAML's representer would take most of the run time
+'''
+import sys, os, re, json, argparse
+from time import time
+import yaml
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+TABLES = ('co', 'di', 'hr', 'ir')
+EXPRESSION = re.compile(r'\{([^{}]+)\}')
+# strings written without quotes: words of letters, digits and '_', separated by single spaces (e.g. 'PLC 0', 'behavior_1')
+PLAIN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*( [A-Za-z0-9_]+)*$')
+RESERVED = set(['true', 'false', 'yes', 'no', 'on', 'off', 'y', 'n', 'null'])
+# mappings below the DATASTORE tables (behaviors) are written in flow style, one per line
+BLOCK_DEPTH = 4
+NAMES = {'__builtins__': {}, 'min': min, 'max': max, 'abs': abs, 'int': int}
+
+_compiled = {}
+
+def evaluate(expression, variables):
+    code = _compiled.get(expression)
+    if code is None:
+        code = _compiled[expression] = compile(expression, '<fleet spec>', 'eval')
+    return eval(code, NAMES, variables)
+
+'''
+@brief a copy of a template value with every {expression} evaluated
+'''
+def render(value, variables):
+    if isinstance(value, dict):
+        return dict((key, render(item, variables)) for key, item in value.items())
+    if isinstance(value, list):
+        return [render(item, variables) for item in value]
+    if isinstance(value, string_types) and '{' in value:
+        whole = EXPRESSION.match(value)
+        if whole is not None and whole.end() == len(value):
+            return evaluate(whole.group(1), variables)
+        return EXPRESSION.sub(lambda match: str(evaluate(match.group(1), variables)), value)
+    return value
+
+'''
+@brief render one DATASTORE table, expanding its 'values' and 'behaviors' generators
+'''
+def render_table(name, table, variables):
+    table = dict(table)
+    generator = table.pop('behaviors', None)
+    values = table.get('values', [])
+    if isinstance(values, dict):
+        del table['values']
+    rendered = render(table, variables)
+    if isinstance(values, dict):
+        value = values.get('value', 0)
+        if isinstance(value, string_types):
+            rendered['values'] = [render(value, dict(variables, r=r)) for r in range(values['count'])]
+        else:
+            rendered['values'] = [value] * values['count']
+    if generator is not None:
+        first = generator.get('first', 1)
+        for r in range(generator.get('count', len(rendered['values']))):
+            rendered['behavior_' + str(first + r)] = render(generator['behavior'], dict(variables, r=r))
+    for k in range(1, len(rendered['values']) + 1):
+        if 'behavior_' + str(k) not in rendered:
+            if name == 'hr':
+                raise ValueError("PLC %d: holding register %d has no behavior" % (variables['i'], k))
+            if name == 'co':
+                rendered['behavior_' + str(k)] = {'type': 'none'}
+    return rendered
+
+def render_plc(template, variables):
+    section = {}
+    for key, value in template.items():
+        if key == 'DATASTORE':
+            section[key] = dict((name, render_table(name, table, variables) if name in TABLES else render(table, variables)) for name, table in value.items())
+        else:
+            section[key] = render(value, variables)
+    return section
+
+'''
+@brief yields (PLC id, PLC section) for every PLC device of the fleet spec
+'''
+def fleet_sections(spec):
+    templates = spec.get('TEMPLATES', {})
+    i = 0
+    for group in spec['FLEET']:
+        if group['template'] not in templates:
+            raise ValueError("FLEET uses unknown template '" + str(group['template']) + "'")
+        template = templates[group['template']]
+        for n in range(group['count']):
+            yield i, render_plc(template, {'i': i, 'n': n, 'port': group.get('base_port', 5020) + n})
+            i += 1
+
+_strings = {}
+
+def scalar(value):
+    # registers and addresses: the common case, checked first (bool is a subclass of int, so this is exact)
+    if type(value) is int:
+        return str(value)
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value is None:
+        return 'null'
+    if isinstance(value, string_types):
+        # keys and behavior types repeat on every PLC device
+        text = _strings.get(value)
+        if text is None:
+            text = value if PLAIN.match(value) and value.lower() not in RESERVED else json.dumps(value)
+            if len(_strings) < 65536:
+                _strings[value] = text
+        return text
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def flow(value):
+    if isinstance(value, dict):
+        return '{' + ', '.join(scalar(key) + ': ' + flow(value[key]) for key in sorted(value, key=str)) + '}'
+    if isinstance(value, list):
+        return '[' + ', '.join(flow(item) for item in value) + ']'
+    return scalar(value)
+
+'''
+@brief write a mapping as YAML, in block style for the first BLOCK_DEPTH levels and flow style below
+'''
+def dump(mapping, stream, depth=0):
+    indent = '  ' * depth
+    for key in sorted(mapping, key=str):
+        value = mapping[key]
+        if isinstance(value, dict) and value and depth + 1 < BLOCK_DEPTH:
+            stream.write(indent + scalar(key) + ':\n')
+            dump(value, stream, depth + 1)
+        else:
+            stream.write(indent + scalar(key) + ': ' + flow(value) + '\n')
+
+'''
+@brief write the master config of a fleet spec to config_filename, and the backups to backup_dir (unless None)
+- Returns the number of PLC devices
+'''
+def generate(spec, config_filename, backup_dir=None):
+    num_of_plc = sum(group['count'] for group in spec['FLEET'])
+    if backup_dir is not None and not os.path.isdir(backup_dir):
+        os.makedirs(backup_dir)
+    tmp_filename = config_filename + '.tmp'
+    stream = open(tmp_filename, 'w')
+    try:
+        dump({'MASTER': dict(spec.get('MASTER', {}), num_of_PLC=num_of_plc)}, stream)
+        for i, section in fleet_sections(spec):
+            dump({'PLC ' + str(i): section}, stream)
+            if backup_dir is not None:
+                # the layout master.py writes: start addresses and values only
+                datastore = section['DATASTORE']
+                backup = open(os.path.join(backup_dir, 'backup_' + str(i) + '.yaml'), 'w')
+                dump({'DATASTORE': dict((table, {'start_addr': 1, 'values': datastore[table]['values']}) for table in TABLES)}, backup)
+                backup.close()
+    except Exception:
+        stream.close()
+        os.remove(tmp_filename)
+        raise
+    stream.close()
+    os.rename(tmp_filename, config_filename)
+    return num_of_plc
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generate a master config (and its backups) for a fleet of PLC devices from a fleet spec")
+    parser.add_argument("spec", help = "Fleet spec (YAML), see fleet_spec_example.yaml")
+    parser.add_argument("config", help = "Master config file to write")
+    parser.add_argument("--backup_dir", default = '/usr/local/bin/scadasim_pymodbus_plc/backups', help = "Where to write backup_N.yaml for every PLC device")
+    parser.add_argument("--no_backups", action = 'store_true', help = "Only write the config; master.py creates missing backups at startup")
+    args = parser.parse_args()
+
+    stream = open(args.spec, 'r')
+    spec = yaml.load(stream, Loader=LOADER)
+    stream.close()
+    start = time()
+    try:
+        num_of_plc = generate(spec, args.config, None if args.no_backups else args.backup_dir)
+    except (ValueError, KeyError, NameError, SyntaxError) as e:
+        sys.stderr.write("Invalid fleet spec " + args.spec + ": " + str(e) + "\n")
+        sys.exit(1)
+    print("Wrote " + str(num_of_plc) + " PLC devices to " + args.config + " in %.1fs" % (time() - start))
+
+if __name__ == "__main__":
+    main()
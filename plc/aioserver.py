@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+asyncio server mode for a PLC device, set with 'event_loop' in its SERVER section
+- event_loop: asyncio (or uvloop, if installed) runs the Modbus TCP/UDP listener, the register behaviors and the backup writer
+  as callbacks on one event loop in the main thread, instead of the Twisted reactor, the scheduler thread and the backup thread
+- The TCP protocol has the request path of server.py (response cache, traffic capture, metrics), on an asyncio transport
+- Behaviors run on a LoopScheduler: the BehaviorScheduler's heap, deadlines, policies and stats (see scheduler.py), driven by
+  loop timers instead of a worker thread; at most 'batch' steps run back to back before the loop gets back to I/O
+- Needs Python 3 (uvloop is optional); serial servers, and the PLC devices of plc_host.py and sharded supervisor workers, always
+  run on the Twisted reactor
+'''
+import logging
+from time import time
+from pymodbus.exceptions import NoSuchSlaveException
+from pymodbus.pdu import ModbusExceptions as merror
+from scheduler import BehaviorScheduler
+from server import PLCRequestHandler, PLCServerFactory, response_cache, report_cache
+try:
+    import asyncio
+except ImportError:
+    # Python 2: only the Twisted reactor is available
+    asyncio = None
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+EVENT_LOOPS = ('asyncio', 'uvloop')
+
+_log = logging.getLogger('server')
+
+'''
+@brief a new event loop of the kind named by 'event_loop' in the SERVER section, set as the current loop
+- uvloop falls back to the asyncio loop (with a warning) when it is not installed
+'''
+def new_event_loop(name, log=None):
+    log = log or _log
+    if name not in EVENT_LOOPS:
+        raise ValueError("Unknown event_loop '" + str(name) + "' (one of " + ', '.join(EVENT_LOOPS) + ")")
+    if asyncio is None:
+        raise RuntimeError("event_loop needs Python 3 (asyncio) - remove it from the SERVER section to use the Twisted reactor")
+    if name == 'uvloop' and uvloop is None:
+        log.warning("event_loop uvloop is not installed - using the asyncio event loop")
+        name = 'asyncio'
+    loop = uvloop.new_event_loop() if name == 'uvloop' else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+'''
+@brief call function(*args) every 'interval' seconds on the loop
+'''
+def repeat(loop, interval, function, *args):
+    def call():
+        function(*args)
+        loop.call_later(interval, call)
+    return loop.call_later(interval, call)
+
+'''
+LoopScheduler is a BehaviorScheduler whose behaviors are stepped by loop callbacks instead of a worker thread
+- A timer is set for the earliest deadline (or the next rate report); add() and wake() move it forward when needed
+- With a discrete clock the clock jumps to the next deadline and the steps run one batch per loop iteration
+'''
+class LoopScheduler(BehaviorScheduler):
+
+    def __init__(self, loop, log=None, report_interval=60, clock=None, policy='catch_up', batch=64):
+        BehaviorScheduler.__init__(self, log, report_interval, clock, policy)
+        self.loop = loop
+        self.batch = batch
+        self._timer = None
+        self._pending = False
+
+    def start(self):
+        self._running = True
+        self._start_report()
+        self._wakeup()
+
+    def stop(self):
+        self._running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _wakeup(self):
+        # one run for the wakeups of many add()/wake() calls in a row; wake() may come from other threads
+        if not self._pending:
+            self._pending = True
+            self.loop.call_soon_threadsafe(self._run_due)
+
+    def _run_due(self):
+        self._pending = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._running:
+            return
+        for _ in range(self.batch):
+            entry, fire_at = self._pop_due()
+            if entry is None:
+                break
+            self._service(entry[0], entry[2], entry[3], entry[4], entry[5])
+            self.serviced += 1
+        else:
+            # more may be due: continue after the loop has handled the I/O that is ready
+            self._report()
+            self._wakeup()
+            return
+        self._report()
+        timeout = self._timeout(fire_at)
+        if timeout is not None:
+            self._timer = self.loop.call_later(timeout, self._run_due)
+
+    '''
+    @brief wall seconds until the earliest behavior (due at fire_at, sim time) or the report is due, or None if neither is
+    '''
+    def _timeout(self, fire_at):
+        timeout = None
+        if fire_at is not None:
+            if self.clock.discrete:
+                self.clock.advance_to(fire_at)
+                timeout = 0
+            else:
+                timeout = self.clock.real_seconds(fire_at - self.clock.now())
+        report_at = self._report_at()
+        if report_at is not None:
+            timeout = report_at - time() if timeout is None else min(timeout, report_at - time())
+        return None if timeout is None else max(timeout, 0)
+
+'''
+@brief execute a decoded request on the factory's datastore, as pymodbus' servers do; returns the response, or None for no response
+'''
+def execute_request(factory, request):
+    try:
+        response = request.execute(factory.store[request.unit_id])
+    except NoSuchSlaveException:
+        _log.debug("requested slave does not exist: %s" % request.unit_id)
+        if factory.ignore_missing_slaves:
+            # the client will simply time out waiting for a response
+            return None
+        response = request.doException(merror.GatewayNoResponse)
+    except Exception as e:
+        _log.debug("Datastore unable to fulfill request: %s" % e)
+        response = request.doException(merror.SlaveFailure)
+    response.transaction_id = request.transaction_id
+    response.unit_id = request.unit_id
+    return response
+
+class LoopTcpProtocol(PLCRequestHandler, asyncio.Protocol if asyncio else object):
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.framer = self.factory.framer(decoder=self.factory.decoder, client=None)
+        peer = transport.get_extra_info('peername')
+        self._connected(peer[0], peer[1])
+
+    def connection_lost(self, exc):
+        self._disconnected()
+
+    def data_received(self, data):
+        self._received(data)
+
+    def _process(self, data):
+        if not self.factory.control.ListenOnly:
+            store = self.factory.store
+            self.framer.processIncomingPacket(data, self._execute, single=store.single, unit=store.slaves())
+
+    def _run(self, request):
+        response = execute_request(self.factory, request)
+        if response is not None:
+            self._send(response)
+
+class LoopUdpProtocol(asyncio.DatagramProtocol if asyncio else object):
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.framer = factory.framer(decoder=factory.decoder, client=None)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.factory.control.ListenOnly:
+            return
+        store = self.factory.store
+        self.framer.processIncomingPacket(data, lambda request: self._execute(request, addr), single=store.single, unit=store.slaves())
+
+    def _execute(self, request, addr):
+        response = execute_request(self.factory, request)
+        if response is not None and response.should_respond:
+            self.factory.control.Counter.BusMessage += 1
+            self.transport.sendto(self.framer.buildPacket(response), addr)
+
+'''
+@brief listen for Modbus TCP on address (interface, port) with the loop - server.listen_tcp for the asyncio server mode
+'''
+def listen_tcp(loop, context, address, framer=None, identity=None, metrics=None, plc_id=0, cache_size=None, report_interval=60, capture=None):
+    cache = response_cache(cache_size, metrics, plc_id)
+    if cache is not None and report_interval:
+        repeat(loop, report_interval, report_cache, cache, plc_id, _log)
+    factory = PLCServerFactory(context, framer, identity, metrics, plc_id, cache, capture)
+    return loop.run_until_complete(loop.create_server(lambda: LoopTcpProtocol(factory), address[0], int(address[1])))
+
+'''
+@brief listen for Modbus UDP on address (interface, port) with the loop, with the socket framer like pymodbus' StartUdpServer
+'''
+def listen_udp(loop, context, address, identity=None):
+    factory = PLCServerFactory(context, None, identity)
+    transport, protocol = loop.run_until_complete(loop.create_datagram_endpoint(lambda: LoopUdpProtocol(factory), local_addr=(address[0], int(address[1]))))
+    return transport
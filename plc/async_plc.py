@@ -36,11 +36,11 @@ Asynchronous PyModbus Server with Client Functionality
 # import the modbus libraries we need
 # --------------------------------------------------------------------------- #
 from pymodbus.server.asynchronous import StartSerialServer
-from pymodbus.server.asynchronous import StartTcpServer
 from pymodbus.server.asynchronous import StartUdpServer
+from twisted.internet import reactor
 from pymodbus.device import ModbusDeviceIdentification
 from pymodbus.datastore import ModbusSequentialDataBlock
-from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.datastore import ModbusServerContext
 from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer, ModbusBinaryFramer
 
 # --------------------------------------------------------------------------- #
@@ -48,83 +48,248 @@ from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer, ModbusBinar
 # --------------------------------------------------------------------------- #
 from datastore import *
 from helper import *
+from scheduler import BehaviorScheduler
+from datablock import make_datablock
+from journal import open_journal, restore_datastore, parse_restore_time
+from metrics import Metrics, start_metrics_server, metrics_config
+from server import listen_tcp
+import aioserver
+from capture import TrafficCapture
+from logqueue import install_log_handler
+from simclock import make_clock
+from regtrace import TraceRecorder, trace_filename, replay_trace
+from configcache import load_sections
+from sharedregs import open_shared_registers
 from time import *
 from threading import Thread
 import logging, yaml
 import sys, os, argparse
 
 
+BACKUP_DIR = '/usr/local/bin/scadasim_pymodbus_plc/backups/'
+
 '''
-@brief reads from backup, initializes the datastore, starts the backup thread and the register behavior threads, then starts the server
+@brief reads from backup and builds the server context for one PLC device
+- Returns the ModbusServerContext to hand to the backup/behavior threads and the server
+- 'datablock: array' in the DATASTORE section selects the array-backed datablocks from datablock.py instead of list-backed ModbusSequentialDataBlocks
+- 'format: mmap' in the BACKUP section restores from (and mirrors every write into) the memory-mapped backup_N.state file instead of backup_N.yaml
+- A datastore_config passed in (e.g. restored from the change journal) is used instead of the backup
+- With a UNITS section the context serves one slave context per unit id instead (see build_units_context)
 '''
-def run_updating_server(config_list, backup_filename, log):
+def build_plc_context(config_list, backup_filename, datastore_config=None):
+    units = unit_datastores(config_list)
+    if units is not None:
+        return build_units_context(config_list, backup_filename, units)
+
     # ----------------------------------------------------------------------- # 
     # initialize your data store
     # ----------------------------------------------------------------------- # 
     # Run datastore_backup_on_start to use the most recent values of the datablocks, as the layout in the master config will only reflect initial values
     # If this is the first time this is used, the backup file will match up with what is laid out in the master config (due to master.py)
-    datastore_config = datastore_backup_on_start(backup_filename)
+    live_state = None
+    if config_list.get('BACKUP', {}).get('format', 'yaml') == 'mmap':
+        if datastore_config is not None:
+            live_state = LiveStateFile.create(state_filename_for(backup_filename), datastore_config)
+        else:
+            live_state = live_state_on_start(backup_filename)
+        datastore_config = -1 if live_state == -1 else live_state.to_datastore_config()
+    elif datastore_config is None:
+        datastore_config = datastore_backup_on_start(backup_filename)
     if datastore_config == -1:
-        print("Issue with backup file - either not created or empty. Exiting program.")
+        print("Issue with backup file (" + backup_filename + ") - either not created or empty. Exiting program.")
         sys.exit()
     
-    store = ModbusSlaveContext(
-        di=ModbusSequentialDataBlock(datastore_config['di']['start_addr'], datastore_config['di']['values']),
-        co=ModbusSequentialDataBlock(datastore_config['co']['start_addr'], datastore_config['co']['values']),
-        hr=ModbusSequentialDataBlock(datastore_config['hr']['start_addr'], datastore_config['hr']['values']),
-        ir=ModbusSequentialDataBlock(datastore_config['ir']['start_addr'], datastore_config['ir']['values']))
-    # Could have multiple slaves, with their own addressing. Since we have 1 PLC device handled by every async_plc.py, it is not necessary
-    context = ModbusServerContext(slaves=store, single=True)
+    kind = config_list['DATASTORE'].get('datablock', 'list')
+    store = PLCSlaveContext(
+        di=make_datablock('di', datastore_config['di']['start_addr'], datastore_config['di']['values'], kind),
+        co=make_datablock('co', datastore_config['co']['start_addr'], datastore_config['co']['values'], kind),
+        hr=make_datablock('hr', datastore_config['hr']['start_addr'], datastore_config['hr']['values'], kind),
+        ir=make_datablock('ir', datastore_config['ir']['start_addr'], datastore_config['ir']['values'], kind))
+    store.live_state = live_state
+    if live_state is not None:
+        store.write_hooks.append(live_state.write)
+    # Could have multiple slaves, with their own addressing. Without a UNITS section every unit id maps to the one slave context
+    return ModbusServerContext(slaves=store, single=True)
 
+'''
+@brief builds a ModbusServerContext(single=False) with one slave context per unit id of the UNITS section
+- Every unit starts from its own entry under UNITS in the backup, or from the DATASTORE written by master.py (its own DATASTORE section for units that have one) the first time
+- The mmap live state and the change journal only cover single unit PLC devices, so these are always backed up to backup_N.yaml
+'''
+def build_units_context(config_list, backup_filename, units):
+    if config_list.get('BACKUP', {}).get('format', 'yaml') == 'mmap':
+        print("BACKUP format mmap does not support UNITS - backing up to " + backup_filename + " instead")
+    backup = units_backup_on_start(backup_filename)
+    if backup == -1:
+        print("Issue with backup file (" + backup_filename + ") - either not created or empty. Exiting program.")
+        sys.exit()
+    unit_backups, default_datastore = backup
+
+    kind = config_list['DATASTORE'].get('datablock', 'list')
+    slaves = {}
+    for slave_id, unit_config in units:
+        datastore_config = unit_backups.get(slave_id)
+        if datastore_config is None:
+            datastore_config = default_datastore if unit_config is config_list['DATASTORE'] else unit_config
+        slaves[slave_id] = PLCSlaveContext(
+            di=make_datablock('di', datastore_config['di']['start_addr'], datastore_config['di']['values'], kind),
+            co=make_datablock('co', datastore_config['co']['start_addr'], datastore_config['co']['values'], kind),
+            hr=make_datablock('hr', datastore_config['hr']['start_addr'], datastore_config['hr']['values'], kind),
+            ir=make_datablock('ir', datastore_config['ir']['start_addr'], datastore_config['ir']['values'], kind))
+        slaves[slave_id].live_state = None
+    return ModbusServerContext(slaves=slaves, single=False)
+
+'''
+@brief adds the PLC device's writes to the change journal
+- Not available for PLC devices with a UNITS section, whose journal records would not say which unit was written
+'''
+def attach_journal(journal, plc_id, context):
+    if context.single:
+        journal.attach(plc_id, context[0])
+    else:
+        print("The change journal does not cover UNITS - PLC " + str(plc_id) + " is only backed up to its backup file")
+
+'''
+@brief starts the backup thread and schedules the register behaviors for one PLC device
+- Behaviors run on the given scheduler; if none is given, a scheduler is created for this PLC device, with the 'policy' of the
+    SCHEDULER section for behaviors that fall behind (see scheduler.py), and started once all of its behaviors are added -
+    with a discrete clock a running scheduler advances sim time, so behaviors added later would start at arbitrary offsets
+- The optional BACKUP section sets how often the backup thread checks for changes ('interval') and how long a change may stay unsaved ('max_staleness'), in seconds
+- With metrics (metrics.Metrics), datastore lock waits and the execution time of every behavior are recorded under plc_id
+- Behaviors and the backup thread run on the scheduler's SimClock; a scheduler created here uses 'clock' (realtime if not given)
+- simulation is the 'simulation' dict of the MASTER section: 'seed' seeds the random behaviors, 'record'/'replay' record the
+    datastore writes to a trace or drive the datastore from one instead of the behaviors (see regtrace.py)
+- With shared (sharedregs.SharedRegisters), the PLC device's tables are exported to shared memory for the behaviors of other PLC devices
+- With backup_on_scheduler=True the backups are written by a behavior on the scheduler instead of the backup thread (asyncio server mode, see aioserver.py)
+'''
+def start_plc_threads(context, config_list, backup_filename, log, scheduler=None, metrics=None, plc_id=0, clock=None, simulation=None, shared=None, backup_on_scheduler=False):
+    simulation = simulation or {}
+    if scheduler is not None:
+        clock = scheduler.clock
+    elif clock is None:
+        clock = make_clock(None)
     # setup a thread with target as datastore_backup_to_yaml to start here, before other threads
-    #     this will continuously read from the context to write to a backup yaml file
-    backup_thread = Thread(target=datastore_backup_to_yaml, args=(context, backup_filename))
-    backup_thread.daemon = True
-    backup_thread.start()
+    #     this will continuously read the changed parts of the context to write to a backup yaml file
+    backup_config = config_list.get('BACKUP', {})
+    interval = backup_config.get('interval', 1)
+    max_staleness = backup_config.get('max_staleness', interval)
+    live_state = context[0].live_state if context.single else None
+    if not backup_on_scheduler:
+        if live_state is not None:
+            backup_thread = Thread(target=datastore_backup_to_state, args=(context, live_state, interval, clock))
+        else:
+            backup_thread = Thread(target=datastore_backup_to_yaml, args=(context, backup_filename, interval, max_staleness, clock))
+        backup_thread.daemon = True
+        backup_thread.start()
  
-    # start register behaviors. Updating writer is started off, which will spawn a thread for every holding register based on the config
-    thread = Thread(target=updating_writer, args=(context, config_list, time, log, backup_filename))
-    thread.daemon = True
-    thread.start()
+    # start register behaviors. Updating writer adds a behavior to the scheduler for every holding register based on the config
+    start_scheduler = scheduler is None
+    if start_scheduler:
+        scheduler = BehaviorScheduler(log, clock=clock, policy=scheduler_policy(config_list))
+    if backup_on_scheduler:
+        if live_state is not None:
+            scheduler.add('backup', state_backup_steps(context, live_state, interval), log)
+        else:
+            scheduler.add('backup', yaml_backup_steps(context, backup_filename, interval, max_staleness, clock), log)
+    behavior_stats = None
+    if metrics is not None:
+        metrics.attach(plc_id, context)
+        behavior_stats = lambda name: metrics.behavior(plc_id, name)
+    if shared is not None:
+        shared.export(plc_id, context)
+    if simulation.get('replay'):
+        scheduler.add('replay', replay_trace(context, trace_filename(simulation['replay'], plc_id), log), log)
+    else:
+        if simulation.get('record'):
+            TraceRecorder(trace_filename(simulation['record'], plc_id), clock).attach(context)
+        behavior_rng = None
+        if simulation.get('seed') is not None:
+            behavior_rng = behavior_rng_factory(simulation['seed'], plc_id)
+        updating_writer(context, config_list, time, log, backup_filename, scheduler, behavior_stats, behavior_rng, shared)
+    if start_scheduler:
+        scheduler.start()
+    return scheduler
 
-    # Starting the server
-    server_config = config_list['SERVER']
+'''
+@brief starts the server for one PLC device based on the SERVER section of its config
+- With defer_reactor_run=True the listener is only registered with the reactor, so several PLC devices can share one reactor.run()
+- TCP servers record per request metrics under plc_id when given metrics (see server.py)
+- 'response_cache: <entries>' in the SERVER section answers repeated TCP reads from a cache of encoded responses (see server.py)
+- capture (capture.TrafficCapture), if given, records the requests and responses of a TCP server
+- With an asyncio event loop (see aioserver.py) a TCP or UDP server listens on the loop, and the loop is run instead of the reactor
+'''
+def start_plc_server(context, server_config, identity=None, defer_reactor_run=False, metrics=None, plc_id=0, capture=None, loop=None):
     framer = configure_server_framer(server_config)
-    if server_config['type'] == 'serial':
-        StartSerialServer(context, port=server_config['port'], framer=framer)
+    if loop is not None and server_config['type'] in ('tcp', 'udp'):
+        address = (server_config['address'], int(server_config['port']))
+        if server_config['type'] == 'udp':
+            aioserver.listen_udp(loop, context, address, identity=identity)
+        else:
+            aioserver.listen_tcp(loop, context, address, framer=framer, identity=identity, metrics=metrics, plc_id=plc_id,
+                                 cache_size=server_config.get('response_cache'), capture=capture)
+        if not defer_reactor_run:
+            loop.run_forever()
+    elif server_config['type'] == 'serial':
+        StartSerialServer(context, port=server_config['port'], framer=framer, defer_reactor_run=defer_reactor_run)
     elif server_config['type'] == 'udp':
-        StartUdpServer(context, identity=identity, address=(server_config['address'], int(server_config['port'])))
+        StartUdpServer(context, identity=identity, address=(server_config['address'], int(server_config['port'])), defer_reactor_run=defer_reactor_run)
     elif server_config['type'] == 'tcp':
-        if server_config['framer'] == 'RTU':
-            StartTcpServer(context, identity=identity, address=(server_config['address'], int(server_config['port'])), framer=framer)
-        else:
-            StartTcpServer(context, address=(server_config['address'], int(server_config['port'])))
+        listen_tcp(context, (server_config['address'], int(server_config['port'])), framer=framer, identity=identity, metrics=metrics, plc_id=plc_id,
+                   cache_size=server_config.get('response_cache'), capture=capture)
+        if not defer_reactor_run:
+            reactor.run()
 
 '''
-@brief parse args, handle master config, setup logging, then call run_updating_server
+@brief restores one PLC device's datastore from the change journal, or returns None to fall back to its backup
+- restore_ts is 'latest', a unix timestamp or 'YYYY-mm-dd HH:MM:SS'
 '''
-def main():
-    # --- BEGIN argparse handling ---
-    parser = argparse.ArgumentParser(description = "Main program for PLC device based off PyModbus")
-    parser.add_argument("--n", "--num_of_PLC", help = "The number of the PLC device")
-    parser.add_argument("--c", "--config_filename", help = "Name of the master config file")
-    args = parser.parse_args()
-    if args.n is None or args.c is None:
-        print("Need to run async_plc.py with --n and --c arguments. Run 'python async_plc.py --h' for help")
-        return
-    print( args )
-    num_of_PLC = args.n
-    master_config_filename = args.c
-    backup_filename = '/usr/local/bin/scadasim_pymodbus_plc/backups/backup_' + args.n + '.yaml'
-    # --- END argparse handling ---
+def journal_datastore_config(master_config, plc_id, restore_ts='latest'):
+    datastore_config = restore_datastore(master_config['journal']['dir'], plc_id, parse_restore_time(restore_ts))
+    if datastore_config == -1:
+        print("No journal checkpoint for PLC " + str(plc_id) + " at " + str(restore_ts) + " - using the backup file")
+        return None
+    print("Restored PLC " + str(plc_id) + " from the journal at " + str(restore_ts))
+    return datastore_config
 
-    stream = open(master_config_filename, 'r')
-    config_list = yaml.safe_load(stream)
-    stream.close()
-    # Only get the current PLC's configuration dictionary
-    config_list = config_list["PLC " + num_of_PLC]
+'''
+@brief reads from backup (or the journal), initializes the datastore, starts the backup thread and the register behavior threads, then starts the server
+'''
+def run_updating_server(config_list, backup_filename, log, journal=None, plc_id=None, datastore_config=None, clock=None, simulation=None, shared=None, capture=None, metrics_endpoint=None):
+    context = build_plc_context(config_list, backup_filename, datastore_config)
+    if journal is not None:
+        attach_journal(journal, plc_id, context)
+        journal.start()
+    # optional Prometheus metrics endpoint, see metrics.py
+    metrics = None
+    if metrics_endpoint:
+        metrics = Metrics()
+        start_metrics_server(metrics, metrics_endpoint, log)
+    # asyncio server mode ('event_loop' in the SERVER section): the server, the behaviors and the backups share one event loop
+    loop = None
+    scheduler = None
+    if config_list['SERVER'].get('event_loop'):
+        if config_list['SERVER']['type'] == 'serial':
+            log.warning("SERVER event_loop does not cover serial servers - using the Twisted reactor")
+        else:
+            loop = aioserver.new_event_loop(config_list['SERVER']['event_loop'], log)
+            scheduler = aioserver.LoopScheduler(loop, log, clock=clock, policy=scheduler_policy(config_list))
+    start_plc_threads(context, config_list, backup_filename, log, scheduler=scheduler, metrics=metrics, plc_id=plc_id, clock=clock, simulation=simulation,
+                      shared=shared, backup_on_scheduler=loop is not None)
+    if scheduler is not None:
+        scheduler.start()
+    # Starting the server
+    start_plc_server(context, config_list['SERVER'], metrics=metrics, plc_id=plc_id, capture=capture, loop=loop)
 
-    # --- BEGIN LOGGING SETUP ---
+'''
+@brief sets up the root logger from the LOGGING section of a PLC config
+- With 'mode: queue', 'output: jsonl' or 'max_bytes' the handler comes from logqueue.py
+'''
+def configure_logging(config_list):
+    if any(key in config_list['LOGGING'] for key in ('mode', 'output', 'max_bytes')):
+        log = logging.getLogger()
+        install_log_handler(log, config_list['LOGGING'])
+        configure_logging_level(config_list['LOGGING']['logging_level'], log)
+        return log
     FORMAT = config_list['LOGGING']['format']
     # Add logic based on whether a file is used or stdout
     #   AND whether a format string is used or not
@@ -140,8 +305,61 @@ def main():
             logging.basicConfig(format=FORMAT, filename=config_list['LOGGING']['file'])
     log = logging.getLogger()
     configure_logging_level(config_list['LOGGING']['logging_level'], log)
+    return log
+
+'''
+@brief sets up logging, restores from the change journal if there is one, then calls run_updating_server for PLC device num_of_PLC
+- Used by main() and by the workers supervisor.py forks
+- capture_filename, if given, records the PLC device's Modbus TCP traffic to that file (see capture.py)
+'''
+def run_plc(num_of_PLC, config_list, master_config, backup_filename, restore_ts=None, capture_filename=None):
+    # --- BEGIN LOGGING SETUP ---
+    log = configure_logging(config_list)
     # --- END LOGGING SETUP ---
-    run_updating_server(config_list, backup_filename, log)
+
+    # the simulation clock ('simulation' in the MASTER section) behaviors, backups and the journal run on, and its seed/record/replay settings
+    clock = make_clock(master_config.get('simulation'))
+    # with a change journal, restore from it (latest state unless --restore_ts says otherwise)
+    journal = open_journal(master_config, 'plc_' + str(num_of_PLC), log, clock)
+    datastore_config = None
+    if journal is not None:
+        datastore_config = journal_datastore_config(master_config, int(num_of_PLC), restore_ts or 'latest')
+    elif restore_ts is not None:
+        print("--restore_ts needs a change journal ('journal' in the MASTER section of the config). Exiting program.")
+        sys.exit()
+    # cross-PLC dependencies through shared memory ('shared_memory' in the MASTER section, see sharedregs.py)
+    shared = open_shared_registers(master_config)
+    capture = TrafficCapture(capture_filename) if capture_filename else None
+    # one metrics endpoint per PLC device process ('metrics' in the MASTER section), on its port + PLC id
+    run_updating_server(config_list, backup_filename, log, journal, int(num_of_PLC), datastore_config, clock, master_config.get('simulation'), shared, capture,
+                        metrics_config(master_config, int(num_of_PLC)))
+
+'''
+@brief parse args, handle master config, then call run_plc
+'''
+def main():
+    # --- BEGIN argparse handling ---
+    parser = argparse.ArgumentParser(description = "Main program for PLC device based off PyModbus")
+    parser.add_argument("--n", "--num_of_PLC", help = "The number of the PLC device")
+    parser.add_argument("--c", "--config_filename", help = "Name of the master config file")
+    parser.add_argument("--b", "--backup_dir", default = BACKUP_DIR, help = "Directory holding the backup_N.yaml files")
+    parser.add_argument("--restore_ts", default = None, help = "With a change journal configured: 'latest' (default) or the time to restore to (unix timestamp or 'YYYY-mm-dd HH:MM:SS')")
+    parser.add_argument("--capture", default = None, help = "Record every Modbus TCP request and response to this capture file (see capture.py)")
+    args = parser.parse_args()
+    if args.n is None or args.c is None:
+        print("Need to run async_plc.py with --n and --c arguments. Run 'python async_plc.py --h' for help")
+        return
+    print( args )
+    num_of_PLC = args.n
+    master_config_filename = args.c
+    backup_filename = os.path.join(args.b, 'backup_' + args.n + '.yaml')
+    # --- END argparse handling ---
+
+    # Only load the MASTER section and the current PLC's configuration dictionary, from the compiled config cache (see configcache.py)
+    config_list = load_sections(master_config_filename, ['MASTER', "PLC " + num_of_PLC])
+    master_config = config_list.get('MASTER', {})
+    config_list = config_list["PLC " + num_of_PLC]
+    run_plc(num_of_PLC, config_list, master_config, backup_filename, args.restore_ts, args.capture)
 
 
 if __name__ == "__main__":
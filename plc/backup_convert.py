@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Converts PLC backups between the YAML format (backup_N.yaml) and the memory-mapped live-state format (backup_N.state)
+  python backup_convert.py backup_0.yaml backup_0.state
+  python backup_convert.py backup_0.state backup_0.yaml
+The direction is taken from the input file's extension.
+'''
+import sys, argparse, yaml
+from livestate import LiveStateFile, TABLES
+
+'''
+@brief backup_N.yaml -> backup_N.state
+'''
+def yaml_to_state(yaml_filename, state_filename):
+    backup = open(yaml_filename, 'r')
+    backup_file = yaml.safe_load(backup)
+    backup.close()
+    LiveStateFile.create(state_filename, backup_file['DATASTORE']).close()
+
+'''
+@brief backup_N.state -> backup_N.yaml, in the same layout master.py writes
+'''
+def state_to_yaml(state_filename, yaml_filename):
+    live_state = LiveStateFile(state_filename, writable=False)
+    datastore = live_state.to_datastore_config()
+    live_state.close()
+    for table in TABLES:
+        datastore[table]['values'] = datastore[table]['values'].tolist()
+    backup = open(yaml_filename, 'w')
+    yaml.dump({'DATASTORE': datastore}, backup, default_flow_style=False)
+    backup.close()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert PLC backups between backup_N.yaml and backup_N.state")
+    parser.add_argument("input", help = "backup file to read (.yaml or .state)")
+    parser.add_argument("output", help = "backup file to write")
+    args = parser.parse_args()
+    if args.input.endswith('.state'):
+        state_to_yaml(args.input, args.output)
+    elif args.input.endswith('.yaml') or args.input.endswith('.yml'):
+        yaml_to_state(args.input, args.output)
+    else:
+        print("Input must be a .yaml or .state backup file")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
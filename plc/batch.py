@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Batch evaluation of register behaviors
+- Behaviors of the same type, 'time' and slave are collected into one group whose per-register
+  parameters live in NumPy arrays
+- Every tick a group reads its registers with one getValues per contiguous run (one call if the group's
+  registers are contiguous), updates all of them with a few NumPy operations, and writes them back with
+  one setValues per run
+- Only linear, random and linear_coil_dependent are batched; the other behaviors stay on the scheduler as
+  generators (see helper.py)
+- NumPy is optional: without it, updating_writer keeps scheduling every behavior on its own
+'''
+from bisect import bisect_right
+from datastore import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BATCH_TYPES = ('linear', 'random', 'linear_coil_dependent')
+
+'''
+BehaviorGroup holds the behaviors of one type/time/slave and the index arrays used to evaluate them together
+- 'index' maps every register a behavior covers to its position in the concatenated run values
+- 'starts' holds the position of every behavior's first register, for reduceat/first-register updates
+'''
+class BehaviorGroup(object):
+
+    def __init__(self, behavior_type, time, slave_id):
+        self.behavior_type = behavior_type
+        self.time = time
+        self.slave_id = slave_id
+        self.behaviors = []
+
+    def add(self, name, config):
+        self.behaviors.append((name, config))
+
+    '''
+    @brief build the NumPy arrays once all behaviors have been added
+    '''
+    def compile(self):
+        ranges = [(int(config['address']), int(config['count'])) for name, config in self.behaviors]
+        self.runs = merge_ranges(ranges)
+        run_addresses = [address for address, count in self.runs]
+        offsets = []
+        position = 0
+        for address, count in self.runs:
+            offsets.append(position)
+            position += count
+        index = []
+        starts = []
+        counts = []
+        for address, count in ranges:
+            run = bisect_right(run_addresses, address) - 1
+            first = offsets[run] + address - run_addresses[run]
+            starts.append(len(index))
+            counts.append(count)
+            index.extend(range(first, first + count))
+        self.index = numpy.array(index, dtype=numpy.intp)
+        self.starts = numpy.array(starts, dtype=numpy.intp)
+        self.counts = numpy.array(counts, dtype=numpy.intp)
+        self.params = {}
+        for key in self.param_names:
+            self.params[key] = numpy.array([config[key] for name, config in self.behaviors], dtype=numpy.int64)
+
+    def read_runs(self, context):
+        values = []
+        for address, count in self.runs:
+            values.extend(read_hr_register(context, self.slave_id, address, count))
+        return numpy.array(values, dtype=numpy.int64)
+
+    def write_runs(self, context, values):
+        position = 0
+        for address, count in self.runs:
+            write_hr_register(context, self.slave_id, address, values[position:position + count].tolist())
+            position += count
+
+    def tick(self, context, log):
+        # one read-modify-write for the whole group, atomic with respect to client writes
+        with locked(slave_context(context, self.slave_id)):
+            values = self.read_runs(context)
+            self.update(context, values)
+            self.write_runs(context, values)
+        log.debug("%s group (time %s): %d registers updated", self.behavior_type, self.time, len(self.index))
+
+'''
+linear: add 'variance' to every register of every behavior
+'''
+class LinearGroup(BehaviorGroup):
+    param_names = ('variance',)
+
+    def update(self, context, values):
+        numpy.add.at(values, self.index, numpy.repeat(self.params['variance'], self.counts))
+
+'''
+random: draw one value in [min, max] per behavior and set all of its registers to it
+'''
+class RandomGroup(BehaviorGroup):
+    param_names = ('min', 'max')
+
+    def compile(self):
+        BehaviorGroup.compile(self)
+        self.rng = numpy.random.RandomState()
+
+    def seed(self, rng):
+        self.rng = numpy.random.RandomState(rng.randint(0, 0xffffffff))
+
+    def update(self, context, values):
+        # scaled uniform draws: RandomState.randint only takes per-behavior bounds from numpy 1.17 on
+        span = self.params['max'] - self.params['min'] + 1
+        draws = self.params['min'] + (self.rng.random_sample(len(span)) * span).astype(numpy.int64)
+        values[self.index] = numpy.repeat(draws, self.counts)
+
+'''
+linear_coil_dependent: same rules as helper.linear_coil_dependent, for every behavior at once
+- coil in default state: first register += variance, clamped to max once it has reached max
+- otherwise: every register -= variance (not below 0), but only if all of the behavior's registers are above 0
+'''
+class LinearCoilDependentGroup(BehaviorGroup):
+    param_names = ('variance', 'max', 'coil_address', 'default_coil_value')
+
+    def compile(self):
+        BehaviorGroup.compile(self)
+        self.coil_runs = merge_ranges([(int(address), 1) for address in self.params['coil_address']])
+        coil_positions = {}
+        position = 0
+        for address, count in self.coil_runs:
+            for i in range(count):
+                coil_positions[address + i] = position + i
+            position += count
+        self.coil_index = numpy.array([coil_positions[int(address)] for address in self.params['coil_address']], dtype=numpy.intp)
+
+    def update(self, context, values):
+        coils = []
+        for address, count in self.coil_runs:
+            coils.extend(read_co_register(context, self.slave_id, address, count))
+        coils = numpy.array(coils, dtype=numpy.int64)[self.coil_index]
+        normal = coils == self.params['default_coil_value']
+
+        first = self.index[self.starts]
+        first_values = values[first]
+        raised = numpy.where(first_values >= self.params['max'], self.params['max'], first_values + self.params['variance'])
+        values[first[normal]] = raised[normal]
+
+        all_above_0 = numpy.minimum.reduceat(values[self.index], self.starts) > 0
+        lowered = ~normal & all_above_0
+        if lowered.any():
+            registers = numpy.repeat(lowered, self.counts)
+            numpy.subtract.at(values, self.index[registers], numpy.repeat(self.params['variance'], self.counts)[registers])
+            values[self.index[registers]] = numpy.maximum(values[self.index[registers]], 0)
+
+GROUP_TYPES = {
+    'linear': LinearGroup,
+    'random': RandomGroup,
+    'linear_coil_dependent': LinearCoilDependentGroup,
+}
+
+'''
+BatchEngine collects batchable behaviors from updating_writer and hands one generator per group to the scheduler
+'''
+class BatchEngine(object):
+
+    def __init__(self):
+        self.groups = {}
+
+    '''
+    @brief returns True if the behavior was taken by a group, False if it has to be scheduled on its own
+    '''
+    def add(self, slave_id, name, config):
+        behavior_type = config['type']
+        # behaviors following a coil of another PLC device read it from shared memory on their own
+        if numpy is None or behavior_type not in BATCH_TYPES or config.get('coil_plc') is not None:
+            return False
+        key = (behavior_type, config['time'], slave_id)
+        if key not in self.groups:
+            self.groups[key] = GROUP_TYPES[behavior_type](behavior_type, config['time'], slave_id)
+        self.groups[key].add(name, config)
+        return True
+
+    '''
+    @brief one scheduler entry per group; behavior_log(name) gives each its logger, behavior_stats(name) its metrics.BehaviorStats
+    - behavior_rng(name), if given, seeds the random draws of the group (see helper.behavior_rng_factory)
+    '''
+    def schedule(self, scheduler, context, behavior_log, behavior_stats=None, behavior_rng=None):
+        for key in sorted(self.groups):
+            group = self.groups[key]
+            group.compile()
+            name = '%s x%d every %ss' % (group.behavior_type, len(group.behaviors), group.time)
+            if group.slave_id != 0x00:
+                name = 'unit %d %s' % (group.slave_id, name)
+            if behavior_rng is not None and hasattr(group, 'seed'):
+                group.seed(behavior_rng(name))
+            log = behavior_log(name)
+            scheduler.add(name, batch_group(group, context, log), log, stats=behavior_stats and behavior_stats(name))
+
+'''
+batch_group() ticks a whole group every 'time' seconds
+'''
+def batch_group(group, context, log):
+    while(True):
+        yield group.time
+        group.tick(context, log)
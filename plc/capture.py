@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Modbus traffic capture
+- Started with '--capture <file>' on async_plc.py or plc_host.py: the TCP server (server.py) writes every request
+  it receives and every response it sends, as whole Modbus TCP frames (MBAP header + PDU), to the capture file
+- benchmarks/replay_capture.py re-issues a capture against a PLC fleet and compares the responses
+
+File layout: HEADER (magic, version), then records of RECORD followed by 'length' bytes of payload:
+    time        float64  unix timestamp the frame was received/sent
+    connection  uint32   client connection, numbered from 1 in the order they connected
+    plc         uint16   PLC id of the server the connection belongs to
+    kind        uint8    REQUEST, RESPONSE, CONNECT (payload: 'host:port' of the client) or DISCONNECT
+    length      uint16   payload bytes
+All fields little endian. Records are buffered and flushed every 'flush_interval' seconds and at exit.
+'''
+import os, struct, atexit
+from time import time
+
+MAGIC = b'SCADACAP'
+VERSION = 1
+HEADER = struct.Struct('<8sH')
+RECORD = struct.Struct('<dIHBH')
+
+REQUEST, RESPONSE, CONNECT, DISCONNECT = 0, 1, 2, 3
+KIND_NAMES = {REQUEST: 'request', RESPONSE: 'response', CONNECT: 'connect', DISCONNECT: 'disconnect'}
+
+# length field of the MBAP header: bytes following it (unit id + PDU)
+MBAP_SIZE = 7
+
+'''
+TrafficCapture writes the records of one capture file
+- Only called from the reactor thread, so it needs no lock
+'''
+class TrafficCapture(object):
+
+    def __init__(self, filename, flush_interval=1.0):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.flush_interval = flush_interval
+        self.connections = 0
+        self._flushed = time()
+        atexit.register(self.close)
+
+    '''
+    @brief number a new client connection of PLC plc_id and record it; peer is the client's (host, port)
+    '''
+    def connect(self, plc_id, peer):
+        self.connections += 1
+        self.record(CONNECT, self.connections, plc_id, ('%s:%s' % peer).encode('ascii'))
+        return self.connections
+
+    def record(self, kind, connection, plc_id, payload):
+        if self.file.closed:
+            return
+        current = time()
+        self.file.write(RECORD.pack(current, connection, plc_id, kind, len(payload)) + payload)
+        if current - self._flushed >= self.flush_interval:
+            self.file.flush()
+            self._flushed = current
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+'''
+FrameSplitter cuts the byte stream of one connection into whole Modbus TCP frames
+'''
+class FrameSplitter(object):
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= MBAP_SIZE:
+            end = MBAP_SIZE - 1 + struct.unpack('>H', self.buffer[4:6])[0]
+            if len(self.buffer) < end:
+                break
+            frames.append(self.buffer[:end])
+            self.buffer = self.buffer[end:]
+        return frames
+
+'''
+@brief yields (time, connection, plc, kind, payload) for every record of a capture file
+- Raises ValueError if the file is not a capture; a record cut short at the end (capture still running) is dropped
+'''
+def read_capture(filename):
+    stream = open(filename, 'rb')
+    try:
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+            raise ValueError(filename + " is not a traffic capture")
+        if HEADER.unpack(header)[1] != VERSION:
+            raise ValueError(filename + " is capture version " + str(HEADER.unpack(header)[1]) + ", expected " + str(VERSION))
+        while True:
+            head = stream.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            timestamp, connection, plc_id, kind, length = RECORD.unpack(head)
+            payload = stream.read(length)
+            if len(payload) < length:
+                return
+            yield timestamp, connection, plc_id, kind, payload
+    finally:
+        stream.close()
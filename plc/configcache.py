@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+'''
+Compiled master config cache
+- compile_config() parses and validates the master YAML config once and writes a compiled copy next to it
+  (<config>.py<N>.cache, one per Python major version): every top level section ('MASTER', 'PLC 0', ...) dumped
+  on its own as YAML, behind an index of section offsets
+- load_sections() then reads only the sections a process needs (async_plc.py: MASTER and its own PLC section)
+  with one seek per section, instead of every PLC process parsing the whole YAML file
+- The cache is valid while the config's mtime and size match the ones it was compiled from; if they differ, the
+  config's sha1 is compared with the compiled one, and only a changed config is recompiled
+- If the cache cannot be written (e.g. a read-only config directory), the config is parsed directly
+- The cache is plain data loaded with the safe YAML loader, like the config itself, and is only used if it is owned by
+  the current user and not writable by group or others - otherwise the config is parsed directly
+
+Cache layout: header (magic, version, config mtime, config size, config sha1, index length), the YAML
+index {section name: [offset, length]}, then the YAML sections.
+'''
+import os, sys, stat, struct, hashlib
+import yaml
+
+MAGIC = b'SCADACFG'
+VERSION = 2
+HEADER = struct.Struct('<8sIdQ20sI')
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+def _dump(data):
+    return yaml.dump(data, Dumper=YAML_DUMPER, default_flow_style=True).encode('utf-8')
+
+def _load(data):
+    return yaml.load(data.decode('utf-8'), Loader=YAML_LOADER)
+
+def cache_filename_for(config_filename):
+    return config_filename + '.py' + str(sys.version_info[0]) + '.cache'
+
+def _config_sha1(config_filename):
+    config_file = open(config_filename, 'rb')
+    try:
+        return hashlib.sha1(config_file.read()).digest()
+    finally:
+        config_file.close()
+
+'''
+@brief checks the parts of the master config every PLC process relies on, raising ValueError for the first problem found
+'''
+def validate_config(config_yaml):
+    if not isinstance(config_yaml, dict) or not isinstance(config_yaml.get('MASTER'), dict):
+        raise ValueError("The config has no MASTER section")
+    num_of_plc = config_yaml['MASTER'].get('num_of_PLC')
+    if not isinstance(num_of_plc, int) or num_of_plc < 0:
+        raise ValueError("MASTER num_of_PLC must be a non-negative integer")
+    for i in range(num_of_plc):
+        plc_device_name = 'PLC ' + str(i)
+        section = config_yaml.get(plc_device_name)
+        if not isinstance(section, dict):
+            raise ValueError("The config has no '" + plc_device_name + "' section (MASTER num_of_PLC is " + str(num_of_plc) + ")")
+        for key in ('DATASTORE', 'LOGGING', 'SERVER'):
+            if key not in section:
+                raise ValueError(plc_device_name + " has no " + key + " section")
+        for table in ('co', 'di', 'hr', 'ir'):
+            if not isinstance(section['DATASTORE'].get(table, {}).get('values'), list):
+                raise ValueError(plc_device_name + " DATASTORE has no '" + table + "' values list")
+        if 'type' not in section['SERVER'] or 'port' not in section['SERVER']:
+            raise ValueError(plc_device_name + " SERVER needs a type and a port")
+
+'''
+@brief parses and validates the master config, writes its compiled cache and returns the parsed config
+- Returns the config even if the cache could not be written
+'''
+def compile_config(config_filename, cache_filename=None):
+    cache_filename = cache_filename or cache_filename_for(config_filename)
+    config_file = open(config_filename, 'rb')
+    try:
+        content = config_file.read()
+        config_stat = os.fstat(config_file.fileno())
+    finally:
+        config_file.close()
+    config_yaml = yaml.load(content, Loader=YAML_LOADER)
+    validate_config(config_yaml)
+
+    index = {}
+    sections = []
+    offset = 0
+    for name in sorted(config_yaml, key=str):
+        data = _dump(config_yaml[name])
+        index[name] = [offset, len(data)]
+        sections.append(data)
+        offset += len(data)
+    index_data = _dump(index)
+    header = HEADER.pack(MAGIC, VERSION, config_stat.st_mtime, config_stat.st_size, hashlib.sha1(content).digest(), len(index_data))
+
+    # write and rename, so PLC processes never read a half written cache
+    tmp_cache = cache_filename + '.' + str(os.getpid()) + '.tmp'
+    try:
+        # readable by the PLC processes, writable by this user only (see _trusted)
+        cache = os.fdopen(os.open(tmp_cache, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), 'wb')
+        try:
+            cache.write(header)
+            cache.write(index_data)
+            for data in sections:
+                cache.write(data)
+        finally:
+            cache.close()
+        os.rename(tmp_cache, cache_filename)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Could not write the config cache " + cache_filename + ": " + str(e) + "\n")
+        if os.path.exists(tmp_cache):
+            os.remove(tmp_cache)
+    return config_yaml
+
+'''
+@brief True if the open cache file is owned by the current user and not writable by group or others
+'''
+def _trusted(cache):
+    cache_stat = os.fstat(cache.fileno())
+    return cache_stat.st_uid == os.getuid() and not cache_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+'''
+@brief opens the cache of config_filename and returns (cache file, index, offset of the first section), or None if it is missing, stale or not trusted
+'''
+def _open_cache(config_filename, cache_filename):
+    try:
+        cache = open(cache_filename, 'rb')
+    except (IOError, OSError):
+        return None
+    if not _trusted(cache):
+        sys.stderr.write("Not using the config cache " + cache_filename + ": it is not owned by this user or is writable by others\n")
+        cache.close()
+        return None
+    header = cache.read(HEADER.size)
+    if len(header) == HEADER.size:
+        magic, version, mtime, size, sha1, index_length = HEADER.unpack(header)
+        config_stat = os.stat(config_filename)
+        if magic == MAGIC and version == VERSION:
+            if (config_stat.st_mtime == mtime and config_stat.st_size == size) or _config_sha1(config_filename) == sha1:
+                index = _load(cache.read(index_length))
+                return cache, index, HEADER.size + index_length
+    cache.close()
+    return None
+
+'''
+@brief returns {name: section} for the requested top level sections of the master config, from its compiled cache
+- The cache is (re)compiled first if it is missing or stale; sections the config does not have are left out
+'''
+def load_sections(config_filename, names, cache_filename=None):
+    cache_filename = cache_filename or cache_filename_for(config_filename)
+    opened = _open_cache(config_filename, cache_filename)
+    if opened is None:
+        config_yaml = compile_config(config_filename, cache_filename)
+        return dict((name, config_yaml[name]) for name in names if name in config_yaml)
+    cache, index, base = opened
+    try:
+        sections = {}
+        for name in names:
+            if name in index:
+                offset, length = index[name]
+                cache.seek(base + offset)
+                sections[name] = _load(cache.read(length))
+        return sections
+    finally:
+        cache.close()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Array-backed datablocks for the PLC datastore
+- Drop-in replacements for ModbusSequentialDataBlock (same constructor, validate/getValues/setValues)
+- ArrayDataBlock keeps registers in an array('H'): 2 bytes per register instead of a list of boxed ints,
+  so a full 65536 register address space costs 128 kB
+    - getValues returns a memoryview slice of the array (no copy); on Python 2, where array has no
+      buffer interface, it returns an array slice instead
+    - values are stored as unsigned 16 bit, so writes are clamped to 0..65535 (a negative value is stored as 0,
+      not wrapped around to 65535)
+- BitDataBlock keeps coils/discrete inputs in a packed bitset: 8 kB for 65536 bits
+    - getValues returns a list of 0/1 ints, since single bits cannot be sliced out of the bitset
+    - any non-zero value is stored as 1
+- Both accept bulk writes from a buffer with setValuesFromBuffer
+'''
+import sys
+from array import array
+from pymodbus.datastore.store import BaseModbusDataBlock, ModbusSequentialDataBlock
+
+try:
+    memoryview(array('H'))
+    ARRAY_HAS_BUFFER = True
+except TypeError:
+    ARRAY_HAS_BUFFER = False
+
+'''
+@brief array('H') from a sequence of ints, clamping every value to 0..65535
+'''
+def to_register_array(values):
+    if isinstance(values, array) and values.typecode == 'H':
+        return values
+    return array('H', [min(max(int(v), 0), 0xFFFF) for v in values])
+
+class ArrayDataBlock(BaseModbusDataBlock):
+    ''' Sequential register datablock backed by array('H') '''
+
+    def __init__(self, address, values):
+        self.address = address
+        if hasattr(values, '__iter__'):
+            self.values = array('H', to_register_array(values))
+        else:
+            self.values = to_register_array([values])
+        self.default_value = 0
+        self._view = memoryview(self.values) if ARRAY_HAS_BUFFER else self.values
+
+    @classmethod
+    def create(klass, size=65536):
+        return klass(0x00, array('H', [0]) * size)
+
+    def reset(self):
+        self.values[:] = array('H', [self.default_value]) * len(self.values)
+
+    def validate(self, address, count=1):
+        return self.address <= address and self.address + len(self.values) >= address + count
+
+    def getValues(self, address, count=1):
+        start = address - self.address
+        return self._view[start:start + count]
+
+    def setValues(self, address, values):
+        if not hasattr(values, '__iter__'):
+            values = [values]
+        start = address - self.address
+        # never grow the array - it may be exported through memoryviews
+        values = to_register_array(values)[:len(self.values) - start]
+        self.values[start:start + len(values)] = values
+
+    '''
+    @brief bulk write of native-endian uint16 values straight from a buffer (bytes, bytearray, mmap slice, ...)
+    '''
+    def setValuesFromBuffer(self, address, buf):
+        values = array('H')
+        if sys.version_info[0] >= 3:
+            values.frombytes(buf)
+        else:
+            values.fromstring(bytes(buf))
+        self.setValues(address, values)
+
+    '''
+    @brief the raw table as native-endian uint16 bytes
+    '''
+    def tobytes(self):
+        return self.values.tobytes() if sys.version_info[0] >= 3 else self.values.tostring()
+
+class BitDataBlock(BaseModbusDataBlock):
+    ''' Sequential coil/discrete input datablock backed by a packed bitset (bit i of byte i // 8 is address + i) '''
+
+    def __init__(self, address, values):
+        self.address = address
+        if not hasattr(values, '__iter__'):
+            values = [values]
+        values = list(values)
+        self.size = len(values)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.default_value = 0
+        self.setValues(address, values)
+
+    @classmethod
+    def create(klass, size=65536):
+        return klass(0x00, [0] * size)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return enumerate(self.getValues(self.address, self.size), self.address)
+
+    def __str__(self):
+        return "BitDataBlock(%d)" % self.size
+
+    def reset(self):
+        self.bits[:] = bytearray(len(self.bits))
+
+    def validate(self, address, count=1):
+        return self.address <= address and self.address + self.size >= address + count
+
+    def getValues(self, address, count=1):
+        start = address - self.address
+        bits = self.bits
+        return [(bits[i >> 3] >> (i & 7)) & 1 for i in range(start, min(start + count, self.size))]
+
+    def setValues(self, address, values):
+        if not hasattr(values, '__iter__'):
+            values = [values]
+        start = address - self.address
+        bits = self.bits
+        for i, value in enumerate(values, start):
+            if i >= self.size:
+                break
+            if value and value != 'false':
+                bits[i >> 3] |= 1 << (i & 7)
+            else:
+                bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    '''
+    @brief bulk write of 'count' bits packed LSB first (Modbus coil order) from a buffer
+    '''
+    def setValuesFromBuffer(self, address, buf, count=None):
+        buf = bytearray(buf)
+        if count is None:
+            count = len(buf) * 8
+        start = address - self.address
+        if start & 7 == 0 and count & 7 == 0:
+            self.bits[start >> 3:(start + count) >> 3] = buf[:count >> 3]
+        else:
+            self.setValues(address, [(buf[i >> 3] >> (i & 7)) & 1 for i in range(count)])
+
+    '''
+    @brief the raw bitset as bytes
+    '''
+    def tobytes(self):
+        return bytes(self.bits)
+
+'''
+@brief build the datablock for one table ('di', 'co', 'hr' or 'ir') of the given kind ('array' or 'list')
+'''
+def make_datablock(table, start_addr, values, kind='list'):
+    if kind == 'array':
+        if table in ('co', 'di'):
+            return BitDataBlock(start_addr, values)
+        return ArrayDataBlock(start_addr, values)
+    return ModbusSequentialDataBlock(start_addr, values)
@@ -29,30 +29,273 @@
 
 '''
 - Helper functions to read from/write to the datastore
-- ***NOTE***: Read/write wrapper functions only support when ModbusServerContext is setup with single=True
-	- Will be looking at implementing to allow for single=False
+- The wrappers take either a ModbusServerContext or one slave context
+	- Given a ModbusServerContext they route by slave_id (one dict lookup), so single=False contexts serving many unit ids work too
+	- With single=True every slave_id maps to the one slave context
 - Datastore is broken down into the following:
 	- di - discrete input - read only, boolean - 2
 	- co - coil output - read and write, boolean - 1
 	- hr - holding register - read and write - 3
 	- ir - input register - read only - 4
+- With the array-backed datablocks (datablock.py), register reads return memoryview slices of the live table
+	- Copy them (list(values)) before holding on to them past the next write
+	- Writes accept any sequence of ints, including arrays and memoryviews
 '''
 
+from threading import Lock, RLock
+from time import time
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+
+def slave_context(context, slave_id):
+  if isinstance(context, ModbusServerContext):
+    return context[slave_id]
+  return context
+
+'''
+- [(slave_id, slave context)] of every Modbus unit served by a ModbusServerContext, sorted by unit id (slave_id 0 when single=True)
+'''
+def plc_slaves(context):
+  return sorted(context, key=lambda item: item[0])
+
 def read_di_register(context, slave_id, addr, count):
-  return context.getValues(2, addr, count)
+  return slave_context(context, slave_id).getValues(2, addr, count)
 
 def read_co_register(context, slave_id, addr, count):
-  return context.getValues(1, addr, count)
+  return slave_context(context, slave_id).getValues(1, addr, count)
 
 def write_co_register(context, slave_id, addr, values):
-  return context.setValues(1, addr, values)
+  return slave_context(context, slave_id).setValues(1, addr, values)
 
 def read_hr_register(context, slave_id, addr, count):
-  return context.getValues(3, addr, count)
+  return slave_context(context, slave_id).getValues(3, addr, count)
 
 def write_hr_register(context, slave_id, addr, values):
-  return context.setValues(3, addr, values)
+  return slave_context(context, slave_id).setValues(3, addr, values)
 
 def read_ir_register(context, slave_id, addr, count):
-  return context.getValues(4, addr, count)
+  return slave_context(context, slave_id).getValues(4, addr, count)
+
+'''
+- Atomic read-modify-write: fn gets a list copy of the values and returns the values to write (or None to write nothing)
+- Returns what fn returned, so behaviors can log it
+- A client write can not land between the read and the write (see PLCSlaveContext.update)
+'''
+def update_co_register(context, slave_id, addr, count, fn):
+  return update_register(slave_context(context, slave_id), 1, addr, count, fn)
+
+def update_hr_register(context, slave_id, addr, count, fn):
+  return update_register(slave_context(context, slave_id), 3, addr, count, fn)
+
+def update_register(context, fx, addr, count, fn):
+  if hasattr(context, 'update'):
+    return context.update(fx, addr, count, fn)
+  # plain ModbusSlaveContext - no lock to take
+  values = fn(list(context.getValues(fx, addr, count)))
+  if values is not None:
+    context.setValues(fx, addr, values)
+  return values
+
+'''
+- Calls callback(table, address, values) after every write overlapping count values of 'table' at addr (see PLCSlaveContext.observe)
+'''
+def observe_registers(context, slave_id, table, addr, count, callback):
+  return slave_context(context, slave_id).observe(table, addr, count, callback)
+
+'''
+- Consistent copy of several whole tables: {table: [values]} for tables such as ('co', 'di', 'hr', 'ir')
+'''
+def snapshot_registers(context, slave_id, tables):
+  context = slave_context(context, slave_id)
+  if hasattr(context, 'snapshot'):
+    ranges = context.snapshot(dict((table, [(0x00, context.table_size(table))]) for table in tables))
+    return dict((table, ranges[table][0][1]) for table in tables)
+  return dict((table, list(context.getValues(TABLE_FX[table], 0x00, len(context.store[table[0]].values)))) for table in tables)
+
+'''
+- Reentrant lock that reports how long contended acquisitions waited to on_wait(seconds), if set (see metrics.py)
+- An uncontended acquisition costs one non-blocking try
+- sequence is odd while the lock is held: bumped on the outermost acquire and release, so everything written
+  under one hold (several setValues of a batch group tick, an update()) is one change to a sequence lock reader
+'''
+class WriteLock(object):
+  def __init__(self):
+    self._lock = RLock()
+    self.on_wait = None
+    self.sequence = 0
+    self._depth = 0
+
+  def acquire(self):
+    if not self._lock.acquire(False):
+      start = time()
+      self._lock.acquire()
+      if self.on_wait is not None:
+        self.on_wait(time() - start)
+    if self._depth == 0:
+      self.sequence += 1
+    self._depth += 1
+    return True
+
+  def release(self):
+    self._depth -= 1
+    if self._depth == 0:
+      self.sequence += 1
+    self._lock.release()
+
+  def __enter__(self):
+    return self.acquire()
+
+  def __exit__(self, *args):
+    self.release()
+    return False
+
+class _NoLock(object):
+  def __enter__(self):
+    return self
+  def __exit__(self, *args):
+    return False
 
+'''
+- The slave context's write lock, for code that needs several reads/writes to be atomic (a no-op for plain ModbusSlaveContexts)
+'''
+def locked(context):
+  return getattr(context, 'write_lock', _NoLock())
+
+
+'''
+- Table name to function code, in the same order the wrappers above use
+'''
+TABLE_FX = {'di': 2, 'co': 1, 'hr': 3, 'ir': 4}
+
+# above this many separate dirty ranges, a table is tracked as one covering range
+MAX_DIRTY_RANGES = 64
+
+'''
+PLCSlaveContext is the slave context used by async_plc.py/plc_host.py
+- Every setValues (client write or behavior write) bumps the table's generation counter and records the written range as dirty
+- take_dirty() hands the dirty ranges to the backup writer, so it only re-reads and re-serializes what changed
+- write_hooks are called as hook(table, address, values) after every write (e.g. LiveStateFile.write to mirror writes into the mmap'ed state file)
+- observe() registers a callback(table, address, values) on an address range of one table; it is called after every write
+  that overlaps the range (e.g. to wake an event driven behavior, see helper.py) and should only hand the event on
+- Writes are serialized by write_lock and bracketed by its sequence counter (odd while the lock is held, see WriteLock):
+	- update() holds the lock across read, modify and write, so a concurrent client write is never lost
+	- snapshot() reads several tables without taking the lock and retries if the sequence moved (a sequence lock),
+	  so plain reads stay cheap and only fall back to the lock when writers keep interfering; it never sees part
+	  of the writes made under one hold of the lock
+'''
+class PLCSlaveContext(ModbusSlaveContext):
+
+  def __init__(self, *args, **kwargs):
+    ModbusSlaveContext.__init__(self, *args, **kwargs)
+    self.generation = dict((table, 0) for table in TABLE_FX)
+    self.dirty = dict((table, []) for table in TABLE_FX)
+    self._dirty_lock = Lock()
+    self._fx_table = dict((fx, table) for table, fx in TABLE_FX.items())
+    self.write_hooks = []
+    self.observers = dict((table, []) for table in TABLE_FX)
+    self.write_lock = WriteLock()
+
+  def table_name(self, fx):
+    table = self._fx_table.get(fx)
+    if table is None:
+      # any other write function code (5, 6, 15, 16, ...) maps onto one of the four tables
+      table = {'d': 'di', 'c': 'co', 'h': 'hr', 'i': 'ir'}[self.decode(fx)]
+    return table
+
+  def table_size(self, table):
+    block = self.store[table[0]]
+    return len(block) if hasattr(block, '__len__') else len(block.values)
+
+  def setValues(self, fx, address, values):
+    if not hasattr(values, '__len__'):
+      values = [values]
+    table = self.table_name(fx)
+    with self.write_lock:
+      ModbusSlaveContext.setValues(self, fx, address, values)
+      self.mark_dirty(table, address, len(values))
+      for hook in self.write_hooks:
+        hook(table, address, values)
+    observers = self.observers[table]
+    if observers:
+      end = address + len(values)
+      for start, stop, callback in observers:
+        if start < end and address < stop:
+          callback(table, address, values)
+
+  '''
+  @brief calls callback(table, address, values) after every write to 'table' that overlaps [address, address + count); returns a handle for unobserve()
+  '''
+  def observe(self, table, address, count, callback):
+    observer = (address, address + count, callback)
+    # copy on write, so setValues can iterate without a lock
+    self.observers[table] = self.observers[table] + [observer]
+    return (table, observer)
+
+  def unobserve(self, handle):
+    table, observer = handle
+    self.observers[table] = [o for o in self.observers[table] if o is not observer]
+
+  '''
+  @brief atomic read-modify-write of count values at address: fn(list of values) returns the values to write, or None to write nothing
+  '''
+  def update(self, fx, address, count, fn):
+    with self.write_lock:
+      values = fn(list(self.getValues(fx, address, count)))
+      if values is not None:
+        self.setValues(fx, address, values)
+    return values
+
+  '''
+  @brief consistent read of several ranges: {table: [(address, count), ...]} -> {table: [(address, [values]), ...]}
+  '''
+  def snapshot(self, ranges, retries=3):
+    for attempt in range(retries):
+      sequence = self.write_lock.sequence
+      if sequence & 1 == 0:
+        result = self._read_ranges(ranges)
+        if self.write_lock.sequence == sequence:
+          return result
+    # writers kept interfering - read under the lock instead
+    with self.write_lock:
+      return self._read_ranges(ranges)
+
+  def _read_ranges(self, ranges):
+    result = {}
+    for table, table_ranges in ranges.items():
+      fx = TABLE_FX[table]
+      result[table] = [(address, list(self.getValues(fx, address, count))) for address, count in table_ranges]
+    return result
+
+  def mark_dirty(self, table, address, count):
+    with self._dirty_lock:
+      self.generation[table] += 1
+      ranges = self.dirty[table]
+      ranges.append((address, count))
+      if len(ranges) > MAX_DIRTY_RANGES:
+        self.dirty[table] = merge_ranges(ranges)
+        if len(self.dirty[table]) > MAX_DIRTY_RANGES:
+          start = self.dirty[table][0][0]
+          end = self.dirty[table][-1][0] + self.dirty[table][-1][1]
+          self.dirty[table] = [(start, end - start)]
+
+  '''
+  @brief returns {table: [(address, count), ...]} for every table written since the last call, and clears it
+  '''
+  def take_dirty(self):
+    with self._dirty_lock:
+      dirty = dict((table, merge_ranges(ranges)) for table, ranges in self.dirty.items() if ranges)
+      for table in dirty:
+        self.dirty[table] = []
+    return dirty
+
+'''
+- @brief sort and merge overlapping/adjacent (address, count) ranges
+'''
+def merge_ranges(ranges):
+  merged = []
+  for address, count in sorted(ranges):
+    if merged and address <= merged[-1][0] + merged[-1][1]:
+      end = max(merged[-1][0] + merged[-1][1], address + count)
+      merged[-1] = (merged[-1][0], end - merged[-1][0])
+    else:
+      merged.append((address, count))
+  return merged
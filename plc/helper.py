@@ -37,335 +37,435 @@ These functions accept:
     maximom value
     slave context
 
-These functions return:
-    a set of values to be written to the slave context
+These functions are generators:
+    every 'yield' hands the number of seconds until the next step back to the BehaviorScheduler (see scheduler.py),
+    which runs every behavior of a PLC device from one worker thread instead of one thread per register
+
+Every read-modify-write of a step is done atomically (update_hr_register or 'with locked(...)', see datastore.py),
+    so a value written by a Modbus client between the read and the write is not lost
 '''
-import sys, logging, yaml
+import os, sys, logging, yaml, zlib
 from os import path
-from threading import Thread
 from time import *
 from random import *
 from datastore import *
+from batch import BatchEngine, numpy
+from livestate import LiveStateFile, state_filename_for
+from logqueue import behavior_log_factory
+from simclock import SimClock
+from scenario import scenario_behavior, scenario_for
 from pymodbus.transaction import (ModbusRtuFramer,
                                   ModbusAsciiFramer,
                                   ModbusBinaryFramer)
 
 '''
 linear() will update registers/coils in a linear function
-- It will continue to run until it receives 'ctrl+c' KeyboardInterrupt
+- It will continue to run until the scheduler is stopped
 '''
 
 def linear(variance, time, address, slave_id, count, context, log, my_backup): 
-    try:
-        while(True):
-            sleep(time)
-            values = read_hr_register(context[0], slave_id, address, count)
-            values = [v + variance for v in values]
-            write_hr_register(context[0], slave_id, address, values)
-            log.debug(values)
-    except:
-        sys.exit()
+    def step(values):
+        return [v + variance for v in values]
+    while(True):
+        yield time
+        values = update_hr_register(context, slave_id, address, count, step)
+        log.debug(values)
 
 '''
 linear_coil_dependent() will update registers/coils in a linear function until it reaches the max value specified
-- Currently will not decrement if it will fall below 0
+- Will not decrement below 0: a step that would go below 0 writes 0, and the next one sees 0 and stops
 - Also will not increment if it goes past max
-- It will continue to run until it receives 'ctrl+c' KeyboardInterrupt
+- It will continue to run until the scheduler is stopped
 - If the coil matches what the default_coil_value is, it will continue to add variance to the holding register normally
 - Otherwise, it will negate the variance and add it to the holding register
 - The holding register will be checked every 'time' seconds
+- read_coil, if given, reads the coil instead (e.g. of another PLC device, see coil_reader); a step is skipped while it returns None
+- event_driven: once the holding register rests (at max, or at/below 0), the behavior parks in the scheduler instead of
+  polling, until a write to the coil (or the holding register) wakes it - see schedule_behaviors
 '''
-def linear_coil_dependent(variance, max, time, address, slave_id, count, context, log, my_backup, coil_address, default_coil_value):
-    try:
-        while(True):
-            sleep(time)
-            coil_reg = read_co_register(context[0], slave_id, coil_address, 1)
-            # the datastore helper functions return a list, even if it is just one register being read
-            coil_reg = coil_reg[0]
-            # check the state of the coil
-            if coil_reg == "false" or int(coil_reg) == 0:
-                coil_val = 0
-            elif coil_reg == "true" or int(coil_reg) == 1:
-                coil_val = 1
-            # compare the current state of the coil to the default coil value
-            if coil_val == int(default_coil_value):
-                values = read_hr_register(context[0], slave_id, address, count)
-                # check to see if exceeded max value
-                if(values[0] >= max):
-                    values[0] = max
-                else:
-                    values[0] = values[0] + variance
-                # values = [v + variance for v in values]
-                write_hr_register(context[0], slave_id, address, values)
-                log.debug(values)
-            else: # not default coil value - negate variance and add it to holding register in order to do opposite behavior
-                values = read_hr_register(context[0], slave_id, address, count)
-                all_greaterthan_0 = True
-                for v in values:
-                    if v <= 0:
-                        all_greaterthan_0 = False
-                values = [v + (variance*-1) for v in values]
-                if all_greaterthan_0:
-                    write_hr_register(context[0], slave_id, address, values)
-                log.debug(values)
-    except:
-        sys.exit()
+def linear_coil_dependent(variance, max, time, address, slave_id, count, context, log, my_backup, coil_address, default_coil_value, read_coil=None, event_driven=False):
+    resting = False
+    while(True):
+        yield None if resting else time
+        with locked(slave_context(context, slave_id)):
+            resting = linear_coil_dependent_step(variance, max, address, slave_id, count, context, log, coil_address, default_coil_value, read_coil) and event_driven
+
+'''
+- Returns True if the holding register is at rest (the step left it as it was), so only a coil or register write can change it
+'''
+def linear_coil_dependent_step(variance, max, address, slave_id, count, context, log, coil_address, default_coil_value, read_coil=None):
+    coil_reg = read_co_register(context, slave_id, coil_address, 1) if read_coil is None else read_coil()
+    if not coil_reg:
+        log.debug("coil not available yet - skipping this step")
+        return False
+    # the datastore helper functions return a list, even if it is just one register being read
+    coil_reg = coil_reg[0]
+    # check the state of the coil
+    if coil_reg == "false" or int(coil_reg) == 0:
+        coil_val = 0
+    elif coil_reg == "true" or int(coil_reg) == 1:
+        coil_val = 1
+    # compare the current state of the coil to the default coil value
+    if coil_val == int(default_coil_value):
+        values = list(read_hr_register(context, slave_id, address, count))
+        resting = values[0] == max
+        # check to see if exceeded max value
+        if(values[0] >= max):
+            values[0] = max
+        else:
+            values[0] = values[0] + variance
+        # values = [v + variance for v in values]
+        write_hr_register(context, slave_id, address, values)
+        log.debug(values)
+        return resting
+    else: # not default coil value - negate variance and add it to holding register in order to do opposite behavior
+        values = read_hr_register(context, slave_id, address, count)
+        all_greaterthan_0 = True
+        for v in values:
+            if v <= 0:
+                all_greaterthan_0 = False
+        # never below 0: the datastore holds unsigned 16 bit registers
+        values = [v - variance if v - variance > 0 else 0 for v in values]
+        if all_greaterthan_0:
+            write_hr_register(context, slave_id, address, values)
+        log.debug(values)
+        return not all_greaterthan_0
 
 '''
 random_num() will update the registers/coils randomly
 - Will only generate random values between 'min' and 'max'
-- It will continue to run until it receives 'ctr+c' KeyboardInterrupt 
+- It will continue to run until the scheduler is stopped
+- rng, if given, is the behavior's own seeded random.Random (see behavior_rng_factory); otherwise the global one is used
 '''
-def random_num(min, max, time, address, slave_id, count, context, log, my_backup):
-    try:
-        while(True):
-            sleep(time)
-            values = read_hr_register(context[0], slave_id, address, count)
-            variance = randint(min, max)
-            values = [(v*0) + variance for v in values]
-            write_hr_register(context[0], slave_id, address, values)
-            log.debug(values)
-    except:
-        sys.exit()
+def random_num(min, max, time, address, slave_id, count, context, log, my_backup, rng=None):
+    draw = randint if rng is None else rng.randint
+    while(True):
+        yield time
+        values = read_hr_register(context, slave_id, address, count)
+        variance = draw(min, max)
+        values = [(v*0) + variance for v in values]
+        write_hr_register(context, slave_id, address, values)
+        log.debug(values)
 
 '''
 random_coil_dependent() will update registers/coils in a linear function until it reaches the max value specified, then it will begin random data variance
-- It will continue to run until it receives 'ctr+c' KeyboardInterrupt
+- It will continue to run until the scheduler is stopped
+- rng works as for random_num(), read_coil and event_driven as for linear_coil_dependent() (it only rests at/below 0)
 '''
-def random_coil_dependent(variance, max, rand_min, rand_max, time, address, slave_id, count, context, log, my_backup, coil_address, default_coil_value):
-    try:
-	# false until max is reached
-	at_max = False
-        while(True):
-            sleep(time)
-            coil_reg = read_co_register(context[0], slave_id, coil_address, 1)
-            # the datastore helper functions return a list, even if it is just one register being read
-            coil_reg = coil_reg[0]
-	    values = read_hr_register(context[0], slave_id, address, count)
-	    # checking to see if max value was reached to begin random data variance
-	    if(values[0] >= max):
-	        at_max = True
-            # check the state of the coil
-            if coil_reg == "false" or int(coil_reg) == 0:
-                coil_val = 0
-            elif coil_reg == "true" or int(coil_reg) == 1:
-                coil_val = 1
-            # compare the current state of the coil to the default coil value
-            if coil_val == int(default_coil_value):
-                # if at max select random int
-		if(at_max == True):
-		    values[0] = randint(rand_min, rand_max)
-		# check to see if exceeded max                
-		elif(values[0] >= max):
-                    values[0] = max
-                else:
-                    values[0] = values[0] + variance
-                # values = [v + variance for v in values]
-                write_hr_register(context[0], slave_id, address, values)
-                log.debug(values)
-            else: # not default coil value - negate variance and add it to holding register in order to do opposite behavior
-                values = read_hr_register(context[0], slave_id, address, count)
-                all_greaterthan_0 = True
-                for v in values:
-                    if v <= 0:
-                        all_greaterthan_0 = False
-                if all_greaterthan_0:
-		    # no longer at max value, do not do random variance
-		    at_max = False
-		    values = [v + (variance*-1) for v in values]
-		    if(values[0] < 0):
-		        values[0] = 0
-                    write_hr_register(context[0], slave_id, address, values)
-                log.debug(values)
-    except:
-        sys.exit()
+def random_coil_dependent(variance, max, rand_min, rand_max, time, address, slave_id, count, context, log, my_backup, coil_address, default_coil_value, rng=None, read_coil=None, event_driven=False):
+    draw = randint if rng is None else rng.randint
+    # false until max is reached
+    at_max = False
+    resting = False
+    while(True):
+        yield None if resting else time
+        with locked(slave_context(context, slave_id)):
+            at_max, resting = random_coil_dependent_step(at_max, variance, max, rand_min, rand_max, address, slave_id, count, context, log, coil_address, default_coil_value, draw, read_coil)
+        resting = resting and event_driven
+
+'''
+- Returns (at_max, resting), resting as for linear_coil_dependent_step()
+'''
+def random_coil_dependent_step(at_max, variance, max, rand_min, rand_max, address, slave_id, count, context, log, coil_address, default_coil_value, draw=randint, read_coil=None):
+    coil_reg = read_co_register(context, slave_id, coil_address, 1) if read_coil is None else read_coil()
+    if not coil_reg:
+        log.debug("coil not available yet - skipping this step")
+        return at_max, False
+    # the datastore helper functions return a list, even if it is just one register being read
+    coil_reg = coil_reg[0]
+    values = list(read_hr_register(context, slave_id, address, count))
+    # checking to see if max value was reached to begin random data variance
+    if(values[0] >= max):
+        at_max = True
+    # check the state of the coil
+    if coil_reg == "false" or int(coil_reg) == 0:
+        coil_val = 0
+    elif coil_reg == "true" or int(coil_reg) == 1:
+        coil_val = 1
+    # compare the current state of the coil to the default coil value
+    if coil_val == int(default_coil_value):
+        # if at max select random int
+        if(at_max == True):
+            values[0] = draw(rand_min, rand_max)
+        # check to see if exceeded max                
+        elif(values[0] >= max):
+            values[0] = max
+        else:
+            values[0] = values[0] + variance
+        # values = [v + variance for v in values]
+        write_hr_register(context, slave_id, address, values)
+        log.debug(values)
+    else: # not default coil value - negate variance and add it to holding register in order to do opposite behavior
+        values = read_hr_register(context, slave_id, address, count)
+        all_greaterthan_0 = True
+        for v in values:
+            if v <= 0:
+                all_greaterthan_0 = False
+        if all_greaterthan_0:
+            # no longer at max value, do not do random variance
+            at_max = False
+            values = [v - variance if v - variance > 0 else 0 for v in values]
+            write_hr_register(context, slave_id, address, values)
+        log.debug(values)
+        return at_max, not all_greaterthan_0
+    return at_max, False
 
 '''
 constant_num() will update the registers/coils with a constant value
 - Will generate constant value to coil register
-- It will continue to run until it receives 'ctr+c' KeyboardInterrupt
+- It will continue to run until the scheduler is stopped
+- event_driven: after writing, the behavior parks in the scheduler until something else writes its coils,
+  then writes the constant again 'time' seconds later
 '''
-def constant_num(num, time, address, slave_id, count, context, log, my_backup):
-    try:
-        while(True):
-            sleep(time)
-            values = read_co_register(context[0], slave_id, address, count)
-            variance = num
-            values = [(v*0) + variance for v in values]
-            write_co_register(context[0], slave_id, address, values)
-            log.debug(values)
-    except:
-        sys.exit()
+def constant_num(num, time, address, slave_id, count, context, log, my_backup, event_driven=False):
+    while(True):
+        yield time
+        values = read_co_register(context, slave_id, address, count)
+        variance = num
+        values = [(v*0) + variance for v in values]
+        write_co_register(context, slave_id, address, values)
+        log.debug(values)
+        if event_driven:
+            yield None
         
-def fuel_tank_behavior(min, max, time, address, slave_id, count, context, log, my_backup, coil_address):
-    print( "Thread started for fuel_tank_behavior" )
-    try:
-        while True:
-            for i in range(0, 2):
-                # decrement behavior - decrement tank by 25% about every 15 min
-                # open coil
-                coil_values = read_co_register(context[0], slave_id, coil_address, 1)
-                coil_values = [1 for v in coil_values]
-                write_co_register(context[0], slave_id, address, coil_values)
-                for j in range(0, 25): # take 25 seconds to decrement fuel tank level by 25%
-                    values = read_hr_register(context[0], slave_id, address, count)
-                    for v in values:
-                        if v > min:
-                            values = [(v-1) for v in values]
-                    write_hr_register(context[0], slave_id, address, values)
-                    log.debug(values)
-                    sleep(1)
-
-                # close coil
-                coil_values = read_co_register(context[0], slave_id, coil_address, 1)
-                coil_values = [0 for v in coil_values]
-                write_co_register(context[0], slave_id, address, coil_values)
-
-                sleep_val = 875
-		# sleep for about 15 minutes, depending on whether we decremented or also incremented
-                sleep(sleep_val)
-                # increment behavior - refill tank to 100% about every hour
-                if i == 1:
-                    # open coil
-                    log.debug("Increment behavior entered\n")
-                    coil_values = read_co_register(context[0], slave_id, coil_address, 1)
-                    coil_values = [1 for v in coil_values]
-                    write_co_register(context[0], slave_id, address, coil_values)
-
-                    for k in range(0, 100): # take 100 seconds to refill fuel tank back to 100
-                        values = read_hr_register(context[0], slave_id, address, count)
-                        for v in values:
-                            if v < max:
-                                values = [(v+1) for v in values]
-                        write_hr_register(context[0], slave_id, address, values)
-                        log.debug(values)
-                        sleep(1)
-
-                    # close coil
-                    coil_values = read_co_register(context[0], slave_id, coil_address, 1)
-                    coil_values = [0 for v in coil_values]
-                    write_co_register(context[0], slave_id, address, coil_values)
-
-                    sleep_val = 775
-		    sleep(900)            
-    except:
-        sys.exit()
+'''
+- @brief parse_id_spec turns an id spec (an int, a list of ints or a string such as '3' or '1,4,10-20') into a sorted list of ids
+'''
+def parse_id_spec(spec):
+    if isinstance(spec, int):
+        return [spec]
+    if isinstance(spec, list):
+        return sorted(set(int(i) for i in spec))
+    ids = set()
+    for part in str(spec).split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            ids.update(range(int(first), int(last) + 1))
+        elif part != '':
+            ids.add(int(part))
+    return sorted(ids)
 
+'''
+- @brief unit_datastores returns [(unit id, DATASTORE section)] for every Modbus unit (slave) a PLC section serves, or None without a UNITS key
+- UNITS lets one PLC section (one port) act as a gateway or serial bus with many slaves behind it, each with its own datablocks and behaviors
+    - UNITS: '1-200' (or a list of unit ids) gives every unit its own copy of the DATASTORE section
+    - UNITS: {1: null, 7: {co: ..., di: ..., hr: ..., ir: ...}} gives unit 7 a DATASTORE section of its own
+'''
+def unit_datastores(config_list):
+    units = config_list.get('UNITS')
+    if units is None:
+        return None
+    if not isinstance(units, dict):
+        units = dict((unit, None) for unit in parse_id_spec(units))
+    result = []
+    for unit in sorted(units):
+        if not 0x00 <= int(unit) <= 0xf7:
+            raise ValueError("Modbus unit id " + str(unit) + " is out of range (0-247)")
+        result.append((int(unit), units[unit] or config_list['DATASTORE']))
+    return result
 
-""" 
-A worker process that runs every so often and
-updates live values of the context. It should be noted
-that there is a race condition for the update.
+'''
+- @brief behavior_rng_factory returns behavior_rng(name), which gives the scheduler entry 'name' of PLC device plc_id its own random.Random
+- The generator is seeded from (seed, plc_id, name), so a run with the same MASTER simulation seed draws the same numbers
+    in every behavior, whatever the order the behaviors are scheduled in or how many other PLC devices share the process
+'''
+def behavior_rng_factory(seed, plc_id):
+    def behavior_rng(name):
+        key = '%s/%s/%s' % (seed, plc_id, name)
+        return Random(zlib.crc32(key.encode('utf-8')) & 0xffffffff)
+    return behavior_rng
 
-:param arguments: The input arguments to the call
-"""
+'''
+@brief the policy for behaviors that fall behind ('policy' in the SCHEDULER section of a PLC device, see scheduler.py)
+- PLC devices hosted in one process (plc_host.py, supervisor shards) share one scheduler, so they must agree on it
+'''
+def scheduler_policy(config_list):
+    return config_list.get('SCHEDULER', {}).get('policy', 'catch_up')
 
 '''
 updating_writer parses the DATASTORE section of the config for the calling PLC device
-  to start threads for each holding register based on the type of behavior and the parameters
+  to add a behavior to the scheduler for each holding register based on the type of behavior and the parameters
   specified
-- Currently designed to have one thread per holding register
+- Currently designed to have one behavior per holding register, all of them serviced by the one scheduler thread
 - Currently does not handle 'di' or 'ir' register types
+- With 'batch: true' in the SCHEDULER section, linear/random/linear_coil_dependent behaviors that share a time are evaluated together (see batch.py)
+- With a UNITS section, every unit id gets its own copy of the behaviors, running against its own slave context
+- behavior_stats(name), if given, returns the metrics.BehaviorStats for the step times and lags of the scheduler entry 'name'
+- Every scheduler entry logs through its own (possibly sampled/rate limited, see logqueue.py) logger
+- behavior_rng(name), if given, returns the seeded random number generator of the scheduler entry 'name' (see behavior_rng_factory)
+- shared (sharedregs.SharedRegisters) lets coil dependent behaviors follow a coil of another PLC device ('coil_plc')
+- With 'event_driven: true' in the SCHEDULER section (or per behavior), coil dependent and constant behaviors park while idle
+  and are woken by writes to their registers instead of polling them (see schedule_behaviors)
+- 'scenario' behaviors (and fuel_tank_behavior, the built-in fuel_tank scenario) run phases declared in the config (see scenario.py)
 '''
-def updating_writer(context, config_list, time, log, backup_filename):
-    # load in config list to generate thread behavior
-    values = config_list['DATASTORE']['hr']['values']
+def updating_writer(context, config_list, time, log, backup_filename, scheduler, behavior_stats=None, behavior_rng=None, shared=None):
+    batch = None
+    if config_list.get('SCHEDULER', {}).get('batch', False):
+        if numpy is None:
+            log.warning("SCHEDULER batch mode needs numpy - scheduling every behavior on its own")
+        else:
+            batch = BatchEngine()
+    event_driven = config_list.get('SCHEDULER', {}).get('event_driven', False)
+    scenarios = config_list.get('SCENARIOS')
+
+    behavior_log = behavior_log_factory(log, config_list.get('LOGGING', {}))
+    units = unit_datastores(config_list)
+    if units is None:
+        schedule_behaviors(context, config_list['DATASTORE'], 0x00, '', behavior_log, backup_filename, scheduler, batch, behavior_stats, behavior_rng, shared, event_driven, scenarios)
+    else:
+        for slave_id, datastore_config in units:
+            schedule_behaviors(context, datastore_config, slave_id, 'unit ' + str(slave_id) + ' ', behavior_log, backup_filename, scheduler, batch, behavior_stats, behavior_rng, shared, event_driven, scenarios)
+
+    # one scheduler entry per group of batched behaviors
+    if batch is not None:
+        batch.schedule(scheduler, context, behavior_log, behavior_stats, behavior_rng)
+
+'''
+- @brief coil_reader returns the read_coil function of a coil dependent behavior, or None if it follows a coil of its own PLC device
+- 'coil_plc: N' in the behavior's config makes it follow coil 'coil_address' of PLC N, read from shared memory
+'''
+def coil_reader(behavior_config, shared):
+    coil_plc = behavior_config.get('coil_plc')
+    if coil_plc is None:
+        return None
+    if shared is None:
+        raise ValueError("'coil_plc' needs 'shared_memory' in the MASTER section of the config")
+    coil_address = behavior_config['coil_address']
+    return lambda: shared.read(coil_plc, 'co', coil_address, 1)
+
+'''
+- @brief is_event_driven returns True if the behavior should be woken by register writes instead of polling
+- 'event_driven' in the behavior's config overrides the SCHEDULER default; a coil of another PLC device ('coil_plc') cannot be observed, so it is always polled
+'''
+def is_event_driven(behavior_config, default):
+    if behavior_config.get('coil_plc') is not None:
+        return False
+    return behavior_config.get('event_driven', default)
+
+'''
+schedule_behaviors adds the behaviors of one DATASTORE section (one Modbus unit) to the scheduler, or to the batch engine if it takes them
+- name_prefix tells the scheduler entries of different units apart
+- behavior_log(name) returns the logger of the scheduler entry 'name'
+- scenarios is the SCENARIOS section of the config, for 'scenario' behaviors (see scenario.py)
+- Event driven behaviors are never batched; a write to the coil wakes a coil dependent behavior at once, a write to its
+  holding registers only wakes it while it is parked (the register may have been moved away from its resting value)
+'''
+def schedule_behaviors(context, datastore_config, slave_id, name_prefix, behavior_log, backup_filename, scheduler, batch, behavior_stats=None, behavior_rng=None, shared=None, event_driven=False, scenarios=None):
+    # load in config list to generate behaviors
+    values = datastore_config['hr']['values']
     size = len(values)
     i = 0
     # loop through each holding register
     while(i < size):
-        log.debug("updating the context")
         name = 'behavior_' + str(i + 1)
-        slave_id = 0x00
-        time = config_list['DATASTORE']['hr'][name]['time']
-        address = config_list['DATASTORE']['hr'][name]['address']
-        count = config_list['DATASTORE']['hr'][name]['count']
+        entry_name = name_prefix + 'hr ' + name
+        log = behavior_log(entry_name)
+        log.debug("updating the context")
+        time = datastore_config['hr'][name]['time']
+        address = datastore_config['hr'][name]['address']
+        count = datastore_config['hr'][name]['count']
         target = ''
         args = ()
+        event = False
 
         # check to see what behavior to use
-        if (config_list['DATASTORE']['hr'][name]['type'] == 'linear'):
+        if (datastore_config['hr'][name]['type'] == 'linear'):
             # collect values from master config
-            variance = config_list['DATASTORE']['hr'][name]['variance']
+            variance = datastore_config['hr'][name]['variance']
             target = linear
             args = (variance, time, address, slave_id, count, context, log, backup_filename)
 
-        elif (config_list['DATASTORE']['hr'][name]['type'] == 'linear_coil_dependent'):
-            variance = config_list['DATASTORE']['hr'][name]['variance']
-            coil_address = config_list['DATASTORE']['hr'][name]['coil_address']
-            default_coil_value = config_list['DATASTORE']['hr'][name]['default_coil_value']
-            maximum = config_list['DATASTORE']['hr'][name]['max']
+        elif (datastore_config['hr'][name]['type'] == 'linear_coil_dependent'):
+            variance = datastore_config['hr'][name]['variance']
+            coil_address = datastore_config['hr'][name]['coil_address']
+            default_coil_value = datastore_config['hr'][name]['default_coil_value']
+            maximum = datastore_config['hr'][name]['max']
+            event = is_event_driven(datastore_config['hr'][name], event_driven)
             target = linear_coil_dependent
-            args = (variance, maximum, time, address, slave_id, count, context, log, backup_filename, coil_address, default_coil_value)
+            args = (variance, maximum, time, address, slave_id, count, context, log, backup_filename, coil_address, default_coil_value, coil_reader(datastore_config['hr'][name], shared), event)
 
-        elif (config_list['DATASTORE']['hr'][name]['type'] == 'random'):
+        elif (datastore_config['hr'][name]['type'] == 'random'):
             # collect values from master config
-            minimum = config_list['DATASTORE']['hr'][name]['min']
-            maximum = config_list['DATASTORE']['hr'][name]['max']
+            minimum = datastore_config['hr'][name]['min']
+            maximum = datastore_config['hr'][name]['max']
             target = random_num
-            args = (minimum, maximum, time, address, slave_id, count, context, log, backup_filename)
+            args = (minimum, maximum, time, address, slave_id, count, context, log, backup_filename, behavior_rng and behavior_rng(entry_name))
         
-        elif (config_list['DATASTORE']['hr'][name]['type'] == 'random_coil_dependent'):
-            variance = config_list['DATASTORE']['hr'][name]['variance']
-            coil_address = config_list['DATASTORE']['hr'][name]['coil_address']
-            default_coil_value = config_list['DATASTORE']['hr'][name]['default_coil_value']
-            maximum = config_list['DATASTORE']['hr'][name]['max']
-            rand_min = config_list['DATASTORE']['hr'][name]['rand_min']
-            rand_max = config_list['DATASTORE']['hr'][name]['rand_max']
+        elif (datastore_config['hr'][name]['type'] == 'random_coil_dependent'):
+            variance = datastore_config['hr'][name]['variance']
+            coil_address = datastore_config['hr'][name]['coil_address']
+            default_coil_value = datastore_config['hr'][name]['default_coil_value']
+            maximum = datastore_config['hr'][name]['max']
+            rand_min = datastore_config['hr'][name]['rand_min']
+            rand_max = datastore_config['hr'][name]['rand_max']
+            event = is_event_driven(datastore_config['hr'][name], event_driven)
             target = random_coil_dependent
-            args = (variance, maximum, rand_min, rand_max, time, address, slave_id, count, context, log, backup_filename, coil_address, default_coil_value)
+            args = (variance, maximum, rand_min, rand_max, time, address, slave_id, count, context, log, backup_filename, coil_address, default_coil_value, behavior_rng and behavior_rng(entry_name), coil_reader(datastore_config['hr'][name], shared), event)
+
+        elif (datastore_config['hr'][name]['type'] == 'fuel_tank_behavior'):
+            # the built-in fuel_tank scenario, with the behavior's min/max/coil_address
+            target = scenario_behavior
+            args = (scenario_for(dict(datastore_config['hr'][name], scenario='fuel_tank')), address, slave_id, count, context, log, scheduler)
+
+        elif (datastore_config['hr'][name]['type'] == 'scenario'):
+            target = scenario_behavior
+            args = (scenario_for(datastore_config['hr'][name], scenarios), address, slave_id, count, context, log, scheduler)
 
-        elif (config_list['DATASTORE']['hr'][name]['type'] == 'fuel_tank_behavior'):
-            print( "successfully found fuel_tank_behavior" )
-            minimum = config_list['DATASTORE']['hr'][name]['min']
-            maximum = config_list['DATASTORE']['hr'][name]['max']
-            coil_address = config_list['DATASTORE']['hr'][name]['coil_address']
-            target = fuel_tank_behavior
-            args = (minimum, maximum, time, address, slave_id, count, context, log, backup_filename, coil_address)
 
+        # batchable behaviors are handed to their group instead
+        if batch is not None and not event and batch.add(slave_id, name, datastore_config['hr'][name]):
+            target = ''
 
-        # start thread
-        thread = Thread(target=target, args=args)
-        thread.daemon = True
-        thread.start()
+        # hand the behavior to the scheduler
+        if target != '':
+            behavior = target(*args)
+            scheduler.add(entry_name, behavior, log, stats=behavior_stats and behavior_stats(entry_name), wakeable=event or target is scenario_behavior)
+            if event:
+                observe_registers(context, slave_id, 'co', coil_address, 1, lambda table, address, values, behavior=behavior: scheduler.wake(behavior))
+                observe_registers(context, slave_id, 'hr', address, count, lambda table, address, values, behavior=behavior: scheduler.wake(behavior, parked_only=True))
 
-        # iterate to next thread
+        # iterate to next behavior
         i = i + 1
 
-    # load in config list to generate thread behavior for coil registers
-    co_values = config_list['DATASTORE']['co']['values']
+    # load in config list to generate behaviors for coil registers
+    co_values = datastore_config['co']['values']
     co_size = len(co_values)
     is_behavior = False	# Allow for us to add behaviors only for some coil registers if we want to
     j = 0
     while(j < co_size):
-        log.debug("updating the context")
         name = 'behavior_' + str(j + 1)
-        slave_id = 0x00
+        entry_name = name_prefix + 'co ' + name
+        log = behavior_log(entry_name)
+        log.debug("updating the context")
         # Moved time/address/count collection to if logic for constant
         # If we add more behaviors in the future for coils, can move it back up here and add logic
         # to check that behavior_N['type'] != 'none' before getting time/address/count values
         target = ''
         args = ()
+        event = False
 
-        # check to see what behavior to use. If it does not match any, don't start a thread
-        if (config_list['DATASTORE']['co'][name]['type'] == 'constant'):
+        # check to see what behavior to use. If it does not match any, don't schedule anything
+        if (datastore_config['co'][name]['type'] == 'constant'):
             # collect values from master config
-            time = config_list['DATASTORE']['co'][name]['time']
-            address = config_list['DATASTORE']['co'][name]['address']
-            count = config_list['DATASTORE']['co'][name]['count']
-            num = config_list['DATASTORE']['co'][name]['num']
+            time = datastore_config['co'][name]['time']
+            address = datastore_config['co'][name]['address']
+            count = datastore_config['co'][name]['count']
+            num = datastore_config['co'][name]['num']
+            event = is_event_driven(datastore_config['co'][name], event_driven)
             target = constant_num
-            args = (num, time, address, slave_id, count, context, log, backup_filename)
+            args = (num, time, address, slave_id, count, context, log, backup_filename, event)
             is_behavior = True
         else:
             # invalid type name or no behavior
             is_behavior = False
 
-        # start thread if it is a valid behavior
+        # schedule it if it is a valid behavior
         if is_behavior:
-            thread = Thread(target=target, args=args)
-            thread.daemon = True
-            thread.start()
+            behavior = target(*args)
+            scheduler.add(entry_name, behavior, log, stats=behavior_stats and behavior_stats(entry_name), wakeable=event)
+            if event:
+                observe_registers(context, slave_id, 'co', address, count, lambda table, address, values, behavior=behavior: scheduler.wake(behavior, parked_only=True))
 
         # iterate to the next coil register to check for behavior
         j = j + 1
@@ -385,40 +485,154 @@ def datastore_backup_on_start(my_backup):
     return backup_file['DATASTORE']
 
 '''
-- @brief datastore_backup_to_yaml will run continuously to READ from the context to update the entries in the datastore backup file in YAML format
-- It should be run from async_plc.py as a thread to continuously run
-- It should start running before the other threads (for register behavior) starts running, but after the datastore context has been setup
+- @brief units_backup_on_start is datastore_backup_on_start for a PLC device with a UNITS section
+- Returns the {unit id: datastore} saved by datastore_backup_to_yaml (empty until the first save) and the DATASTORE written by master.py, or -1
 '''
-def datastore_backup_to_yaml(context, my_backup):
+def units_backup_on_start(my_backup):
+    if (path.exists(my_backup) == False or path.getsize(my_backup) == 0):
+        return -1
     backup = open(my_backup, 'r')
     backup_file = yaml.safe_load(backup)
     backup.close()
-    yaml_file = ''
-    num_of_co = len(backup_file['DATASTORE']['co']['values'])
-    num_of_di = len(backup_file['DATASTORE']['di']['values'])
-    num_of_hr = len(backup_file['DATASTORE']['hr']['values'])
-    num_of_ir = len(backup_file['DATASTORE']['ir']['values'])
+
+    return backup_file.get('UNITS') or {}, backup_file['DATASTORE']
+
+# libyaml's dumper when PyYAML was built with it - same output, much less CPU
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+'''
+- @brief write_backup_atomically dumps backup_file to a temp file next to my_backup, fsyncs it and renames it over my_backup
+- A crash mid-write leaves the previous backup untouched for datastore_backup_on_start
+'''
+def write_backup_atomically(backup_file, my_backup):
+    tmp_backup = my_backup + '.tmp'
+    yaml_file = open(tmp_backup, 'w')
+    try:
+        yaml.dump(backup_file, yaml_file, Dumper=YAML_DUMPER, default_flow_style=False)
+        yaml_file.flush()
+        os.fsync(yaml_file.fileno())
+    finally:
+        yaml_file.close()
+    os.rename(tmp_backup, my_backup)
+
+'''
+- @brief live_state_on_start is the datastore_backup_on_start for 'BACKUP: {format: mmap}'
+- It maps backup_N.state next to my_backup; the first time, the state file is created from the YAML backup written by master.py
+- Returns the mapped LiveStateFile, or -1 if neither file is usable
+'''
+def live_state_on_start(my_backup):
+    state_filename = state_filename_for(my_backup)
+    if path.exists(state_filename) and path.getsize(state_filename) > 0:
+        return LiveStateFile(state_filename)
+    datastore_config = datastore_backup_on_start(my_backup)
+    if datastore_config == -1:
+        return -1
+    return LiveStateFile.create(state_filename, datastore_config)
+
+'''
+- @brief datastore_backup_to_state is the backup thread for 'BACKUP: {format: mmap}'
+- Writes already land in the mapping through the slave context's write hook, so all that is left is to msync it every 'interval' seconds if anything changed
+'''
+def datastore_backup_to_state(context, live_state, interval=1, clock=None):
+    clock = clock or SimClock()
+    try:
+        for delay in state_backup_steps(context, live_state, interval):
+            clock.sleep(delay)
+    except:
+        sys.exit()
+
+'''
+- @brief the steps of datastore_backup_to_state as a behavior generator, to run the backup on a scheduler instead of its own thread
+'''
+def state_backup_steps(context, live_state, interval=1):
+    slave = context[0]
+    while(True):
+        yield interval
+        if slave.take_dirty():
+            live_state.flush()
+
+'''
+- @brief datastore_backup_to_yaml will run continuously to READ from the context to update the entries in the datastore backup file in YAML format
+- It should be run from async_plc.py as a thread to continuously run
+- It should start running before the register behaviors start running, but after the datastore context has been setup
+- Every 'interval' seconds it collects the ranges written since the last check (PLCSlaveContext.take_dirty) and re-reads only those
+- The file is only rewritten if something changed: once writes stop for an interval, or at the latest 'max_staleness' seconds after the first unsaved write
+- A context serving several units (UNITS section, single=False) is saved unit by unit under UNITS in the same file
+- 'interval' and 'max_staleness' are sim seconds on 'clock' (see simclock.py)
+'''
+def datastore_backup_to_yaml(context, my_backup, interval=1, max_staleness=None, clock=None):
+    clock = clock or SimClock()
+    steps = yaml_backup_steps(context, my_backup, interval, max_staleness, clock)
+    # the first step reads the backup file, so a missing or broken backup raises here instead of ending the thread quietly
+    delay = next(steps)
     try:
         while(True):
-            # Eventually change sleep value to a parameter - there are issues with the backup file if there is no sleep at all
-            sleep(1)
-            values = read_co_register(context[0], 0x00, 0x00, num_of_co)
-            backup_file['DATASTORE']['co']['values'] = values
-            values = read_di_register(context[0], 0x00, 0x00, num_of_di)
-            backup_file['DATASTORE']['di']['values'] = values
-            values = read_hr_register(context[0], 0x00, 0x00, num_of_hr)
-            backup_file['DATASTORE']['hr']['values'] = values
-            values = read_ir_register(context[0], 0x00, 0x00, num_of_ir)
-            backup_file['DATASTORE']['ir']['values'] = values
-            
-            yaml_file = open(my_backup, 'w')
-            yaml.dump(backup_file, yaml_file, default_flow_style=False)
-            yaml_file.close()
+            clock.sleep(delay)
+            delay = next(steps)
     except:
-        if(yaml_file.closed == False):
-            yaml_file.close()
         sys.exit()
 
+'''
+- @brief the steps of datastore_backup_to_yaml as a behavior generator, to run the backup on a scheduler instead of its own thread
+- Every 'yield' is the 'interval' to wait before the next change check
+'''
+def yaml_backup_steps(context, my_backup, interval=1, max_staleness=None, clock=None):
+    clock = clock or SimClock()
+    backup = open(my_backup, 'r')
+    backup_file = yaml.safe_load(backup)
+    backup.close()
+    if max_staleness is None:
+        max_staleness = interval
+    first_unsaved = None
+    # (slave context, its datastore in backup_file, number of values saved per table) for every unit
+    units = []
+    for slave_id, slave in plc_slaves(context):
+        # start from the live datastore rather than the file, in case it was restored from elsewhere (e.g. the change journal)
+        tables = snapshot_registers(slave, slave_id, TABLE_FX)
+        if context.single:
+            datastore = backup_file['DATASTORE']
+        elif slave_id in backup_file.setdefault('UNITS', {}):
+            datastore = backup_file['UNITS'][slave_id]
+        else:
+            # first save of this unit
+            datastore = backup_file['UNITS'][slave_id] = dict((table, {'start_addr': 1, 'values': tables[table]}) for table in TABLE_FX)
+            first_unsaved = clock.now()
+        sizes = dict((table, len(datastore[table]['values'])) for table in TABLE_FX)
+        for table in TABLE_FX:
+            values = tables[table][:sizes[table]]
+            if values != datastore[table]['values']:
+                datastore[table]['values'] = values
+                first_unsaved = clock.now()
+        units.append((slave, datastore, sizes))
+    while(True):
+        yield interval
+        changed = False
+        for slave, datastore, sizes in units:
+            if hasattr(slave, 'take_dirty'):
+                dirty = slave.take_dirty()
+            else:
+                # plain slave contexts do not track writes - treat every table as dirty
+                dirty = dict((table, [(0, sizes[table])]) for table in TABLE_FX)
+            # clip the ranges to the backed up tables and read them all as one consistent snapshot, so a multi-table change
+            # (e.g. a coil flip and the register it drives) is never saved half applied
+            ranges = {}
+            for table, table_ranges in dirty.items():
+                ranges[table] = [(address, min(address + count, sizes[table]) - address) for address, count in table_ranges if address < sizes[table]]
+            if hasattr(slave, 'snapshot'):
+                ranges = slave.snapshot(ranges)
+            else:
+                ranges = dict((table, [(address, list(slave.getValues(TABLE_FX[table], address, count))) for address, count in table_ranges]) for table, table_ranges in ranges.items())
+            for table, table_ranges in ranges.items():
+                values = datastore[table]['values']
+                for address, new_values in table_ranges:
+                    values[address:address + len(new_values)] = new_values
+            changed = changed or bool(dirty)
+        if changed and first_unsaved is None:
+            first_unsaved = clock.now()
+        if first_unsaved is not None and (not changed or clock.now() - first_unsaved >= max_staleness):
+            write_backup_atomically(backup_file, my_backup)
+            first_unsaved = None
+
 '''
 Used to configure logging and clean up the code in async_plc.py
 '''
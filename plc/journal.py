@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Append-only change journal for a host's PLC devices
+- Every datastore write becomes one compact binary record (PLC id, table, address, values, timestamp)
+- Records are buffered in memory and group-committed (write + fsync) every 'commit_interval' seconds by one thread
+- Every 'checkpoint_interval' seconds the journal rolls over to a new segment that starts with a full
+  checkpoint of every attached PLC device; only the newest 'segments' segments are kept (compaction)
+- restore_datastore() rebuilds a PLC device's tables at the latest time or at any time covered by the kept
+  segments, by replaying writes on top of the nearest earlier checkpoint
+- Records are stamped with the journal's clock (the SimClock of the PLC devices, see simclock.py), so with an accelerated
+  or discrete simulation the timestamps, and the times given to --restore_ts, are sim time
+- A checkpoint's timestamp is taken under the PLC device's write lock together with its snapshot, so every write
+  stamped before it is in the snapshot, and every write left out of it is stamped at or after it
+
+Directory layout: <journal dir>/<writer>/segment_<n>.log, where the writer is e.g. 'plc_3' for async_plc.py
+or 'host' for plc_host.py, so several processes can journal into the same directory.
+
+Record layout (little-endian): uint8 kind (1 write, 2 checkpoint), double timestamp, uint16 PLC id,
+uint8 table, uint16 address, uint16 count, uint32 crc32 of the values, then count x uint16 values.
+'''
+import os, sys, struct, zlib, logging
+from array import array
+from threading import Thread, Lock
+from time import time, sleep
+from datastore import TABLE_FX, snapshot_registers, locked
+
+WRITE = 1
+CHECKPOINT = 2
+TABLES = ('di', 'co', 'hr', 'ir')
+TABLE_IDS = dict((table, i) for i, table in enumerate(TABLES))
+RECORD = struct.Struct('<BdHBHHI')
+
+def _pack_values(values):
+    values = array('H', [int(v) & 0xFFFF for v in values])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes() if sys.version_info[0] >= 3 else values.tostring()
+
+def _unpack_values(data):
+    values = array('H')
+    if sys.version_info[0] >= 3:
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def pack_record(kind, timestamp, plc_id, table, address, values):
+    raw = _pack_values(values)
+    return RECORD.pack(kind, timestamp, plc_id, TABLE_IDS[table], address, len(raw) // 2, zlib.crc32(raw) & 0xFFFFFFFF) + raw
+
+'''
+@brief yields (kind, timestamp, plc_id, table, address, values) for every intact record in one segment
+- Stops at the first torn or corrupt record (e.g. the tail of a segment that was being written during a crash)
+'''
+def read_segment(filename):
+    segment = open(filename, 'rb')
+    data = segment.read()
+    segment.close()
+    position = 0
+    while position + RECORD.size <= len(data):
+        kind, timestamp, plc_id, table_id, address, count, crc = RECORD.unpack_from(data, position)
+        raw = data[position + RECORD.size:position + RECORD.size + 2 * count]
+        if len(raw) != 2 * count or zlib.crc32(raw) & 0xFFFFFFFF != crc or table_id >= len(TABLES):
+            return
+        yield kind, timestamp, plc_id, TABLES[table_id], address, _unpack_values(raw)
+        position += RECORD.size + 2 * count
+
+'''
+@brief every segment under journal_dir, from every writer
+'''
+def list_segments(journal_dir):
+    segments = []
+    if not os.path.isdir(journal_dir):
+        return segments
+    for writer in sorted(os.listdir(journal_dir)):
+        writer_dir = os.path.join(journal_dir, writer)
+        if os.path.isdir(writer_dir):
+            for name in sorted(os.listdir(writer_dir)):
+                if name.startswith('segment_') and name.endswith('.log'):
+                    segments.append(os.path.join(writer_dir, name))
+    return segments
+
+'''
+@brief rebuild the DATASTORE dict ({table: {'start_addr': 1, 'values': [...]}}) of one PLC device from the journal
+- until=None restores the latest state; otherwise the state as of that unix timestamp
+- Returns -1 if no checkpoint of that PLC device at or before 'until' is left in the journal
+'''
+def restore_datastore(journal_dir, plc_id, until=None):
+    records = []
+    for filename in list_segments(journal_dir):
+        for record in read_segment(filename):
+            if record[2] == plc_id and (until is None or record[1] <= until):
+                records.append(record)
+    # stable sort, so records of one writer keep their order when timestamps tie
+    records.sort(key=lambda record: record[1])
+    checkpoint_time = None
+    for kind, timestamp, plc, table, address, values in records:
+        if kind == CHECKPOINT:
+            checkpoint_time = timestamp
+    if checkpoint_time is None:
+        return -1
+
+    datastore = {}
+    for kind, timestamp, plc, table, address, values in records:
+        if timestamp < checkpoint_time:
+            continue
+        if kind == CHECKPOINT:
+            if timestamp == checkpoint_time:
+                datastore[table] = {'start_addr': 1, 'values': list(values)}
+        elif table in datastore:
+            table_values = datastore[table]['values']
+            end = min(address + len(values), len(table_values))
+            if address < end:
+                table_values[address:end] = list(values[:end - address])
+    if len(datastore) != len(TABLES):
+        return -1
+    return datastore
+
+'''
+@brief the Journal for this process from the 'journal' entry of the MASTER section, or None if journaling is off
+- MASTER: {journal: {dir: <path>, commit_interval: 0.05, checkpoint_interval: 300, segments: 24}}
+- clock (simclock.SimClock) stamps the records; the wall clock if not given
+'''
+def open_journal(master_config, writer, log=None, clock=None):
+    journal_config = master_config.get('journal')
+    if not journal_config:
+        return None
+    return Journal(journal_config['dir'], writer,
+                   commit_interval=journal_config.get('commit_interval', 0.05),
+                   checkpoint_interval=journal_config.get('checkpoint_interval', 300),
+                   segments=journal_config.get('segments', 24), log=log, clock=clock)
+
+class Journal(object):
+
+    def __init__(self, journal_dir, writer, commit_interval=0.05, checkpoint_interval=300, segments=24, log=None, clock=None):
+        self.directory = os.path.join(journal_dir, writer)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.commit_interval = commit_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.segments = max(segments, 2)
+        self.log = log or logging.getLogger('journal')
+        self.now = clock.now if clock is not None else time
+        self.contexts = {}
+        self._pending = []
+        self._lock = Lock()
+        self._segment = None
+        existing = [name for name in os.listdir(self.directory) if name.startswith('segment_') and name.endswith('.log')]
+        self._segment_number = max([int(name[8:-4]) for name in existing] or [0])
+
+    '''
+    @brief journal every write to this slave context under plc_id, and include it in checkpoints
+    '''
+    def attach(self, plc_id, slave_context):
+        self.contexts[plc_id] = slave_context
+        slave_context.write_hooks.append(lambda table, address, values: self.append(plc_id, table, address, values))
+
+    def append(self, plc_id, table, address, values):
+        # called from the write hooks, under the write lock of the slave context
+        record = pack_record(WRITE, self.now(), plc_id, table, address, values)
+        with self._lock:
+            self._pending.append(record)
+
+    def start(self):
+        self.checkpoint()
+        thread = Thread(target=self.run, name='Journal')
+        thread.daemon = True
+        thread.start()
+
+    '''
+    @brief write and fsync everything appended since the last commit
+    '''
+    def commit(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        if pending:
+            self._segment.write(b''.join(pending))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+
+    '''
+    @brief roll over to a new segment that starts with a full copy of every attached PLC device, then drop old segments
+    '''
+    def checkpoint(self):
+        if self._segment is not None:
+            self.commit()
+            self._segment.close()
+        datastores = {}
+        timestamps = {}
+        for plc_id, slave_context in self.contexts.items():
+            with locked(slave_context):
+                timestamps[plc_id] = self.now()
+                tables = snapshot_registers(slave_context, 0x00, TABLES)
+            datastores[plc_id] = dict((table, {'values': tables[table]}) for table in TABLES)
+        self._segment = self._new_segment(datastores, timestamps)
+
+    '''
+    @brief write a checkpoint for PLC devices that are not attached, e.g. DATASTORE dicts restored by master.py
+    - The checkpoint becomes the newest state of those PLC devices
+    '''
+    def record_checkpoint(self, datastores):
+        self._new_segment(datastores).close()
+
+    '''
+    @brief start a new segment with a checkpoint of datastores, each stamped with its timestamps entry (now if not given)
+    '''
+    def _new_segment(self, datastores, timestamps=None):
+        self._segment_number += 1
+        segment = open(os.path.join(self.directory, 'segment_%08d.log' % self._segment_number), 'ab')
+        timestamps = timestamps or {}
+        now = self.now()
+        records = []
+        for plc_id in sorted(datastores):
+            timestamp = timestamps.get(plc_id, now)
+            for table in TABLES:
+                records.append(pack_record(CHECKPOINT, timestamp, plc_id, table, 0x00, datastores[plc_id][table]['values']))
+        segment.write(b''.join(records))
+        segment.flush()
+        os.fsync(segment.fileno())
+        self.compact()
+        return segment
+
+    def compact(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith('segment_') and name.endswith('.log'))
+        for name in names[:-self.segments]:
+            os.remove(os.path.join(self.directory, name))
+
+    def run(self):
+        # commits and checkpoints are paced by the wall clock, whatever clock stamps the records
+        last_checkpoint = time()
+        while True:
+            sleep(self.commit_interval)
+            try:
+                if time() - last_checkpoint >= self.checkpoint_interval:
+                    self.checkpoint()
+                    last_checkpoint = time()
+                else:
+                    self.commit()
+            except Exception:
+                self.log.exception("Journal commit failed")
+
+'''
+@brief parse a restore point: 'latest' (None) or a unix timestamp or 'YYYY-mm-dd HH:MM:SS' in local time
+'''
+def parse_restore_time(value):
+    if value is None or value == 'latest':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        from datetime import datetime
+        from time import mktime
+        return mktime(datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timetuple())
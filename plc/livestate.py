@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Memory-mapped live-state file for one PLC device
+- Fixed binary layout, written in place on every datastore write, so nothing has to be serialized
+  and restoring on start is a straight copy out of the mapping
+- External tools (e.g. a historian) can map the same file read-only and see live register values
+  without polling over Modbus
+
+Layout (little-endian):
+    magic       8s      b'SCADASIM'
+    version     uint32
+    header_len  uint32  offset of the first table
+    generation  uint64  seqlock counter: odd while a write is in progress, bumped twice per write
+    4 x table   uint32 start_addr, uint32 count, uint32 offset   (di, co, hr, ir in that order)
+    tables      count x uint16 each, 8 byte aligned (coils/discrete inputs are stored as 0/1)
+
+Readers: read generation, copy the values, read generation again; retry if it was odd or changed.
+'''
+import os, sys, mmap, struct
+from array import array
+from threading import Lock
+
+MAGIC = b'SCADASIM'
+VERSION = 1
+TABLES = ('di', 'co', 'hr', 'ir')
+HEADER = struct.Struct('<8sIIQ')
+TABLE_ENTRY = struct.Struct('<III')
+GENERATION_OFFSET = 16
+GENERATION = struct.Struct('<Q')
+HEADER_LEN = HEADER.size + TABLE_ENTRY.size * len(TABLES)
+
+'''
+@brief the .state file that goes with a backup_N.yaml file
+'''
+def state_filename_for(backup_filename):
+    return os.path.splitext(backup_filename)[0] + '.state'
+
+'''
+@brief array('H') <-> little-endian bytes, independent of the host byte order
+'''
+def _to_le_bytes(values):
+    values = array('H', [int(v) & 0xFFFF for v in values])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes() if sys.version_info[0] >= 3 else values.tostring()
+
+def _from_le_bytes(data):
+    values = array('H')
+    if sys.version_info[0] >= 3:
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+class LiveStateFile(object):
+
+    def __init__(self, filename, writable=True):
+        self.filename = filename
+        self.writable = writable
+        self._lock = Lock()
+        self._file = open(filename, 'r+b' if writable else 'rb')
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self.map = mmap.mmap(self._file.fileno(), 0, access=access)
+        magic, version, header_len, generation = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(filename + " is not a SCADASim live-state file")
+        self.tables = {}
+        for i, table in enumerate(TABLES):
+            self.tables[table] = TABLE_ENTRY.unpack_from(self.map, HEADER.size + i * TABLE_ENTRY.size)
+
+    '''
+    @brief create a new live-state file from a DATASTORE dict ({table: {'start_addr': n, 'values': [...]}}) and map it
+    '''
+    @classmethod
+    def create(klass, filename, datastore):
+        entries = []
+        payload = []
+        offset = HEADER_LEN
+        for table in TABLES:
+            values = datastore[table]['values']
+            offset = (offset + 7) & ~7
+            entries.append(TABLE_ENTRY.pack(int(datastore[table]['start_addr']), len(values), offset))
+            payload.append((offset, _to_le_bytes(values)))
+            offset += 2 * len(values)
+        data = bytearray(max(offset, HEADER_LEN))
+        data[0:HEADER.size] = HEADER.pack(MAGIC, VERSION, HEADER_LEN, 0)
+        data[HEADER.size:HEADER_LEN] = b''.join(entries)
+        for start, raw in payload:
+            data[start:start + len(raw)] = raw
+        tmp_filename = filename + '.tmp'
+        state_file = open(tmp_filename, 'wb')
+        state_file.write(data)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+        state_file.close()
+        os.rename(tmp_filename, filename)
+        return klass(filename)
+
+    def generation(self):
+        return GENERATION.unpack_from(self.map, GENERATION_OFFSET)[0]
+
+    '''
+    @brief write values at a zero-based table address (the same address the datastore wrappers use)
+    '''
+    def write(self, table, address, values):
+        start_addr, count, offset = self.tables[table]
+        if address >= count:
+            return
+        raw = _to_le_bytes(list(values)[:count - address])
+        with self._lock:
+            generation = self.generation()
+            GENERATION.pack_into(self.map, GENERATION_OFFSET, generation + 1)
+            self.map[offset + 2 * address:offset + 2 * address + len(raw)] = raw
+            GENERATION.pack_into(self.map, GENERATION_OFFSET, generation + 2)
+
+    '''
+    @brief consistent copy of one table as array('H')
+    '''
+    def read_table(self, table):
+        start_addr, count, offset = self.tables[table]
+        while True:
+            before = self.generation()
+            data = self.map[offset:offset + 2 * count]
+            if before & 1 == 0 and self.generation() == before:
+                return _from_le_bytes(data)
+
+    '''
+    @brief consistent copy of count values at a zero-based table address, as array('H')
+    '''
+    def read(self, table, address, count):
+        start_addr, table_count, offset = self.tables[table]
+        count = max(0, min(count, table_count - address))
+        start = offset + 2 * address
+        while True:
+            before = self.generation()
+            data = self.map[start:start + 2 * count]
+            if before & 1 == 0 and self.generation() == before:
+                return _from_le_bytes(data)
+
+    '''
+    @brief the DATASTORE dict datastore_backup_on_start returns for YAML backups, read straight out of the mapping
+    '''
+    def to_datastore_config(self):
+        datastore = {}
+        for table in TABLES:
+            datastore[table] = {'start_addr': self.tables[table][0], 'values': self.read_table(table)}
+        return datastore
+
+    '''
+    @brief msync the mapping - only needed to survive an OS crash, a process crash loses nothing
+    '''
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self._file.close()
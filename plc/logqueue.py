@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Logging pipeline for the behavior hot loops
+- QueueLogHandler hands records to a background writer thread through a bounded queue, so a behavior step
+  never waits for disk I/O; records are only formatted by the writer (in batches), and dropped (and counted) if the queue is full
+- BehaviorLog wraps the logger a behavior logs to with per-behavior sampling and rate limits, checked before
+  a record is even created, so skipped records cost a counter increment
+- JSON-lines output and size based rotation of the log file
+- All of it is configured from the LOGGING section of a PLC config:
+    LOGGING:
+      mode: queue              # hand records to a writer thread (default: write them directly)
+      output: jsonl            # one JSON object per record instead of 'format' (default: text)
+      max_bytes: 10485760      # rotate the log file at this size, keeping backup_count old files
+      backup_count: 5
+      queue_size: 10000
+      flush_interval: 0.1      # seconds between batches written by the writer thread
+      sample_every: 10         # log every 10th DEBUG/INFO record of a behavior
+      rate_limit: 5            # and at most 5 of them per second
+      behaviors: {'hr behavior_1': {sample_every: 1, rate_limit: 50}}
+'''
+import os, sys, json, logging, atexit
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from threading import Thread
+from time import time, sleep
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                 'thread': record.threadName, 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def build_formatter(logging_config):
+    if logging_config.get('output', 'text') == 'jsonl':
+        return JsonLinesFormatter()
+    if logging_config['format'] != 'NONE':
+        return logging.Formatter(logging_config['format'])
+    return logging.Formatter()
+
+'''
+@brief the handler for direct (not queued) logging: a file (rotated at max_bytes if given) or stderr, with text or JSON-lines output
+'''
+def build_log_handler(logging_config):
+    if logging_config['file'] == 'STDOUT':
+        # same stream logging.basicConfig() uses
+        handler = logging.StreamHandler()
+    elif logging_config.get('max_bytes'):
+        handler = RotatingFileHandler(logging_config['file'], maxBytes=int(logging_config['max_bytes']), backupCount=int(logging_config.get('backup_count', 5)))
+    else:
+        handler = logging.FileHandler(logging_config['file'])
+    handler.setFormatter(build_formatter(logging_config))
+    return handler
+
+'''
+@brief writes batches of records with one write and one flush per batch, rotating the file at max_bytes like RotatingFileHandler
+'''
+class LogWriter(object):
+
+    def __init__(self, formatter, filename=None, max_bytes=0, backup_count=5):
+        self.formatter = formatter
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.stream = sys.stderr if filename is None else open(filename, 'a')
+
+    def write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                lines.append("Unformattable log record %r %r" % (record.msg, record.args))
+        self.stream.write('\n'.join(lines) + '\n')
+        self.stream.flush()
+        if self.filename is not None and self.max_bytes and self.stream.tell() >= self.max_bytes:
+            self.rollover()
+
+    def rollover(self):
+        self.stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = '%s.%d' % (self.filename, i)
+            if os.path.exists(source):
+                os.rename(source, '%s.%d' % (self.filename, i + 1))
+        if self.backup_count > 0:
+            os.rename(self.filename, self.filename + '.1')
+        else:
+            os.remove(self.filename)
+        self.stream = open(self.filename, 'a')
+
+    def close(self):
+        if self.filename is not None:
+            self.stream.close()
+
+'''
+@brief logging handler that queues records for a writer thread, which writes them in batches every flush_interval seconds
+- Queuing a record is one deque append: no lock, no wakeup and no formatting on the logging thread
+- Records beyond queue_size are dropped, and how many is logged with the next batch
+- Records keep references to their arguments until they are written, so only log values that are not changed afterwards (behaviors log fresh lists)
+'''
+class QueueLogHandler(logging.Handler):
+
+    def __init__(self, writer, queue_size=10000, flush_interval=0.1):
+        logging.Handler.__init__(self)
+        self.writer = writer
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.records = deque()
+        self.dropped = 0
+        self._reported = 0
+        self._running = True
+        self._thread = Thread(target=self.run, name='LogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle(self, record):
+        # no handler lock needed: deque appends are atomic
+        if self.filter(record):
+            self.emit(record)
+
+    def emit(self, record):
+        if len(self.records) >= self.queue_size:
+            self.dropped += 1
+        else:
+            self.records.append(record)
+
+    def write_queued(self):
+        batch = []
+        while self.records:
+            batch.append(self.records.popleft())
+        if self.dropped != self._reported:
+            batch.append(logging.makeLogRecord({'name': 'logqueue', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                                'msg': "%d log records dropped (queue full)", 'args': (self.dropped - self._reported,)}))
+            self._reported = self.dropped
+        if batch:
+            self.writer.write(batch)
+
+    def run(self):
+        while self._running:
+            sleep(self.flush_interval)
+            try:
+                self.write_queued()
+            except Exception:
+                # nowhere to log this to - drop the batch rather than kill the writer
+                pass
+
+    '''
+    @brief write out what is queued, then stop the writer
+    '''
+    def close(self):
+        if self._running:
+            self._running = False
+            self._thread.join(5)
+            self.write_queued()
+            self.writer.close()
+        logging.Handler.close(self)
+
+'''
+@brief adds the handler for a LOGGING section to logger and returns it
+'''
+def install_log_handler(logger, logging_config):
+    if logging_config.get('mode') == 'queue':
+        filename = None if logging_config['file'] == 'STDOUT' else logging_config['file']
+        writer = LogWriter(build_formatter(logging_config), filename, int(logging_config.get('max_bytes', 0)), int(logging_config.get('backup_count', 5)))
+        handler = QueueLogHandler(writer, int(logging_config.get('queue_size', 10000)), float(logging_config.get('flush_interval', 0.1)))
+        atexit.register(handler.close)
+    else:
+        handler = build_log_handler(logging_config)
+    logger.addHandler(handler)
+    return handler
+
+'''
+@brief wraps the logger of one behavior: DEBUG and INFO records are sampled (every sample_every-th) and rate limited (rate_limit per second)
+- WARNING and above always go through
+'''
+class BehaviorLog(object):
+
+    def __init__(self, log, sample_every=1, rate_limit=None):
+        self.log = log
+        self.sample_every = max(1, int(sample_every))
+        self.rate_limit = rate_limit
+        self._seen = 0
+        self._tokens = float(rate_limit or 0)
+        self._refilled = time()
+
+    def _allow(self, level):
+        if not self.log.isEnabledFor(level):
+            return False
+        self._seen += 1
+        if self._seen % self.sample_every:
+            return False
+        if self.rate_limit:
+            # token bucket: rate_limit records per second, bursts of up to rate_limit
+            current = time()
+            self._tokens = min(self.rate_limit, self._tokens + (current - self._refilled) * self.rate_limit)
+            self._refilled = current
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        return True
+
+    def isEnabledFor(self, level):
+        return self.log.isEnabledFor(level)
+
+    def debug(self, msg, *args, **kwargs):
+        if self._allow(logging.DEBUG):
+            self.log.debug(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self._allow(logging.INFO):
+            self.log.info(msg, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # warning, error, exception, ... are not limited
+        return getattr(self.log, name)
+
+'''
+@brief returns behavior_log(name), which gives the scheduler entry 'name' its (possibly limited) logger
+- Without sampling or rate limits in logging_config the behaviors log to 'log' directly
+'''
+def behavior_log_factory(log, logging_config):
+    defaults = {'sample_every': logging_config.get('sample_every', 1), 'rate_limit': logging_config.get('rate_limit')}
+    overrides = logging_config.get('behaviors') or {}
+    def behavior_log(name):
+        limits = dict(defaults)
+        limits.update(overrides.get(name) or {})
+        if int(limits['sample_every']) <= 1 and not limits['rate_limit']:
+            return log
+        return BehaviorLog(log, limits['sample_every'], limits['rate_limit'])
+    return behavior_log
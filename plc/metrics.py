@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Request, datastore and behavior metrics in Prometheus text format
+- Histograms have fixed bucket bounds and preallocated counts, so recording a value is a bisect and a few
+  additions - no allocation per request - and the metrics can stay on in production
+- Every histogram is recorded by one thread only (the reactor thread for requests and framing, the scheduler
+  thread for behaviors, and one histogram per thread for lock waits), so recording needs no lock
+- Enabled with 'metrics' in the MASTER section of the config: 'port' serves http://127.0.0.1:<port>/metrics,
+  'socket' serves the same over a Unix socket; every process serves its own endpoint (see metrics_config)
+- The request path resolves its histograms once (RequestStats per PLC device, a client histogram per connection),
+  so timing a request indexes a list by function code instead of looking up a label set
+'''
+import os, socket, logging
+from bisect import bisect_left
+from threading import Thread, Lock, current_thread
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import UnixStreamServer
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import UnixStreamServer
+
+# seconds, from 50us to 10s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# clients of a PLC device beyond this many distinct addresses are counted as 'other'
+MAX_CLIENTS = 64
+
+class Histogram(object):
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # one count per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    '''
+    @brief Prometheus text lines for this histogram with the given labels ('key="value",...')
+    '''
+    def render(self, name, labels):
+        prefix = labels + ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%sle="%s"} %d' % (name, prefix, repr(bound), cumulative))
+        lines.append('%s_bucket{%sle="+Inf"} %d' % (name, prefix, self.count))
+        lines.append('%s_sum{%s} %r' % (name, labels, self.sum))
+        lines.append('%s_count{%s} %d' % (name, labels, self.count))
+        return lines
+
+'''
+@brief the histograms of one behavior: how long its steps took, and how late they fired (see scheduler.py)
+'''
+class BehaviorStats(object):
+
+    def __init__(self):
+        self.steps = Histogram()
+        self.lag = Histogram()
+
+    def observe(self, seconds):
+        self.steps.observe(seconds)
+
+    def observe_lag(self, seconds):
+        self.lag.observe(seconds)
+
+'''
+@brief the request histograms of one PLC device, preallocated per function code and looked up by list index
+- A histogram for a function code is created on its first request; only the reactor (or event loop) thread records requests
+'''
+class RequestStats(object):
+
+    def __init__(self):
+        self.by_fc = [None] * 256
+        self.exceptions = [0] * 256
+        self.framing = Histogram()
+
+    '''
+    @brief one Modbus request of function code fc, executed in 'seconds' (decoded request to response written),
+        also recorded in the client histogram of its connection (see Metrics.client)
+    '''
+    def observe(self, fc, client, seconds, exception=False):
+        histogram = self.by_fc[fc]
+        if histogram is None:
+            histogram = self.by_fc[fc] = Histogram()
+        histogram.observe(seconds)
+        client.observe(seconds)
+        if exception:
+            self.exceptions[fc] += 1
+
+    '''
+    @brief time spent receiving and decoding a chunk of data, without the requests executed for it
+    '''
+    def observe_framing(self, seconds):
+        self.framing.observe(seconds)
+
+'''
+@brief the metrics of one process: requests per PLC device/function code/client, framing, datastore lock waits and behavior steps
+- Histograms for a new label set are created on first use (once), then reused; the request path holds on to
+  the RequestStats of its PLC device and the client histogram of its connection
+'''
+class Metrics(object):
+
+    def __init__(self):
+        self.requests = {}
+        self.clients = {}
+        # number of client series of each PLC device, 'other' not included
+        self.client_series = {}
+        self.lock_waits = {}
+        self.behaviors = {}
+        self.response_caches = {}
+        self._lock = Lock()
+
+    def _get(self, table, key, factory=Histogram):
+        value = table.get(key)
+        if value is None:
+            # creating a label set is rare - take the lock so a concurrent scrape never sees the dict change size
+            with self._lock:
+                value = table.setdefault(key, factory())
+        return value
+
+    '''
+    @brief the RequestStats of a PLC device (resolved once by its server factory)
+    '''
+    def plc_requests(self, plc):
+        return self._get(self.requests, plc, RequestStats)
+
+    '''
+    @brief the request histogram of a client (host) of a PLC device (resolved once per connection);
+        clients beyond MAX_CLIENTS per PLC device share 'other'
+    '''
+    def client(self, plc, client):
+        key = (plc, client)
+        if key not in self.clients:
+            if self.client_series.get(plc, 0) >= MAX_CLIENTS:
+                key = (plc, 'other')
+            else:
+                self.client_series[plc] = self.client_series.get(plc, 0) + 1
+        return self._get(self.clients, key)
+
+    '''
+    @brief how long a contended datastore write lock was waited for (see datastore.WriteLock.on_wait)
+    '''
+    def observe_lock_wait(self, plc, seconds):
+        self._get(self.lock_waits, (plc, current_thread().name)).observe(seconds)
+
+    '''
+    @brief the BehaviorStats a behavior's step times and lags go to (handed to BehaviorScheduler.add)
+    '''
+    def behavior(self, plc, name):
+        return self._get(self.behaviors, (plc, name), BehaviorStats)
+
+    '''
+    @brief export the hit/miss counters of a PLC device's server.ResponseCache
+    '''
+    def add_response_cache(self, plc, cache):
+        with self._lock:
+            self.response_caches[plc] = cache
+
+    '''
+    @brief hook the lock waits of every slave context of a ModbusServerContext up to these metrics
+    '''
+    def attach(self, plc, context):
+        for slave_id, slave in context:
+            lock = getattr(slave, 'write_lock', None)
+            if lock is not None:
+                lock.on_wait = lambda seconds: self.observe_lock_wait(plc, seconds)
+
+    def render(self):
+        with self._lock:
+            requests = sorted(self.requests.items())
+            clients = sorted(self.clients.items())
+            lock_waits = sorted(self.lock_waits.items())
+            behaviors = sorted(self.behaviors.items())
+            caches = sorted(self.response_caches.items())
+        lines = ['# HELP scadasim_request_seconds Modbus request execution time by function code',
+                 '# TYPE scadasim_request_seconds histogram']
+        for plc, stats in requests:
+            for fc, histogram in enumerate(stats.by_fc):
+                if histogram is not None:
+                    lines.extend(histogram.render('scadasim_request_seconds', 'plc="%s",fc="%d"' % (plc, fc)))
+        lines += ['# HELP scadasim_client_request_seconds Modbus request execution time by client address',
+                  '# TYPE scadasim_client_request_seconds histogram']
+        for (plc, client), histogram in clients:
+            lines.extend(histogram.render('scadasim_client_request_seconds', 'plc="%s",client="%s"' % (plc, client)))
+        lines += ['# HELP scadasim_request_exceptions_total Modbus exception responses by function code',
+                  '# TYPE scadasim_request_exceptions_total counter']
+        for plc, stats in requests:
+            for fc, count in enumerate(stats.exceptions):
+                if count:
+                    lines.append('scadasim_request_exceptions_total{plc="%s",fc="%d"} %d' % (plc, fc, count))
+        lines += ['# HELP scadasim_framing_seconds Time spent receiving and decoding request data',
+                  '# TYPE scadasim_framing_seconds histogram']
+        for plc, stats in requests:
+            lines.extend(stats.framing.render('scadasim_framing_seconds', 'plc="%s"' % plc))
+        lines += ['# HELP scadasim_datastore_lock_wait_seconds Time waited for a contended datastore write lock',
+                  '# TYPE scadasim_datastore_lock_wait_seconds histogram']
+        for (plc, thread), histogram in lock_waits:
+            lines.extend(histogram.render('scadasim_datastore_lock_wait_seconds', 'plc="%s",thread="%s"' % (plc, thread)))
+        lines += ['# HELP scadasim_behavior_seconds Execution time of one behavior step',
+                  '# TYPE scadasim_behavior_seconds histogram']
+        for (plc, name), stats in behaviors:
+            lines.extend(stats.steps.render('scadasim_behavior_seconds', 'plc="%s",behavior="%s"' % (plc, name)))
+        lines += ['# HELP scadasim_behavior_lag_seconds How late a behavior step fired after its scheduled deadline',
+                  '# TYPE scadasim_behavior_lag_seconds histogram']
+        for (plc, name), stats in behaviors:
+            lines.extend(stats.lag.render('scadasim_behavior_lag_seconds', 'plc="%s",behavior="%s"' % (plc, name)))
+        for metric, kind, help_text, field in (('scadasim_response_cache_hits_total', 'counter', 'Read requests answered from the response cache', 'hits'),
+                                               ('scadasim_response_cache_misses_total', 'counter', 'Read requests executed and put in the response cache', 'misses'),
+                                               ('scadasim_response_cache_evictions_total', 'counter', 'Response cache entries evicted to stay within its size', 'evictions')):
+            lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s %s' % (metric, kind)]
+            for plc, cache in caches:
+                lines.append('%s{plc="%s"} %d' % (metric, plc, getattr(cache, field)))
+        lines += ['# HELP scadasim_response_cache_hit_ratio Share of cacheable read requests answered from the response cache',
+                  '# TYPE scadasim_response_cache_hit_ratio gauge']
+        for plc, cache in caches:
+            lines.append('scadasim_response_cache_hit_ratio{plc="%s"} %r' % (plc, cache.hit_rate()))
+        return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return 'metrics client'
+
+    def log_message(self, format, *args):
+        pass
+
+class UnixHTTPServer(UnixStreamServer):
+
+    def get_request(self):
+        request, client_address = UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects an (address, port) pair
+        return request, ('unix', 0)
+
+'''
+@brief the endpoint of one of several processes serving the MASTER 'metrics' config: 'port' + offset, or the 'socket' path
+    with .<offset> appended (offset is the PLC id of an async_plc.py process, or the shard number of a supervisor shard)
+- None if metrics are not enabled
+'''
+def metrics_config(master_config, offset=None):
+    config = master_config.get('metrics')
+    if not config or offset is None:
+        return config
+    config = dict(config)
+    if 'port' in config:
+        config['port'] = int(config['port']) + int(offset)
+    if 'socket' in config:
+        config['socket'] = config['socket'] + '.' + str(offset)
+    return config
+
+'''
+@brief serve metrics in Prometheus text format from a daemon thread, as given by a metrics config
+- {port: 9200} listens on 127.0.0.1 (or 'address'); {socket: /run/scadasim/plc_0.sock} on a Unix socket
+'''
+def start_metrics_server(metrics, metrics_config, log=None):
+    log = log or logging.getLogger('metrics')
+    if metrics_config.get('socket'):
+        if os.path.exists(metrics_config['socket']):
+            os.remove(metrics_config['socket'])
+        server = UnixHTTPServer(metrics_config['socket'], MetricsHandler)
+        where = metrics_config['socket']
+    else:
+        server = HTTPServer((metrics_config.get('address', '127.0.0.1'), int(metrics_config['port'])), MetricsHandler)
+        where = '%s:%s' % server.server_address[:2]
+    server.metrics = metrics
+    thread = Thread(target=server.serve_forever, name='MetricsServer')
+    thread.daemon = True
+    thread.start()
+    log.info("Serving metrics on " + where)
+    return server
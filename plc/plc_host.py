@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Multi-PLC Host
+  Serves many PLC devices from one Python process and one Twisted reactor.
+  Every 'PLC N' section gets its own ModbusServerContext, backup thread and
+  listener on its own port, while the register behaviors of all of them share
+  one BehaviorScheduler. pymodbus/Twisted are imported once, and only the
+  hosted PLC sections are loaded from the compiled config cache.
+'''
+
+# --------------------------------------------------------------------------- #
+# import the libraries we need
+# --------------------------------------------------------------------------- #
+from twisted.internet import reactor
+from async_plc import *
+import logging, yaml
+import sys, os, argparse
+
+
+'''
+@brief turn a PLC id spec ('all', '3', '0,2,5-9') into a sorted list of PLC ids
+'''
+def parse_plc_ids(spec, num_of_plc):
+    if spec is None or spec == 'all':
+        return list(range(num_of_plc))
+    return parse_id_spec(spec)
+
+'''
+@brief sets up a logger for one PLC device from the LOGGING section of its config
+- Unlike configure_logging in async_plc.py this does not touch the root logger, so every PLC device keeps its own file, format and level
+- The LOGGING options of logqueue.py (queue mode, JSON-lines, rotation) apply per PLC device
+'''
+def configure_plc_logger(config_list, name):
+    log = logging.getLogger(name)
+    log.propagate = False
+    install_log_handler(log, config_list['LOGGING'])
+    configure_logging_level(config_list['LOGGING']['logging_level'], log)
+    return log
+
+'''
+@brief builds the context, threads and listener for every requested PLC device, then runs the shared reactor
+'''
+def run_plc_host(config_yaml, plc_ids, backup_dir, writer='host', restore_ts=None, capture_filename=None):
+    master_config = config_yaml.get('MASTER', {})
+    # one scheduler for every hosted PLC device, so the hosted PLC devices must agree on the 'policy' of their SCHEDULER sections
+    policies = set(scheduler_policy(config_yaml['PLC ' + str(num)]) for num in plc_ids)
+    if len(policies) > 1:
+        print("The hosted PLC devices share one scheduler but their SCHEDULER sections set different policies (" + ', '.join(sorted(policies)) + "). Exiting program.")
+        sys.exit()
+    scheduler = BehaviorScheduler(logging.getLogger('scheduler'), clock=make_clock(master_config.get('simulation')),
+                                  policy=policies.pop() if policies else 'catch_up')
+    journal = open_journal(master_config, writer, logging.getLogger('journal'), scheduler.clock)
+    shared = open_shared_registers(master_config)
+    # one capture file for every hosted PLC device, its records tell them apart by PLC id
+    capture = TrafficCapture(capture_filename) if capture_filename else None
+    if journal is None and restore_ts is not None:
+        print("--restore_ts needs a change journal ('journal' in the MASTER section of the config). Exiting program.")
+        sys.exit()
+    # one metrics endpoint for every hosted PLC device ('metrics' in the MASTER section), labelled by PLC id
+    metrics = None
+    if metrics_config(master_config):
+        metrics = Metrics()
+        start_metrics_server(metrics, metrics_config(master_config), logging.getLogger('metrics'))
+    for num in plc_ids:
+        plc_device_name = 'PLC ' + str(num)
+        config_list = config_yaml[plc_device_name]
+        backup_filename = os.path.join(backup_dir, 'backup_' + str(num) + '.yaml')
+        log = configure_plc_logger(config_list, plc_device_name)
+
+        datastore_config = None
+        if journal is not None:
+            datastore_config = journal_datastore_config(master_config, num, restore_ts or 'latest')
+        context = build_plc_context(config_list, backup_filename, datastore_config)
+        if journal is not None:
+            attach_journal(journal, num, context)
+        start_plc_threads(context, config_list, backup_filename, log, scheduler, metrics, num, simulation=master_config.get('simulation'), shared=shared)
+        start_plc_server(context, config_list['SERVER'], defer_reactor_run=True, metrics=metrics, plc_id=num, capture=capture)
+        print("Hosting " + plc_device_name + " on port " + str(config_list['SERVER']['port']))
+    if journal is not None:
+        journal.start()
+    scheduler.start()
+    reactor.run()
+
+'''
+@brief parse args, load the master config once, then call run_plc_host
+'''
+def main():
+    parser = argparse.ArgumentParser(description = "Host many PLC devices in one process")
+    parser.add_argument("--c", "--config_filename", help = "Name of the master config file")
+    parser.add_argument("--n", "--plc_ids", default = 'all', help = "PLC devices to host, e.g. 'all', '3' or '0,2,5-9' (default: all)")
+    parser.add_argument("--b", "--backup_dir", default = BACKUP_DIR, help = "Directory holding the backup_N.yaml files")
+    parser.add_argument("--restore_ts", default = None, help = "With a change journal configured: 'latest' (default) or the time to restore to (unix timestamp or 'YYYY-mm-dd HH:MM:SS')")
+    parser.add_argument("--capture", default = None, help = "Record every Modbus TCP request and response of the hosted PLC devices to this capture file (see capture.py)")
+    args = parser.parse_args()
+    if args.c is None:
+        print("Need to run plc_host.py with the --c argument. Run 'python plc_host.py --h' for help")
+        return
+    print( args )
+
+    # only the sections of the hosted PLC devices are loaded, from the compiled config cache (see configcache.py)
+    config_yaml = load_sections(args.c, ['MASTER'])
+
+    # pymodbus and twisted log through the root logger
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('scheduler').setLevel(logging.INFO)
+    plc_ids = parse_plc_ids(args.n, config_yaml['MASTER']['num_of_PLC'])
+    config_yaml.update(load_sections(args.c, ['PLC ' + str(num) for num in plc_ids]))
+    # one journal writer per set of hosted PLC devices, e.g. host_all or host_0_2_5-9
+    writer = 'host_' + args.n.replace(',', '_')
+    run_plc_host(config_yaml, plc_ids, args.b, writer, args.restore_ts, args.capture)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Record and replay of register trajectories
+- Set with 'simulation' in the MASTER section of the config, next to the clock settings (see simclock.py):
+    - seed: every random behavior gets its own generator seeded from (seed, PLC id, behavior name), see helper.behavior_rng_factory
+    - record: <dir> writes every datastore write of PLC N, with its sim time, to <dir>/trace_N.trace
+    - replay: <dir> drives PLC N's datastore from <dir>/trace_N.trace instead of running its behaviors
+- A seeded run in discrete mode with a fixed 'start' produces the same trace every time, so a recorded run can be
+  diffed against a later one, or replayed exactly into an IDS/test harness
+
+Trace layout: the change journal's record format (see journal.py), with the Modbus unit id in the PLC id field and
+the sim time as timestamp. A trace starts with a checkpoint of every table of every unit; values are uint16.
+'''
+import os, atexit
+from threading import Lock
+from time import time
+from datastore import TABLE_FX, plc_slaves, slave_context, snapshot_registers
+from journal import WRITE, CHECKPOINT, TABLES, pack_record, read_segment
+
+'''
+@brief the trace file of PLC device plc_id in trace_dir
+'''
+def trace_filename(trace_dir, plc_id):
+    return os.path.join(trace_dir, 'trace_' + str(plc_id) + '.trace')
+
+'''
+TraceRecorder appends every write to a PLC device's datastore to its trace file
+- attach() adds a write hook to every unit's slave context, so behavior, batch and client writes are all recorded
+- Records are buffered by the file object and flushed every 'flush_interval' wall seconds and at exit
+'''
+class TraceRecorder(object):
+
+    def __init__(self, filename, clock, flush_interval=1.0):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(filename, 'wb')
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._flushed = time()
+        atexit.register(self.close)
+
+    def attach(self, context):
+        for slave_id, slave in plc_slaves(context):
+            self.checkpoint(slave_id, slave)
+            slave.write_hooks.append(lambda table, address, values, slave_id=slave_id: self.write(slave_id, table, address, values))
+
+    def checkpoint(self, slave_id, slave):
+        tables = snapshot_registers(slave, slave_id, TABLES)
+        now = self.clock.now()
+        with self._lock:
+            for table in TABLES:
+                self.file.write(pack_record(CHECKPOINT, now, slave_id, table, 0x00, tables[table]))
+
+    def write(self, slave_id, table, address, values):
+        record = pack_record(WRITE, self.clock.now(), slave_id, table, address, values)
+        with self._lock:
+            if self.file.closed:
+                return
+            self.file.write(record)
+            if time() - self._flushed >= self.flush_interval:
+                self.file.flush()
+                self._flushed = time()
+
+    def close(self):
+        with self._lock:
+            if not self.file.closed:
+                self.file.close()
+
+'''
+replay_trace() is a scheduler behavior that writes the records of a trace back into the datastore
+- Each record is applied at its offset from the start of the trace, measured on the scheduler's SimClock,
+  so a trace recorded at any speed can be replayed in realtime, accelerated or discrete mode
+- The scheduler keeps absolute deadlines, so yielding the gap to the previous record keeps every record at its offset
+- Records of units the context does not serve are skipped
+'''
+def replay_trace(context, filename, log):
+    records = list(read_segment(filename))
+    log.info("Replaying " + str(len(records)) + " records from " + filename)
+    if not records:
+        return
+    slaves = dict(plc_slaves(context))
+    previous = records[0][1]
+    for kind, timestamp, slave_id, table, address, values in records:
+        if timestamp > previous:
+            yield timestamp - previous
+            previous = timestamp
+        if slave_id not in slaves:
+            continue
+        slave_context(context, slave_id).setValues(TABLE_FX[table], address, list(values))
+    log.info("Replay of " + filename + " finished")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Scenario behaviors: a behavior written as a list of phases in the config instead of in Python
+- A holding register behavior {'type': 'scenario', 'scenario': <name>} runs a scenario of the SCENARIOS section of the
+  PLC device's config (or a built-in one, see BUILTIN_SCENARIOS); {'type': 'scenario', 'phases': [...]} gives the phases inline
+- Phases ('type'), applied to the 'count' holding registers at 'address' of the behavior:
+    - ramp: add 'rate' every 'every' seconds (default 1), for 'steps' steps, or until every register reached 'until'
+      (registers never pass 'until')
+    - hold: leave the registers alone for 'for' seconds
+    - clamp: bring the registers into 'min'..'max'
+    - coil_set: write 'value' to the coil at 'address' (default: the behavior's coil_address)
+    - wait: until the coil at 'address' (default: coil_address) is 'value', at most 'timeout' seconds; a write to the
+      coil wakes the behavior, so a wait without timeout costs nothing until it ends
+- After a phase comes the next one in the list, or the phase named by its 'next'; a wait that timed out goes to 'on_timeout'
+  (default: 'next'). After the last phase the scenario starts over, unless the scenario has 'repeat: false'
+- A string where a number is expected names a key of the behavior's config, e.g. 'until: min', so one scenario serves
+  many PLC devices with different parameters
+- compile_scenario() turns the phases into a table of tuples with resolved transitions, once per scenario and parameters,
+  and ScenarioRunner steps through the table as a scheduler behavior: no thread, and a hold is one heap entry
+'''
+import yaml
+from datastore import read_co_register, write_co_register, update_hr_register, observe_registers
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+RAMP, HOLD, CLAMP, COIL_SET, WAIT = 'ramp', 'hold', 'clamp', 'coil_set', 'wait'
+
+BUILTIN_SCENARIOS = yaml.safe_load('''
+# drain the tank by 25 over 25 seconds with the coil (valve) open every 15 minutes, refill it to max every hour
+fuel_tank:
+  phases:
+    - {type: coil_set, value: 1, name: drain}
+    - {type: ramp, rate: -1, steps: 25, until: min}
+    - {type: coil_set, value: 0}
+    - {type: hold, for: 875}
+    - {type: coil_set, value: 1}
+    - {type: ramp, rate: -1, steps: 25, until: min}
+    - {type: coil_set, value: 0}
+    - {type: hold, for: 875}
+    - {type: coil_set, value: 1, name: refill}
+    - {type: ramp, rate: 1, steps: 100, until: max}
+    - {type: coil_set, value: 0}
+    - {type: hold, for: 900}
+''')
+
+_compiled = {}
+
+'''
+@brief a compiled scenario: phases is a list of tuples (type, index of the next phase or None, parameters...)
+- waits lists the coil addresses of its wait phases, whose writes have to wake the behavior
+'''
+class Scenario(object):
+
+    def __init__(self, name, phases):
+        self.name = name
+        self.phases = phases
+        self.waits = sorted(set(phase[2] for phase in phases if phase[0] == WAIT))
+
+'''
+@brief the phases of scenario 'name' from the SCENARIOS section of a config (scenarios), falling back to the built-in ones
+'''
+def scenario_definition(name, scenarios=None):
+    definition = (scenarios or {}).get(name, BUILTIN_SCENARIOS.get(name))
+    if definition is None:
+        raise ValueError("Unknown scenario '" + str(name) + "'")
+    return definition
+
+'''
+@brief compile the phases of a scenario for a behavior config (params); raises ValueError for an invalid scenario
+- definition is a list of phases or {'phases': [...], 'repeat': true}
+- With cache, a scenario is compiled once for every set of parameters it uses
+'''
+def compile_scenario(name, definition, params, cache=True):
+    if isinstance(definition, list):
+        definition = {'phases': definition}
+    phases = definition.get('phases') or []
+    key = None
+    if cache:
+        key = (name, tuple((param, params.get(param)) for param in sorted(_referenced(phases) | set(['coil_address']))))
+        if key in _compiled:
+            return _compiled[key]
+    if not phases:
+        raise ValueError("Scenario '" + str(name) + "' has no phases")
+
+    names = {}
+    for index, phase in enumerate(phases):
+        if 'name' in phase:
+            names[phase['name']] = index
+
+    def value(phase, field, default=KeyError):
+        v = phase.get(field, default)
+        if v is KeyError:
+            raise ValueError("Phase '" + str(phase.get('type')) + "' of scenario '" + str(name) + "' needs '" + field + "'")
+        if isinstance(v, string_types):
+            if v not in params:
+                raise ValueError("Scenario '" + str(name) + "' uses '" + v + "', which the behavior does not set")
+            v = params[v]
+        return v
+
+    def target(phase, field, index):
+        if phase.get(field) is None:
+            if index + 1 < len(phases):
+                return index + 1
+            return 0 if definition.get('repeat', True) else None
+        if phase[field] not in names:
+            raise ValueError("Scenario '" + str(name) + "' has no phase named '" + str(phase[field]) + "'")
+        return names[phase[field]]
+
+    compiled = []
+    for index, phase in enumerate(phases):
+        kind = phase.get('type')
+        after = target(phase, 'next', index)
+        if kind == RAMP:
+            steps = value(phase, 'steps', None)
+            until = value(phase, 'until', None)
+            if steps is None and until is None:
+                raise ValueError("A ramp of scenario '" + str(name) + "' needs 'steps' or 'until'")
+            compiled.append((RAMP, after, value(phase, 'rate'), value(phase, 'every', 1), steps, until))
+        elif kind == HOLD:
+            compiled.append((HOLD, after, value(phase, 'for')))
+        elif kind == CLAMP:
+            compiled.append((CLAMP, after, value(phase, 'min'), value(phase, 'max')))
+        elif kind == COIL_SET:
+            compiled.append((COIL_SET, after, value(phase, 'address', 'coil_address'), value(phase, 'value')))
+        elif kind == WAIT:
+            on_timeout = target(phase, 'on_timeout', index) if 'on_timeout' in phase else after
+            compiled.append((WAIT, after, value(phase, 'address', 'coil_address'), value(phase, 'value'), value(phase, 'timeout', None), on_timeout))
+        else:
+            raise ValueError("Unknown phase type '" + str(kind) + "' in scenario '" + str(name) + "'")
+
+    scenario = Scenario(name, compiled)
+    if key is not None:
+        _compiled[key] = scenario
+    return scenario
+
+'''
+@brief the compiled scenario of a 'scenario' behavior config: its inline 'phases', or the scenario named by 'scenario'
+'''
+def scenario_for(behavior_config, scenarios=None):
+    if 'phases' in behavior_config:
+        definition = {'phases': behavior_config['phases'], 'repeat': behavior_config.get('repeat', True)}
+        return compile_scenario('inline', definition, behavior_config, cache=False)
+    name = behavior_config['scenario']
+    return compile_scenario(name, scenario_definition(name, scenarios), behavior_config)
+
+def _referenced(phases):
+    return set(v for phase in phases for field, v in phase.items()
+               if field not in ('type', 'name', 'next', 'on_timeout') and isinstance(v, string_types))
+
+def ramp_values(values, rate, until):
+    if until is None:
+        return [v + rate for v in values]
+    if rate < 0:
+        return [max(v + rate, until) if v > until else v for v in values]
+    return [min(v + rate, until) if v < until else v for v in values]
+
+'''
+ScenarioRunner steps one behavior through a compiled scenario
+- run() is the scheduler behavior; 'waiting' is True while a wait phase waits for its coil
+'''
+class ScenarioRunner(object):
+
+    def __init__(self, scenario, address, slave_id, count, context, log, clock):
+        self.scenario = scenario
+        self.address = address
+        self.slave_id = slave_id
+        self.count = count
+        self.context = context
+        self.log = log
+        self.clock = clock
+        self.waiting = False
+
+    def run(self):
+        phases = self.scenario.phases
+        context, slave_id, address, count = self.context, self.slave_id, self.address, self.count
+        index = 0
+        # phases entered since time last passed: more than a round of them is a scenario that never waits
+        instant = 0
+        while index is not None:
+            phase = phases[index]
+            kind, after = phase[0], phase[1]
+            instant += 1
+            if instant > len(phases):
+                raise ValueError("Scenario '" + str(self.scenario.name) + "' loops without letting time pass")
+
+            if kind == RAMP:
+                rate, every, steps, until = phase[2:]
+                step = 0
+                while True:
+                    values = update_hr_register(context, slave_id, address, count, lambda values: ramp_values(values, rate, until))
+                    self.log.debug(values)
+                    step += 1
+                    yield every
+                    if steps is not None and step >= steps:
+                        break
+                    if steps is None and all(v == until for v in values):
+                        break
+                instant = 0
+            elif kind == HOLD:
+                yield phase[2]
+                instant = 0
+            elif kind == CLAMP:
+                low, high = phase[2:]
+                values = update_hr_register(context, slave_id, address, count, lambda values: [min(max(v, low), high) for v in values])
+                self.log.debug(values)
+            elif kind == COIL_SET:
+                write_co_register(context, slave_id, phase[2], [phase[3]])
+            elif kind == WAIT:
+                coil, value, timeout, on_timeout = phase[2:]
+                deadline = None if timeout is None else self.clock.now() + timeout
+                while bool(read_co_register(context, slave_id, coil, 1)[0]) != bool(value):
+                    remaining = None if deadline is None else deadline - self.clock.now()
+                    if remaining is not None and remaining <= 0:
+                        after = on_timeout
+                        break
+                    # parked (or queued until the timeout) until a write to the coil wakes it
+                    self.waiting = True
+                    yield remaining
+                    self.waiting = False
+                    instant = 0
+            index = after
+        self.log.info("Scenario " + str(self.scenario.name) + " finished")
+
+'''
+@brief the scheduler behavior of a scenario; the caller adds it to the scheduler with wakeable=True
+- Writes to the coils of wait phases wake the behavior while it waits
+'''
+def scenario_behavior(scenario, address, slave_id, count, context, log, scheduler):
+    runner = ScenarioRunner(scenario, address, slave_id, count, context, log, scheduler.clock)
+    behavior = runner.run()
+    for coil in scenario.waits:
+        observe_registers(context, slave_id, 'co', coil, 1, lambda table, address, values: runner.waiting and scheduler.wake(behavior))
+    return behavior
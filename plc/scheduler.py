@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Behavior scheduler
+- Keeps every register behavior of one or more PLC devices in a single heap keyed by next-fire time
+- One worker thread pops the earliest behavior, advances it by one step and pushes it back with its new fire time
+- A behavior is a generator (see helper.py): every 'yield' returns the number of seconds until its next step
+- The worker blocks in select() on a wakeup pipe, so it sleeps exactly until the next behavior is due and
+  can be woken early when a behavior is added
+- Fire times are in sim time (see simclock.py): with an accelerated clock the worker waits 1/speed as long,
+  and with a discrete clock it does not wait at all but advances the clock to the next fire time
+- Steps are scheduled against absolute deadlines: the next step of a behavior is due 'delay' after the deadline
+  of its last step, not after the step ran, so step time and scheduling delay do not add up to drift over hours
+- When a behavior falls behind (its next deadline has already passed) the policy decides:
+    - catch_up (default): missed steps run back to back until the behavior is on its deadlines again
+    - skip: missed steps are dropped and the behavior continues at its next deadline still ahead
+- How late every step fired (actual - scheduled, in wall seconds) goes to the behavior's stats (see metrics.BehaviorStats),
+  and the largest lag and the number of skipped steps are part of the periodic rate report
+- Event driven behaviors (added with wakeable=True) can 'yield None' to park until wake() is called, e.g. by a
+  datastore observer (see datastore.py); wake() also pulls a behavior that is waiting for its next step forward to now
+- aioserver.LoopScheduler drives the same heap from an asyncio event loop instead of the worker thread
+'''
+import os, errno, fcntl, select, heapq, itertools, logging
+from threading import Thread, Lock
+from time import time
+from simclock import SimClock
+
+POLICIES = ('catch_up', 'skip')
+
+class BehaviorScheduler(object):
+
+    '''
+    @brief log is used for the periodic rate report; report_interval is in wall seconds (0 disables the report)
+    - clock is the SimClock behaviors are scheduled on (realtime if not given)
+    - policy is what happens to the missed steps of a behavior that fell behind, one of POLICIES
+    '''
+    def __init__(self, log=None, report_interval=60, clock=None, policy='catch_up'):
+        if policy not in POLICIES:
+            raise ValueError("Unknown scheduler policy '" + str(policy) + "' (one of " + ', '.join(POLICIES) + ")")
+        self.log = log or logging.getLogger('scheduler')
+        self.clock = clock or SimClock()
+        self.report_interval = report_interval
+        self.policy = policy
+        self.serviced = 0
+        self.skipped = 0
+        self.rate = 0.0
+        self.max_lag = 0.0
+        self._heap = []
+        self._lock = Lock()
+        # event driven behaviors: (seq of the valid heap entry, name, log, stats) of each queued one, the parked ones, the one being stepped
+        self._wakeable = set()
+        self._queued = {}
+        self._parked = {}
+        self._active = None
+        self._woken = False
+        self._seq = itertools.count()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        fcntl.fcntl(self._wakeup_w, fcntl.F_SETFL, fcntl.fcntl(self._wakeup_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._thread = None
+        self._running = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    '''
+    @brief add a behavior generator; its first step runs after 'delay' seconds
+    - stats, if given, is a metrics.BehaviorStats every step's execution time and lag are recorded in
+    - wakeable behaviors can be woken with wake(behavior)
+    '''
+    def add(self, name, behavior, log=None, delay=0, stats=None, wakeable=False):
+        with self._lock:
+            entry = (self.clock.now() + delay, next(self._seq), name, behavior, log or self.log, stats)
+            heapq.heappush(self._heap, entry)
+            if wakeable:
+                self._wakeable.add(behavior)
+                self._queued[behavior] = (entry[1], name, entry[4], stats)
+            is_head = self._heap[0] is entry
+        # only the worker's current timeout can be too long, and only if the new behavior is now the earliest
+        if is_head and self._running:
+            self._wakeup()
+
+    '''
+    @brief step a wakeable behavior now: a parked one is queued again, a queued one is moved forward
+    - With parked_only=True only a parked behavior is woken (e.g. for writes that matter only while it is idle)
+    - Safe to call from any thread, including from inside the behavior's own step
+    '''
+    def wake(self, behavior, parked_only=False):
+        with self._lock:
+            if behavior in self._parked:
+                name, log, stats = self._parked.pop(behavior)
+            elif parked_only:
+                return
+            elif behavior is self._active:
+                # stepped right after its current step
+                self._woken = True
+                return
+            elif behavior in self._queued:
+                # the old heap entry stays behind and is skipped when popped
+                seq, name, log, stats = self._queued[behavior]
+            else:
+                return
+            entry = (self.clock.now(), next(self._seq), name, behavior, log, stats)
+            heapq.heappush(self._heap, entry)
+            self._queued[behavior] = (entry[1], name, log, stats)
+            is_head = self._heap[0] is entry
+        if is_head and self._running:
+            self._wakeup()
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self.run, name='BehaviorScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError as e:
+            # pipe already full means the worker has a wakeup pending anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    '''
+    @brief block until the earliest behavior is due (fire_at, sim time) or the report is due (report_at, wall time), or until woken up by add()/stop()
+    - With a discrete clock nothing is waited for: the clock jumps to fire_at
+    '''
+    def _wait(self, fire_at, report_at):
+        timeout = None
+        if fire_at is not None:
+            if self.clock.discrete:
+                self.clock.advance_to(fire_at)
+                timeout = 0
+            else:
+                timeout = self.clock.real_seconds(fire_at - self.clock.now())
+        if report_at is not None:
+            timeout = report_at - time() if timeout is None else min(timeout, report_at - time())
+        if timeout is not None and timeout <= 0:
+            if self.clock.discrete:
+                # still pick up a wakeup from stop(), without blocking
+                self._drain_wakeup()
+            return
+        readable, _, _ = select.select([self._wakeup_r], [], [], timeout)
+        if readable:
+            os.read(self._wakeup_r, 4096)
+
+    def _drain_wakeup(self):
+        readable, _, _ = select.select([self._wakeup_r], [], [], 0)
+        if readable:
+            os.read(self._wakeup_r, 4096)
+
+    '''
+    @brief the deadline of the step after one due at fire_at, 'delay' sim seconds later, as the policy has it
+    '''
+    def _next_deadline(self, fire_at, delay, now):
+        deadline = fire_at + delay
+        if deadline < now and self.policy == 'skip' and delay > 0:
+            missed = int((now - deadline) // delay) + 1
+            self.skipped += missed
+            deadline += missed * delay
+        return deadline
+
+    '''
+    @brief advance one behavior by one step (due at fire_at), then push it back on the heap (or park it, if it yielded None)
+    - A behavior that returns is dropped; a behavior that raises is logged and dropped
+    '''
+    def _service(self, fire_at, name, behavior, log, stats):
+        lag = self.clock.real_seconds(self.clock.now() - fire_at)
+        if lag is not None and lag > self.max_lag:
+            self.max_lag = lag
+        try:
+            if stats is None:
+                delay = next(behavior)
+            else:
+                start = time()
+                delay = next(behavior)
+                stats.observe(time() - start)
+                if lag is not None:
+                    stats.observe_lag(lag)
+        except StopIteration:
+            log.info("Behavior " + name + " finished")
+            self._done(behavior)
+            return
+        except Exception:
+            log.exception("Behavior " + name + " failed and was removed from the scheduler")
+            self._done(behavior)
+            return
+        now = self.clock.now()
+        with self._lock:
+            if behavior is self._active:
+                self._active = None
+                if self._woken:
+                    # a wake-up starts a new series of deadlines
+                    self._woken = False
+                    fire_at, delay = now, 0
+                elif delay is None:
+                    self._parked[behavior] = (name, log, stats)
+                    return
+                entry = (self._next_deadline(fire_at, delay, now), next(self._seq), name, behavior, log, stats)
+                self._queued[behavior] = (entry[1], name, log, stats)
+            else:
+                entry = (self._next_deadline(fire_at, delay, now), next(self._seq), name, behavior, log, stats)
+            heapq.heappush(self._heap, entry)
+
+    def _done(self, behavior):
+        with self._lock:
+            self._wakeable.discard(behavior)
+            if behavior is self._active:
+                self._active = None
+                self._woken = False
+
+    '''
+    @brief pop the earliest behavior if it is due; returns (heap entry or None, fire_at of the earliest behavior or None)
+    - Entries superseded by wake() are dropped on the way
+    '''
+    def _pop_due(self):
+        with self._lock:
+            while self._heap:
+                fire_at = self._heap[0][0]
+                if fire_at > self.clock.now():
+                    return None, fire_at
+                entry = heapq.heappop(self._heap)
+                if entry[3] in self._wakeable:
+                    queued = self._queued.get(entry[3])
+                    if queued is None or queued[0] != entry[1]:
+                        # superseded by wake()
+                        continue
+                    del self._queued[entry[3]]
+                    self._active = entry[3]
+                return entry, fire_at
+            return None, None
+
+    def _start_report(self):
+        self._report_start = time()
+        self._report_serviced = self.serviced
+        self._report_skipped = self.skipped
+
+    '''
+    @brief the wall time the next rate report is due, or None without reports
+    '''
+    def _report_at(self):
+        return self._report_start + self.report_interval if self.report_interval else None
+
+    '''
+    @brief report how many behaviors were serviced per (wall) second, if the report is due
+    '''
+    def _report(self):
+        elapsed = time() - self._report_start
+        if self.report_interval and elapsed >= self.report_interval:
+            self.rate = (self.serviced - self._report_serviced) / elapsed
+            self.log.info("Behavior scheduler serviced %.1f behaviors/sec (%d scheduled, max lag %.3fs, %d steps skipped)"
+                          % (self.rate, len(self._heap), self.max_lag, self.skipped - self._report_skipped))
+            self._start_report()
+            self.max_lag = 0.0
+
+    def run(self):
+        self._start_report()
+        while self._running:
+            entry, fire_at = self._pop_due()
+            if entry is None:
+                self._wait(fire_at, self._report_at())
+            else:
+                self._service(entry[0], entry[2], entry[3], entry[4], entry[5])
+                self.serviced += 1
+            self._report()
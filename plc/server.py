@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Modbus TCP server for the PLC devices
+- The same protocol as pymodbus' asynchronous TCP server (ModbusTcpProtocol), with a hook point in the request path
+- With a metrics.Metrics object, every request is timed per function code and client, and the time spent
+  receiving/decoding data is recorded separately as framing time
+- With a ResponseCache ('response_cache: <entries>' in the SERVER section), read requests (function codes 1-4) are
+  answered from encoded response PDUs keyed on (function code, unit, address, count):
+    - An entry holds the generation counter of its table (see datastore.PLCSlaveContext) read before the request
+      was executed, so any write to the table since makes it stale - the counter is bumped after the values are set
+    - Requests that arrive as whole MBAP frames are looked up before pymodbus decodes them; a miss (or anything
+      else) goes through the normal path, which fills the cache
+    - The cache is only used from the reactor (or event loop) thread, so it needs no lock
+- With a capture.TrafficCapture, every request frame received and every response frame sent is recorded with its
+  connection (see capture.py)
+- The request path is in PLCRequestHandler, so the asyncio server mode (see aioserver.py) serves requests the same way
+'''
+import struct, logging
+from collections import OrderedDict
+from pymodbus.server.asynchronous import ModbusTcpProtocol, ModbusServerFactory
+from pymodbus.framer.socket_framer import ModbusSocketFramer
+from pymodbus.exceptions import NoSuchSlaveException
+from capture import FrameSplitter, REQUEST, RESPONSE, DISCONNECT
+from time import time as now
+
+# the table read by each cacheable function code
+READ_TABLES = {1: 'co', 2: 'di', 3: 'hr', 4: 'ir'}
+
+# MBAP header (transaction id, protocol id, length, unit id) and a whole read request: function code, address, count
+MBAP = struct.Struct('>HHHB')
+READ_REQUEST = struct.Struct('>HHHBBHH')
+
+'''
+@brief bounded LRU cache of encoded read response PDUs, each valid for one generation of its table
+'''
+class ResponseCache(object):
+
+    def __init__(self, size=1024):
+        self.size = int(size)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    '''
+    @brief the cached PDU for key if it is still at 'generation', else None
+    '''
+    def get(self, key, generation):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != generation:
+            return None
+        # most recently used go to the end
+        del self.entries[key]
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    '''
+    @brief store the PDU of a read that missed the cache, evicting the least recently used entry if full
+    '''
+    def put(self, key, generation, pdu):
+        self.misses += 1
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = (generation, pdu)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+'''
+@brief the request path of the PLC device servers: cache, capture and metrics around pymodbus' request execution
+- Shared by PLCTcpProtocol (Twisted) and the asyncio protocol of aioserver.py, which provide self.factory (a PLCServerFactory),
+  self.framer, self.transport, _process(data) (framing) and _run(request) (execution, which calls _send with the response)
+'''
+class PLCRequestHandler(object):
+
+    def _connected(self, host, port):
+        self.client = host
+        if self.factory.metrics is not None:
+            # the histogram of this client, resolved once for the connection
+            self.client_requests = self.factory.metrics.client(self.factory.plc_id, host)
+        self.executed = 0.0
+        self.exception = False
+        # (key, generation) of the read being executed, to put its response in the cache
+        self.fill = None
+        if self.factory.capture is not None:
+            self.connection = self.factory.capture.connect(self.factory.plc_id, (host, port))
+            self.splitter = FrameSplitter() if isinstance(self.framer, ModbusSocketFramer) else None
+
+    def _disconnected(self):
+        if self.factory.capture is not None:
+            self.factory.capture.record(DISCONNECT, self.connection, self.factory.plc_id, b'')
+
+    def _received(self, data):
+        capture = self.factory.capture
+        if capture is not None:
+            # other framers' data is recorded as it came in
+            for frame in (self.splitter.feed(data) if self.splitter is not None else [data]):
+                capture.record(REQUEST, self.connection, self.factory.plc_id, frame)
+        requests = self.factory.requests
+        if requests is None:
+            if self.factory.cache is not None:
+                data = self._serve_cached(data)
+            if data:
+                self._process(data)
+            return
+        start = now()
+        self.executed = 0.0
+        if self.factory.cache is not None:
+            data = self._serve_cached(data)
+        if data:
+            self._process(data)
+        # whatever was not spent executing requests went to framing
+        requests.observe_framing(now() - start - self.executed)
+
+    '''
+    @brief answer the whole read requests at the start of data from the cache; returns the data left for the framer
+    '''
+    def _serve_cached(self, data):
+        # only at a frame boundary, with no partial frame buffered
+        if not isinstance(self.framer, ModbusSocketFramer) or self.framer._buffer or self.factory.control.ListenOnly:
+            return data
+        cache = self.factory.cache
+        store = self.factory.store
+        requests = self.factory.requests
+        while len(data) >= READ_REQUEST.size:
+            start = now()
+            transaction_id, protocol_id, length, unit, fc, address, count = READ_REQUEST.unpack_from(data)
+            if protocol_id != 0 or length != 6 or fc not in READ_TABLES:
+                break
+            try:
+                generation = getattr(store[unit], 'generation', None)
+            except NoSuchSlaveException:
+                break
+            if generation is None:
+                break
+            pdu = cache.get((fc, unit, address, count), generation[READ_TABLES[fc]])
+            if pdu is None:
+                break
+            self.factory.control.Counter.BusMessage += 1
+            self._write(MBAP.pack(transaction_id, protocol_id, len(pdu) + 1, unit) + pdu)
+            data = data[READ_REQUEST.size:]
+            if requests is not None:
+                elapsed = now() - start
+                self.executed += elapsed
+                requests.observe(fc, self.client_requests, elapsed)
+        return data
+
+    def _execute(self, request):
+        self.fill = None
+        if self.factory.cache is not None and request.function_code in READ_TABLES:
+            try:
+                generation = getattr(self.factory.store[request.unit_id], 'generation', None)
+            except NoSuchSlaveException:
+                generation = None
+            if generation is not None:
+                # read before executing: a write during the request leaves the entry stale, never wrong
+                key = (request.function_code, request.unit_id, request.address, request.count)
+                self.fill = (key, generation[READ_TABLES[request.function_code]])
+        requests = self.factory.requests
+        if requests is None:
+            return self._run(request)
+        start = now()
+        self.exception = False
+        self._run(request)
+        elapsed = now() - start
+        self.executed += elapsed
+        requests.observe(request.function_code, self.client_requests, elapsed, self.exception)
+
+    def _send(self, message):
+        # exception responses carry the function code with the high bit set
+        self.exception = message.function_code > 0x80
+        fill, self.fill = self.fill, None
+        if not message.should_respond:
+            return
+        self.factory.control.Counter.BusMessage += 1
+        packet = self.framer.buildPacket(message)
+        if fill is not None and not self.exception:
+            self.factory.cache.put(fill[0], fill[1], packet[MBAP.size:])
+        return self._write(packet)
+
+    def _write(self, packet):
+        if self.factory.capture is not None:
+            self.factory.capture.record(RESPONSE, self.connection, self.factory.plc_id, packet)
+        return self.transport.write(packet)
+
+class PLCTcpProtocol(PLCRequestHandler, ModbusTcpProtocol):
+
+    def connectionMade(self):
+        ModbusTcpProtocol.connectionMade(self)
+        peer = self.transport.getPeer()
+        self._connected(peer.host, peer.port)
+
+    def connectionLost(self, reason):
+        ModbusTcpProtocol.connectionLost(self, reason)
+        self._disconnected()
+
+    def dataReceived(self, data):
+        self._received(data)
+
+    def _process(self, data):
+        ModbusTcpProtocol.dataReceived(self, data)
+
+    def _run(self, request):
+        ModbusTcpProtocol._execute(self, request)
+
+class PLCServerFactory(ModbusServerFactory):
+
+    protocol = PLCTcpProtocol
+
+    def __init__(self, store, framer=None, identity=None, metrics=None, plc_id=0, cache=None, capture=None, **kwargs):
+        ModbusServerFactory.__init__(self, store, framer, identity, **kwargs)
+        self.metrics = metrics
+        self.plc_id = plc_id
+        # the request histograms of this PLC device (see metrics.RequestStats)
+        self.requests = metrics.plc_requests(plc_id) if metrics is not None else None
+        self.cache = cache
+        self.capture = capture
+
+'''
+@brief listen for Modbus TCP on address (interface, port) with the reactor - what StartTcpServer(defer_reactor_run=True) does, with metrics
+- cache_size > 0 answers repeated reads from a ResponseCache of that many entries; its hit rate goes to the metrics
+  (if given) and is logged every report_interval seconds
+- capture (capture.TrafficCapture), if given, records the server's traffic
+'''
+def listen_tcp(context, address, framer=None, identity=None, metrics=None, plc_id=0, cache_size=None, report_interval=60, capture=None):
+    from twisted.internet import reactor
+    cache = response_cache(cache_size, metrics, plc_id)
+    if cache is not None and report_interval:
+        from twisted.internet.task import LoopingCall
+        LoopingCall(report_cache, cache, plc_id, logging.getLogger('server')).start(report_interval, now=False)
+    factory = PLCServerFactory(context, framer, identity, metrics, plc_id, cache, capture)
+    return reactor.listenTCP(int(address[1]), factory, interface=address[0])
+
+'''
+@brief the ResponseCache for a 'response_cache: <entries>' setting (None if not set), with its hit rate in the metrics if given
+'''
+def response_cache(cache_size, metrics=None, plc_id=0):
+    if not cache_size:
+        return None
+    cache = ResponseCache(cache_size)
+    if metrics is not None:
+        metrics.add_response_cache(plc_id, cache)
+    return cache
+
+def report_cache(cache, plc_id, log):
+    log.info("PLC %s response cache: %.1f%% hits (%d hits, %d misses, %d evictions, %d entries)"
+             % (plc_id, 100 * cache.hit_rate(), cache.hits, cache.misses, cache.evictions, len(cache.entries)))
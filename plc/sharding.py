@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+'''
+Sharded fleet placement
+- In sharded mode (supervisor.py --shards K) the PLC devices are split across K worker processes, each hosting
+  its share in one reactor and one BehaviorScheduler like plc_host.py, so the fleet uses K cores without a process per PLC device
+- plc_load() estimates the load of a PLC device as the sum over its behaviors (of every unit) of registers x steps per second,
+  plus BASE_LOAD for its listener, so PLC devices without behaviors still spread out
+- plan_shards() places the heaviest PLC devices first, each on the currently least loaded shard (longest processing time first)
+'''
+import os, subprocess
+from helper import unit_datastores
+
+BASE_LOAD = 1.0
+
+'''
+@brief registers x steps per second of the 'hr' and 'co' behaviors of one DATASTORE section
+- A behavior with 'time: 0' (e.g. fuel_tank_behavior, which paces itself) counts as one step per second
+'''
+def datastore_load(datastore_config):
+    load = 0.0
+    for table in ('hr', 'co'):
+        for name, behavior in (datastore_config.get(table) or {}).items():
+            if not name.startswith('behavior_') or not isinstance(behavior, dict) or behavior.get('type', 'none') == 'none':
+                continue
+            period = float(behavior.get('time') or 0) or 1.0
+            load += int(behavior.get('count', 1)) / period
+    return load
+
+def plc_load(config_list):
+    units = unit_datastores(config_list)
+    if units is None:
+        return BASE_LOAD + datastore_load(config_list['DATASTORE'])
+    return BASE_LOAD + sum(datastore_load(datastore_config) for unit, datastore_config in units)
+
+'''
+@brief splits loads ({PLC id: estimated load}) into at most k shards, returned as [(sorted PLC ids, total load)]
+'''
+def plan_shards(loads, k):
+    k = max(1, min(k, len(loads)))
+    shards = [([], 0.0) for i in range(k)]
+    for plc_id in sorted(loads, key=lambda plc_id: (-loads[plc_id], plc_id)):
+        i = min(range(k), key=lambda i: (shards[i][1], i))
+        shards[i] = (shards[i][0] + [plc_id], shards[i][1] + loads[plc_id])
+    return [(sorted(plc_ids), load) for plc_ids, load in shards]
+
+'''
+@brief the CPUs this process may run on
+'''
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    import multiprocessing
+    return list(range(multiprocessing.cpu_count()))
+
+'''
+@brief pins process pid to the given CPUs (with taskset where os.sched_setaffinity is not available); returns False if it could not
+'''
+def set_cpu_affinity(pid, cpus):
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(pid, cpus)
+            return True
+        except OSError:
+            return False
+    try:
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.call(['taskset', '-p', '-c', ','.join(str(cpu) for cpu in cpus), str(pid)], stdout=devnull, stderr=devnull) == 0
+        finally:
+            devnull.close()
+    except OSError:
+        return False
+
+'''
+@brief user + system CPU seconds used so far by process pid, read from /proc
+'''
+def cpu_seconds(pid):
+    try:
+        stat = open('/proc/' + str(pid) + '/stat')
+    except IOError:
+        return 0.0
+    fields = stat.read().rsplit(')', 1)[1].split()
+    stat.close()
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat, the 12th and 13th after the command name
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
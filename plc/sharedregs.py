@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+'''
+Shared-memory register tables for cross-PLC dependencies
+- With 'shared_memory: {dir: /dev/shm/scadasim}' in the MASTER section, every PLC device exports its register tables
+  to <dir>/plc_N.state, a live-state file (see livestate.py) that every write to its datastore is mirrored into
+- Behaviors of other PLC devices map that file read-only and read a coil or register straight out of it, with no
+  Modbus round trip; e.g. 'coil_plc: 3' on a linear_coil_dependent/random_coil_dependent behavior makes it follow
+  coil 'coil_address' of PLC 3 instead of its own
+- Works the same whether the PLC devices run one per process (async_plc.py, supervisor.py) or several per process
+  (plc_host.py, supervisor.py --shards), since every reader goes through the mapped file
+- A restarted PLC device re-creates its file; readers notice the new file within RECHECK_INTERVAL seconds, remap it
+  and close the mapping of the old one, so a PLC device restarting over and over does not pile up mappings
+- Only single-unit PLC devices are exported (a PLC section with UNITS is not)
+'''
+import os
+from threading import Lock
+from time import time
+from datastore import locked, snapshot_registers
+from livestate import LiveStateFile, TABLES
+
+DEFAULT_DIR = '/dev/shm/scadasim'
+RECHECK_INTERVAL = 1.0
+
+class SharedRegisters(object):
+
+    def __init__(self, shared_dir=DEFAULT_DIR):
+        self.dir = shared_dir
+        if not os.path.isdir(shared_dir):
+            try:
+                os.makedirs(shared_dir)
+            except OSError:
+                if not os.path.isdir(shared_dir):
+                    raise
+        self._lock = Lock()
+        self._states = {}
+
+    def filename(self, plc_id):
+        return os.path.join(self.dir, 'plc_' + str(plc_id) + '.state')
+
+    '''
+    @brief exports the register tables of PLC device plc_id and mirrors every later write into them
+    '''
+    def export(self, plc_id, context):
+        if not context.single:
+            print("Shared memory does not cover UNITS - the registers of PLC " + str(plc_id) + " are not shared")
+            return None
+        slave = context[0]
+        # under the write lock, so no write falls between the copy and the hook
+        with locked(slave):
+            tables = snapshot_registers(slave, 0x00, TABLES)
+            state = LiveStateFile.create(self.filename(plc_id), dict((table, {'start_addr': 1, 'values': tables[table]}) for table in TABLES))
+            slave.write_hooks.append(state.write)
+        return state
+
+    '''
+    @brief count values of 'table' at a zero-based address of PLC device plc_id, or None while it has not exported its tables yet
+    '''
+    def read(self, plc_id, table, address, count):
+        state = self._state(plc_id)
+        if state is None:
+            return None
+        try:
+            return state.read(table, address, count)
+        except ValueError:
+            # another thread remapped the file and closed this mapping in between - read the new one
+            state = self._state(plc_id)
+            return state.read(table, address, count)
+
+    def _state(self, plc_id):
+        entry = self._states.get(plc_id)
+        now = time()
+        if entry is not None and now - entry[2] < RECHECK_INTERVAL:
+            return entry[0]
+        with self._lock:
+            filename = self.filename(plc_id)
+            try:
+                inode = os.stat(filename).st_ino
+            except OSError:
+                return entry and entry[0]
+            if entry is None or entry[1] != inode:
+                old = entry
+                try:
+                    entry = [LiveStateFile(filename, writable=False), inode, now]
+                except (IOError, OSError, ValueError):
+                    return entry and entry[0]
+                self._states[plc_id] = entry
+                if old is not None:
+                    old[0].close()
+            else:
+                entry[2] = now
+            self._states[plc_id] = entry
+        return entry[0]
+
+'''
+@brief the SharedRegisters of the 'shared_memory' section of the MASTER config, or None without one
+'''
+def open_shared_registers(master_config):
+    shared_config = master_config.get('shared_memory')
+    if not shared_config:
+        return None
+    if not isinstance(shared_config, dict):
+        shared_config = {}
+    return SharedRegisters(shared_config.get('dir', DEFAULT_DIR))
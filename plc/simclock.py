@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Simulation clock
+- Behaviors and the backup writer take their time from a SimClock instead of the wall clock
+- Modes, set with 'simulation' in the MASTER section of the config:
+    - realtime (default): sim time is wall time
+    - accelerated: sim time runs 'speed' times faster than wall time, e.g. MASTER: {simulation: {mode: accelerated, speed: 60}}
+    - discrete: as fast as possible - the BehaviorScheduler jumps sim time straight to the next scheduled step
+      instead of waiting for it, so a 24 hour scenario runs in seconds
+- 'start' (a unix timestamp or 'YYYY-mm-dd HH:MM:SS' in local time) sets the sim time the accelerated and discrete clocks start at
+'''
+from time import time, sleep, mktime, strptime
+
+MODES = ('realtime', 'accelerated', 'discrete')
+
+# how often (wall seconds) a thread sleeping on the discrete clock checks whether sim time has caught up
+DISCRETE_POLL = 0.01
+
+class SimClock(object):
+
+    def __init__(self, mode='realtime', speed=1.0, start=None):
+        if mode not in MODES:
+            raise ValueError("Unknown simulation mode '" + str(mode) + "' (one of " + ', '.join(MODES) + ")")
+        self.mode = mode
+        self.speed = float(speed) if mode == 'accelerated' else 1.0
+        self.discrete = mode == 'discrete'
+        self._real_start = time()
+        self._start = self._real_start if start is None else float(start)
+        self._now = self._start
+
+    '''
+    @brief current sim time (seconds since the epoch)
+    '''
+    def now(self):
+        if self.mode == 'realtime':
+            return time()
+        if self.discrete:
+            return self._now
+        return self._start + (time() - self._real_start) * self.speed
+
+    '''
+    @brief wall seconds that pass while sim time advances by 'seconds' (None in discrete mode, where it depends on the scheduler)
+    '''
+    def real_seconds(self, seconds):
+        if self.discrete:
+            return None
+        return seconds / self.speed
+
+    '''
+    @brief discrete mode: jump sim time forward to 'when' (the BehaviorScheduler does this when nothing is due)
+    '''
+    def advance_to(self, when):
+        if self.discrete and when > self._now:
+            self._now = when
+
+    '''
+    @brief block until sim time has advanced by 'seconds'
+    - In discrete mode sim time only moves while behaviors are scheduled, so this polls until the scheduler got there
+    '''
+    def sleep(self, seconds):
+        if not self.discrete:
+            sleep(seconds / self.speed)
+            return
+        until = self._now + seconds
+        while self._now < until:
+            sleep(DISCRETE_POLL)
+
+'''
+@brief parse a sim start time: None, a unix timestamp or 'YYYY-mm-dd HH:MM:SS' in local time
+'''
+def parse_start_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return mktime(strptime(str(value), '%Y-%m-%d %H:%M:%S'))
+
+'''
+@brief the SimClock for a 'simulation' config section (None or an empty section gives a realtime clock)
+'''
+def make_clock(simulation_config):
+    simulation_config = simulation_config or {}
+    return SimClock(simulation_config.get('mode', 'realtime'), simulation_config.get('speed', 1.0), parse_start_time(simulation_config.get('start')))
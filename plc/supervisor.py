@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+'''
+Pre-forking PLC supervisor
+  Replaces the background loop of startup_plc.sh: pymodbus, Twisted and the PLC modules are imported and the
+  master config is loaded once, then every PLC device runs in its own forked worker process, which shares the
+  imported modules and config with the supervisor copy-on-write instead of importing and parsing them again.
+- Readiness: a TCP worker is ready once its port accepts a connection and answers a Modbus request
+  (serial and UDP workers once they are running); with every worker ready, systemd is notified (READY=1)
+- A worker that exits is restarted after a backoff that doubles with every quick failure (up to max_backoff seconds)
+  and resets once the worker has stayed up for 'stable' seconds
+- SIGTERM/SIGINT stop every worker with SIGTERM, and with SIGKILL whatever is left after shutdown_timeout seconds
+- The supervisor sleeps in select() until a signal or a timer is due, so an idle fleet costs no CPU
+- Sharded mode ('--shards K', or 'shards' in the supervisor section; 'auto' is one shard per available core): K workers,
+  each hosting its share of the PLC devices in one reactor like plc_host.py, balanced by estimated load (see sharding.py);
+  'affinity: true' pins shard k to core k, and every stats_interval seconds the CPU use of every shard is logged
+- Optional 'supervisor' section in MASTER: readiness_timeout, max_backoff, stable, shutdown_timeout, stats_interval (seconds),
+  shards, affinity
+
+The Twisted reactor is not installed before forking (each worker needs its own); only modules that do not
+install it are preloaded. If a preloaded module installs it anyway, workers exec async_plc.py (or plc_host.py) instead.
+'''
+
+import os, sys, errno, signal, socket, select, struct, logging, argparse, traceback
+from time import time
+from helper import parse_id_spec, scheduler_policy
+from configcache import load_sections
+from metrics import metrics_config
+from sharding import plc_load, plan_shards, available_cpus, set_cpu_affinity, cpu_seconds
+
+BACKUP_DIR = '/usr/local/bin/scadasim_pymodbus_plc/backups/'
+ASYNC_PLC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'async_plc.py')
+PLC_HOST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plc_host.py')
+
+# imported once in the supervisor for the workers to share; none of them installs the Twisted reactor
+PRELOAD_MODULES = (
+    'helper', 'scheduler', 'journal', 'metrics', 'logqueue', 'simclock', 'regtrace', 'datablock', 'livestate', 'sharedregs',
+    'pymodbus.device', 'pymodbus.factory', 'pymodbus.transaction', 'pymodbus.datastore',
+    'twisted.internet.protocol', 'twisted.internet.default', 'twisted.internet.epollreactor',
+    'twisted.internet.tcp', 'twisted.internet.udp',
+    # imported by pymodbus' Twisted server for its (unused) manhole
+    'twisted.cred.portal', 'twisted.cred.checkers', 'twisted.conch.insults.insults',
+    'twisted.conch.ssh.keys', 'twisted.conch.ssh.transport', 'twisted.conch.ssh.session', 'twisted.conch.ssh.connection',
+)
+
+DEFAULTS = {'readiness_timeout': 30, 'max_backoff': 60, 'stable': 60, 'shutdown_timeout': 10, 'stats_interval': 60, 'shards': None, 'affinity': False}
+INITIAL_BACKOFF = 1
+PROBE_INTERVAL = 0.2
+
+'''
+@brief imports PRELOAD_MODULES, skipping the ones this pymodbus/Twisted version does not have
+- Returns False if the Twisted reactor got installed, in which case workers must not share this process' imports
+'''
+def preload_modules(log):
+    for name in PRELOAD_MODULES:
+        try:
+            __import__(name)
+        except ImportError as e:
+            log.debug("Not preloading %s: %s", name, e)
+    if 'twisted.internet.reactor' in sys.modules:
+        log.warning("A preloaded module installed the Twisted reactor - workers will exec async_plc.py/plc_host.py")
+        return False
+    return True
+
+'''
+@brief True once a Modbus TCP server answers a read of one holding register (any response, exceptions included)
+'''
+def modbus_ready(address, port, timeout=0.5):
+    if address in ('', '0.0.0.0'):
+        address = '127.0.0.1'
+    try:
+        sock = socket.create_connection((address, port), timeout=timeout)
+    except socket.error:
+        return False
+    try:
+        # MBAP header (transaction 1, protocol 0, length 6, unit 0) + fc 3, address 0, count 1
+        sock.sendall(struct.pack('>HHHBBHH', 1, 0, 6, 0, 3, 0, 1))
+        return len(sock.recv(256)) > 0
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+'''
+@brief sends a state (e.g. 'READY=1') to systemd if the supervisor runs as a Type=notify service
+'''
+def sd_notify(state):
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(state.encode('ascii'), address)
+    except socket.error:
+        pass
+    finally:
+        sock.close()
+
+'''
+Worker is one supervised process: a single PLC device, or with shard set, a shard hosting several of them
+'''
+class Worker(object):
+
+    def __init__(self, name, plc_ids, shard=None, load=None, cpus=None):
+        self.name = name
+        self.plc_ids = plc_ids
+        self.shard = shard
+        self.load = load
+        self.cpus = cpus
+        self.pid = None
+        self.started = None
+        self.pending = set()
+        self.failures = 0
+        self.restart_at = None
+        self.cpu_seconds = 0.0
+        # times the process was started, and whether it exited cleanly (status 0) and stays down
+        self.spawns = 0
+        self.finished = False
+
+    @property
+    def ready(self):
+        return self.pid is not None and not self.pending
+
+class Supervisor(object):
+
+    def __init__(self, config_filename, config_yaml, plc_ids, backup_dir, log, restore_ts=None, shards=None):
+        self.config_filename = config_filename
+        self.config_yaml = config_yaml
+        self.master_config = config_yaml.get('MASTER', {})
+        self.backup_dir = backup_dir
+        self.log = log
+        self.restore_ts = restore_ts
+        self.settings = dict(DEFAULTS)
+        self.settings.update(self.master_config.get('supervisor') or {})
+        if shards is not None:
+            self.settings['shards'] = shards
+        if self.settings['shards'] is None:
+            self.workers = [Worker('PLC ' + str(num), [num]) for num in plc_ids]
+        else:
+            self.workers = self._plan_shards(plc_ids)
+        self.fork_in_process = True
+        self.stopping = False
+        self.all_ready = False
+        self._started = None
+        self._stats_at = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    '''
+    @brief one Worker per shard, balanced by estimated load; with 'affinity', shard k is pinned to the k-th available core
+    '''
+    def _plan_shards(self, plc_ids):
+        cpus = available_cpus()
+        shards = self.settings['shards']
+        shards = len(cpus) if shards == 'auto' else int(shards)
+        loads = dict((num, plc_load(self.config_yaml['PLC ' + str(num)])) for num in plc_ids)
+        total = sum(loads.values()) or 1.0
+        workers = []
+        # every shard runs one scheduler for its PLC devices, so the fleet needs one SCHEDULER policy
+        policies = set(scheduler_policy(self.config_yaml['PLC ' + str(num)]) for num in plc_ids)
+        if len(policies) > 1:
+            self.log.error("Sharded PLC devices share a scheduler per shard but their SCHEDULER sections set different policies (%s). Exiting program.",
+                           ', '.join(sorted(policies)))
+            sys.exit(1)
+        for i, (shard_ids, load) in enumerate(plan_shards(loads, shards)):
+            shard_cpus = [cpus[i % len(cpus)]] if self.settings['affinity'] else None
+            workers.append(Worker('shard ' + str(i), shard_ids, i, load, shard_cpus))
+            self.log.info("shard %d: %d PLC devices, estimated load %.1f (%.1f%%)%s", i, len(shard_ids), load, 100.0 * load / total,
+                          '' if shard_cpus is None else ', cpu ' + str(shard_cpus[0]))
+        return workers
+
+    def _on_signal(self, signum, frame):
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            self.stopping = True
+        try:
+            os.write(self._wakeup_w, b'.')
+        except OSError:
+            pass
+
+    '''
+    @brief forks the process of one worker
+    '''
+    def spawn(self, worker):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(worker)
+        worker.pid = pid
+        worker.spawns += 1
+        worker.started = time()
+        worker.pending = set(worker.plc_ids)
+        worker.restart_at = None
+        worker.cpu_seconds = 0.0
+        if worker.cpus is not None and not set_cpu_affinity(pid, worker.cpus):
+            self.log.warning("Could not pin %s to cpu %s", worker.name, worker.cpus)
+        self.log.info("Started %s (pid %d)", worker.name, pid)
+
+    def _run_worker(self, worker):
+        code = 1
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            restore_ts = self._restore_ts(worker)
+            if not self.fork_in_process:
+                os.execv(sys.executable, self._exec_args(worker))
+            if worker.shard is None:
+                import async_plc
+                backup_filename = os.path.join(self.backup_dir, 'backup_' + str(worker.plc_ids[0]) + '.yaml')
+                async_plc.run_plc(str(worker.plc_ids[0]), self.config_yaml['PLC ' + str(worker.plc_ids[0])], self.master_config, backup_filename, restore_ts)
+            else:
+                import plc_host
+                # as in plc_host.py, pymodbus and twisted log through the root logger
+                logging.getLogger().setLevel(logging.WARNING)
+                logging.getLogger('scheduler').setLevel(logging.INFO)
+                plc_host.run_plc_host(self._shard_config(worker.shard), worker.plc_ids, self.backup_dir, 'shard_' + str(worker.shard), restore_ts)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    '''
+    @brief the --restore_ts of a worker: the supervisor's only for its first start, after that the journal's latest state,
+        so a worker restarted after a crash is not rewound to the time the supervisor was started with
+    '''
+    def _restore_ts(self, worker):
+        if self.restore_ts is None or worker.spawns == 0:
+            return self.restore_ts
+        return 'latest'
+
+    def _exec_args(self, worker):
+        if worker.shard is None:
+            args = [sys.executable, ASYNC_PLC, '--n', str(worker.plc_ids[0])]
+        else:
+            args = [sys.executable, PLC_HOST, '--n', ','.join(str(num) for num in worker.plc_ids)]
+        args += ['--c', self.config_filename, '--b', self.backup_dir]
+        restore_ts = self._restore_ts(worker)
+        if restore_ts is not None:
+            args += ['--restore_ts', restore_ts]
+        return args
+
+    '''
+    @brief the config a shard hosts its PLC devices from: each shard serves its metrics endpoint (MASTER metrics)
+        on port + shard number, or on its 'socket' path with .<shard number> appended (see metrics.metrics_config)
+    '''
+    def _shard_config(self, shard):
+        config_yaml = dict(self.config_yaml)
+        if metrics_config(self.master_config):
+            config_yaml['MASTER'] = dict(self.master_config, metrics=metrics_config(self.master_config, shard))
+        return config_yaml
+
+    '''
+    @brief reaps exited workers and schedules their restart
+    '''
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            for worker in self.workers:
+                if worker.pid == pid:
+                    self._exited(worker, status)
+
+    def _exited(self, worker, status):
+        pid = worker.pid
+        worker.pid = None
+        if self.stopping:
+            return
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            # a clean exit is not a crash
+            worker.finished = True
+            self.log.info("%s (pid %d) exited cleanly - not restarting it", worker.name, pid)
+            return
+        if os.WIFSIGNALED(status):
+            reason = "was killed by signal " + str(os.WTERMSIG(status))
+        else:
+            reason = "exited with status " + str(os.WEXITSTATUS(status))
+        if time() - worker.started >= self.settings['stable']:
+            worker.failures = 0
+        worker.failures += 1
+        backoff = min(self.settings['max_backoff'], INITIAL_BACKOFF * 2 ** (worker.failures - 1))
+        worker.restart_at = time() + backoff
+        self.log.warning("%s (pid %d) %s - restarting in %ss", worker.name, pid, reason, backoff)
+
+    '''
+    @brief probes the PLC devices that are not ready yet; returns True while some are still starting
+    '''
+    def _probe(self):
+        now = time()
+        pending = False
+        for worker in self.workers:
+            if worker.pid is None:
+                continue
+            for num in sorted(worker.pending):
+                server_config = self.config_yaml['PLC ' + str(num)]['SERVER']
+                if server_config['type'] != 'tcp' or modbus_ready(server_config['address'], int(server_config['port'])):
+                    worker.pending.discard(num)
+                    self.log.info("PLC %d ready after %.2fs", num, time() - worker.started)
+                elif now - worker.started > self.settings['readiness_timeout']:
+                    worker.pending.discard(num)
+                    self.log.warning("PLC %d is running but did not answer on port %s within %ss", num, server_config['port'], self.settings['readiness_timeout'])
+                else:
+                    pending = True
+        if not pending and not self.all_ready and all(worker.ready or worker.finished for worker in self.workers):
+            self.all_ready = True
+            self.log.info("All %d PLC devices ready in %.2fs", sum(len(worker.plc_ids) for worker in self.workers), time() - self._started)
+            sd_notify('READY=1')
+        return pending
+
+    '''
+    @brief sharded mode: logs each shard's share of the estimated load next to its share of the CPU time used since the last report
+    '''
+    def _report_shards(self):
+        used = {}
+        for worker in self.workers:
+            if worker.pid is not None:
+                total = cpu_seconds(worker.pid)
+                used[worker.shard] = total - worker.cpu_seconds
+                worker.cpu_seconds = total
+        interval = float(self.settings['stats_interval'])
+        total_load = sum(worker.load for worker in self.workers) or 1.0
+        total_used = sum(used.values()) or 1.0
+        for worker in self.workers:
+            if worker.shard not in used:
+                self.log.info("shard %d: not running", worker.shard)
+                continue
+            self.log.info("shard %d: %d PLC devices, estimated load %.1f%%, cpu %.1f%% of a core (%.1f%% of the fleet's)", worker.shard, len(worker.plc_ids),
+                          100.0 * worker.load / total_load, 100.0 * used[worker.shard] / interval, 100.0 * used[worker.shard] / total_used)
+
+    '''
+    @brief blocks until a signal arrives or 'timeout' seconds pass (forever if None)
+    '''
+    def _wait(self, timeout):
+        try:
+            readable = select.select([self._wakeup_r], [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            os.read(self._wakeup_r, 4096)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        self._started = time()
+        if self.settings['shards'] is not None and self.settings['stats_interval']:
+            self._stats_at = self._started + self.settings['stats_interval']
+        for worker in self.workers:
+            self.spawn(worker)
+        while not self.stopping:
+            self._reap()
+            now = time()
+            for worker in self.workers:
+                if worker.pid is None and worker.restart_at is not None and worker.restart_at <= now:
+                    self.spawn(worker)
+            timeouts = [worker.restart_at - now for worker in self.workers if worker.pid is None and worker.restart_at is not None]
+            if self._probe():
+                timeouts.append(PROBE_INTERVAL)
+            if self._stats_at is not None:
+                if now >= self._stats_at:
+                    self._report_shards()
+                    self._stats_at = now + self.settings['stats_interval']
+                timeouts.append(self._stats_at - now)
+            self._wait(max(0, min(timeouts)) if timeouts else None)
+        self.shutdown()
+
+    '''
+    @brief SIGTERM to every worker, SIGKILL to the ones still running after shutdown_timeout
+    '''
+    def shutdown(self):
+        sd_notify('STOPPING=1')
+        self.log.info("Stopping %d workers", len([worker for worker in self.workers if worker.pid is not None]))
+        self._signal_workers(signal.SIGTERM)
+        deadline = time() + self.settings['shutdown_timeout']
+        while any(worker.pid is not None for worker in self.workers) and time() < deadline:
+            self._wait(deadline - time())
+            self._reap()
+        if any(worker.pid is not None for worker in self.workers):
+            self.log.warning("Killing the workers still running after %ss", self.settings['shutdown_timeout'])
+            self._signal_workers(signal.SIGKILL)
+            for worker in self.workers:
+                if worker.pid is not None:
+                    os.waitpid(worker.pid, 0)
+                    worker.pid = None
+        self.log.info("All PLC devices stopped")
+
+    def _signal_workers(self, signum):
+        for worker in self.workers:
+            if worker.pid is not None:
+                try:
+                    os.kill(worker.pid, signum)
+                except OSError:
+                    pass
+
+'''
+@brief parse args, load the config, preload the PLC modules, then run the supervisor until SIGTERM/SIGINT
+'''
+def main():
+    parser = argparse.ArgumentParser(description = "Start and supervise every PLC device as a pre-forked worker process")
+    parser.add_argument("--c", "--config_filename", help = "Name of the master config file")
+    parser.add_argument("--n", "--plc_ids", default = 'all', help = "PLC devices to run, e.g. 'all', '3' or '0,2,5-9' (default: all)")
+    parser.add_argument("--b", "--backup_dir", default = BACKUP_DIR, help = "Directory holding the backup_N.yaml files")
+    parser.add_argument("--restore_ts", default = None, help = "With a change journal configured: 'latest' (default) or the time to restore to (unix timestamp or 'YYYY-mm-dd HH:MM:SS')")
+    parser.add_argument("--shards", nargs = '?', const = 'auto', default = None, help = "Split the PLC devices across this many worker processes ('auto' or no value: one per core) instead of one process per PLC device")
+    args = parser.parse_args()
+    if args.c is None:
+        print("Need to run supervisor.py with the --c argument. Run 'python supervisor.py --h' for help")
+        return
+
+    logging.basicConfig(format='%(asctime)-15s supervisor %(levelname)-8s %(message)s', level=logging.INFO)
+    log = logging.getLogger('supervisor')
+    config_yaml = load_sections(args.c, ['MASTER'])
+    if args.n == 'all':
+        plc_ids = list(range(config_yaml['MASTER']['num_of_PLC']))
+    else:
+        plc_ids = parse_id_spec(args.n)
+    config_yaml.update(load_sections(args.c, ['PLC ' + str(num) for num in plc_ids]))
+
+    supervisor = Supervisor(args.c, config_yaml, plc_ids, args.b, log, args.restore_ts, args.shards)
+    supervisor.fork_in_process = preload_modules(log)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -31,23 +31,47 @@ import sys
 import yaml
 from os import path
 
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'plc'))
+from configcache import compile_config
+
+# optional '--restore_ts <latest|unix timestamp|YYYY-mm-dd HH:MM:SS>' rewrites every backup from the change journal
+# ('journal' in the MASTER section) before the PLC devices start
+args = sys.argv[1:]
+restore_ts = None
+if '--restore_ts' in args:
+    i = args.index('--restore_ts')
+    restore_ts = args[i + 1]
+    del args[i:i + 2]
+
 # (Default) open txt file to get config.yaml file name IF path of config file was not supplied as argument to master.py
 # strip any trailing /n from string
-if len(sys.argv) == 1:
+if len(args) == 0:
     f = open("/usr/local/bin/scadasim_pymodbus_plc/startup/config_file_name.txt", 'r')
     file_name = f.read()
     file_name = file_name.rstrip()
     f.close()
 else:
-    file_name = sys.argv[1]
+    file_name = args[0]
 
-# open yaml config file, build object
-config_file = open(file_name, 'r')
-config_yaml = yaml.safe_load(config_file)
-config_file.close()
+# parse and validate the yaml config file once, and compile the per-PLC cache the PLC devices load their sections from
+try:
+    config_yaml = compile_config(file_name)
+except ValueError as e:
+    sys.stderr.write("Invalid config file " + file_name + ": " + str(e) + "\n")
+    sys.exit(1)
 
 # get number of plc devices from MASTER section of the config file
 num_of_plc = config_yaml['MASTER']['num_of_PLC']
+
+journal_dir = None
+restored = {}
+if restore_ts is not None:
+    if not config_yaml['MASTER'].get('journal'):
+        sys.stderr.write("--restore_ts needs a change journal ('journal' in the MASTER section of the config)\n")
+        sys.exit(1)
+    from journal import Journal, restore_datastore, parse_restore_time
+    journal_dir = config_yaml['MASTER']['journal']['dir']
+    restore_time = parse_restore_time(restore_ts)
 # create backup files if they do not already exist - 1 for each PLC device
 i = 0
 while(i < num_of_plc):
@@ -62,6 +86,17 @@ while(i < num_of_plc):
     di_values = config_yaml[plc_device_name]['DATASTORE']['di']['values']
     ir_values = config_yaml[plc_device_name]['DATASTORE']['ir']['values']
 
+    # restoring from the journal overwrites the backup with the journaled state
+    if journal_dir is not None:
+        datastore = restore_datastore(journal_dir, i, restore_time)
+        if datastore == -1:
+            sys.stderr.write("No journal checkpoint for " + plc_device_name + " at " + restore_ts + " - keeping its backup\n")
+        else:
+            restored[i] = datastore
+            backup = open(backup_file_name, 'w+')
+            yaml.dump({'DATASTORE': datastore}, backup)
+            backup.close()
+
     # check if file exists
     if (path.exists(backup_file_name) == False or path.getsize(backup_file_name) == 0):
         # create file - only storing the register starting address and values 
@@ -72,6 +107,10 @@ while(i < num_of_plc):
         backup.close()
     i = i + 1
 
+# the restored states become the newest checkpoint, so PLC devices restoring 'latest' from the journal start from them
+if restored:
+    Journal(journal_dir, 'master').record_checkpoint(restored)
+
 # return number of backup files created and the config filepath to bash startup script
 print str(num_of_plc) + ' ' + file_name
 
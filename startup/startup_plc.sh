@@ -34,13 +34,15 @@ TEMPLATE_VAR="$(vmtoolsd --cmd 'info-get guestinfo.template_variable')"
 if [ "$TEMPLATE_VAR" = "" ]; then
     echo "No template variable found on the vmx file. Using hard-coded value"
     # load in data from master.py using hard-coded config textfile
-    result=$(python /usr/local/bin/scadasim_pymodbus_plc/startup/master.py)
+    result=$(python /usr/local/bin/scadasim_pymodbus_plc/startup/master.py ${RESTORE_TS:+--restore_ts "$RESTORE_TS"})
 else
     # load in data from master.py using template_var as config textfile
     echo "Using template_var from vmx file"
-    result=$(python /usr/local/bin/scadasim_pymodbus_plc/startup/master.py $TEMPLATE_VAR)
+    result=$(python /usr/local/bin/scadasim_pymodbus_plc/startup/master.py $TEMPLATE_VAR ${RESTORE_TS:+--restore_ts "$RESTORE_TS"})
 fi
 
+# RESTORE_TS=<latest|unix timestamp|"YYYY-mm-dd HH:MM:SS"> makes master.py rewrite the backups from the change journal first
+
 # master.py will return the number of plc devices for this schema, and the path of the config file
 results=( $result )
 
@@ -51,15 +53,14 @@ START=0
 END=${results[0]}
 name_of_config=${results[1]}
 
-# loop and start plc devices with their ID and the path of the config file supplied as arguments
-# run in background as async_plc will start off multiple threads
-for (( c=$START; c<$END; c++ ))
-do
-        echo "Running async_plc.py with arg $c"
-	python /usr/local/bin/scadasim_pymodbus_plc/plc/async_plc.py --n $c --c $name_of_config &	
-done
-
-# keep script alive so that async_plc programs continue to run
-while true; do
-    echo
-done
+# PLC_HOST_MODE=multi serves every PLC device from a single plc_host.py process
+# otherwise, supervisor.py imports the PLC modules once and forks one async_plc worker per PLC device, restarting crashed workers
+# PLC_SHARDS=<number|auto> makes it fork that many workers instead, each hosting a share of the PLC devices
+# exec, so the python process replaces this script and receives systemd's stop signal directly
+if [ "$PLC_HOST_MODE" = "multi" ]; then
+        echo "Running plc_host.py for all $END PLC devices"
+	exec python /usr/local/bin/scadasim_pymodbus_plc/plc/plc_host.py --c $name_of_config
+else
+        echo "Running supervisor.py for PLC devices $START to $((END - 1))"
+	exec python /usr/local/bin/scadasim_pymodbus_plc/plc/supervisor.py --c $name_of_config ${PLC_SHARDS:+--shards "$PLC_SHARDS"}
+fi
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Batched behavior groups write the same register values as the behaviors they replace, run one by one
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, logging, unittest
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from pymodbus.datastore import ModbusServerContext
+from datastore import PLCSlaveContext
+from datablock import make_datablock
+import batch, helper
+
+HR = [0, 10, 20, 30, 40, 3, 0, 95, 50, 1, 4, 0]
+CO = [1, 0, 1, 0]
+
+LINEAR = [
+    {'variance': 3, 'address': 0, 'count': 2},
+    {'variance': 5, 'address': 2, 'count': 1},
+    # not next to the others, so the group reads and writes two runs
+    {'variance': 1, 'address': 8, 'count': 1},
+]
+
+# coils 0 and 2 are in their default state (raise to max), coils 1 and 3 are not (lower to 0)
+LINEAR_COIL_DEPENDENT = [
+    {'variance': 4, 'max': 100, 'address': 7, 'count': 1, 'coil_address': 0, 'default_coil_value': 1},
+    {'variance': 2, 'max': 60, 'address': 3, 'count': 1, 'coil_address': 2, 'default_coil_value': 1},
+    {'variance': 2, 'max': 100, 'address': 4, 'count': 2, 'coil_address': 1, 'default_coil_value': 1},
+    {'variance': 3, 'max': 100, 'address': 9, 'count': 1, 'coil_address': 3, 'default_coil_value': 1},
+    # one register already at 0: the behavior does not lower the others
+    {'variance': 1, 'max': 100, 'address': 10, 'count': 2, 'coil_address': 1, 'default_coil_value': 1},
+]
+
+TICKS = 40
+
+def context(kind):
+    slave = PLCSlaveContext(di=make_datablock('di', 1, [0], kind), co=make_datablock('co', 1, list(CO), kind),
+                            hr=make_datablock('hr', 1, list(HR), kind), ir=make_datablock('ir', 1, [0], kind))
+    return ModbusServerContext(slaves=slave, single=True)
+
+def hr_values(context):
+    return list(context[0].getValues(3, 0, len(HR)))
+
+def group(group_type, name, configs):
+    group = batch.GROUP_TYPES[name](name, 1, 0x00)
+    for i, config in enumerate(configs):
+        group.add('behavior_' + str(i + 1), dict(config, type=name, time=1))
+    group.compile()
+    return group
+
+@unittest.skipIf(batch.numpy is None, "batch mode needs numpy")
+class BatchEquivalenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger('test')
+
+    def assert_same_ticks(self, scalar_tick, batched, kind):
+        scalar_context = context(kind)
+        batch_context = context(kind)
+        scalar = scalar_tick(scalar_context)
+        for tick in range(TICKS):
+            scalar()
+            batched.tick(batch_context, self.log)
+            self.assertEqual(hr_values(batch_context), hr_values(scalar_context), "tick %d (%s datablocks)" % (tick, kind))
+
+    def test_linear(self):
+        def scalar_tick(context):
+            behaviors = [helper.linear(config['variance'], 1, config['address'], 0x00, config['count'], context, self.log, None) for config in LINEAR]
+            for behavior in behaviors:
+                next(behavior)
+            return lambda: [next(behavior) for behavior in behaviors]
+        for kind in ('list', 'array'):
+            self.assert_same_ticks(scalar_tick, group(batch.LinearGroup, 'linear', LINEAR), kind)
+
+    def test_linear_coil_dependent(self):
+        def scalar_tick(context):
+            def tick():
+                for config in LINEAR_COIL_DEPENDENT:
+                    helper.linear_coil_dependent_step(config['variance'], config['max'], config['address'], 0x00, config['count'], context, self.log,
+                                                      config['coil_address'], config['default_coil_value'])
+            return tick
+        for kind in ('list', 'array'):
+            self.assert_same_ticks(scalar_tick, group(batch.LinearCoilDependentGroup, 'linear_coil_dependent', LINEAR_COIL_DEPENDENT), kind)
+        # the lowered registers came to rest at 0, never below (not wrapped to 65535)
+        final = context('array')
+        lowered = group(batch.LinearCoilDependentGroup, 'linear_coil_dependent', LINEAR_COIL_DEPENDENT)
+        for tick in range(TICKS):
+            lowered.tick(final, self.log)
+        self.assertEqual(hr_values(final)[4:6], [36, 0])
+        self.assertEqual(hr_values(final)[9:12], [0, 4, 0])
+
+    def test_random_is_seeded_and_in_range(self):
+        configs = [{'min': 5, 'max': 9, 'address': 0, 'count': 3}, {'min': 100, 'max': 100, 'address': 5, 'count': 1}]
+        runs = []
+        for run in range(2):
+            random_group = group(batch.RandomGroup, 'random', configs)
+            random_group.seed(Random(42))
+            random_context = context('list')
+            values = []
+            for tick in range(TICKS):
+                random_group.tick(random_context, self.log)
+                values.append(hr_values(random_context))
+            runs.append(values)
+        self.assertEqual(runs[0], runs[1])
+        for values in runs[0]:
+            # every register of a behavior gets the same draw
+            self.assertEqual(len(set(values[0:3])), 1)
+            self.assertTrue(5 <= values[0] <= 9)
+            self.assertEqual(values[5], 100)
+
+if __name__ == '__main__':
+    unittest.main()
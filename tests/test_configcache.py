@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+The compiled config cache returns the sections of the config it was compiled from, and is rebuilt or bypassed when it cannot be used
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, shutil, tempfile, unittest, yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from configcache import load_sections, compile_config, cache_filename_for, validate_config
+
+def plc_section(port, hr):
+    return {'DATASTORE': {'co': {'start_addr': 1, 'values': [0]}, 'di': {'start_addr': 1, 'values': [0]},
+                          'hr': {'start_addr': 1, 'values': hr, 'behavior_1': {'type': 'linear', 'variance': 1, 'address': 0, 'count': 1, 'time': 1}},
+                          'ir': {'start_addr': 1, 'values': [0]}},
+            'LOGGING': {'logging_level': 'WARNING'},
+            'SERVER': {'type': 'tcp', 'framer': 'TCP', 'address': '0.0.0.0', 'port': port}}
+
+class ConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_filename = os.path.join(self.dir, 'config.yaml')
+        self.cache_filename = cache_filename_for(self.config_filename)
+        self.config = {'MASTER': {'num_of_PLC': 2}, 'PLC 0': plc_section(5020, [1, 2]), 'PLC 1': plc_section(5021, [3])}
+        self.write_config(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_config(self, config, mtime=None):
+        config_file = open(self.config_filename, 'w')
+        yaml.safe_dump(config, config_file)
+        config_file.close()
+        if mtime is not None:
+            os.utime(self.config_filename, (mtime, mtime))
+
+    def test_round_trip(self):
+        self.assertEqual(load_sections(self.config_filename, ['MASTER', 'PLC 1']), {'MASTER': self.config['MASTER'], 'PLC 1': self.config['PLC 1']})
+        self.assertTrue(os.path.exists(self.cache_filename))
+        # from the cache this time, and without the sections the config does not have
+        self.assertEqual(load_sections(self.config_filename, ['PLC 0', 'PLC 7']), {'PLC 0': self.config['PLC 0']})
+
+    def test_cache_is_plain_yaml_data(self):
+        compile_config(self.config_filename)
+        cache = open(self.cache_filename, 'rb')
+        data = cache.read()
+        cache.close()
+        self.assertFalse(b'!!python' in data)
+        self.assertEqual(os.stat(self.cache_filename).st_mode & 0o022, 0)
+
+    def test_changed_config_is_recompiled(self):
+        load_sections(self.config_filename, ['PLC 0'])
+        self.config['PLC 0']['SERVER']['port'] = 6020
+        self.write_config(self.config, mtime=os.path.getmtime(self.config_filename) + 10)
+        self.assertEqual(load_sections(self.config_filename, ['PLC 0'])['PLC 0']['SERVER']['port'], 6020)
+
+    def test_touched_config_keeps_cache(self):
+        load_sections(self.config_filename, ['PLC 0'])
+        os.utime(self.cache_filename, (1000000000, 1000000000))
+        config_mtime = os.path.getmtime(self.config_filename) + 10
+        os.utime(self.config_filename, (config_mtime, config_mtime))
+        # same content: the sha1 matches, so the cache is used as it is
+        self.assertEqual(load_sections(self.config_filename, ['PLC 1']), {'PLC 1': self.config['PLC 1']})
+        self.assertEqual(os.path.getmtime(self.cache_filename), 1000000000)
+
+    def test_writable_cache_is_not_trusted(self):
+        load_sections(self.config_filename, ['PLC 0'])
+        # a cache others could have written is bypassed (and replaced) rather than loaded
+        cache = open(self.cache_filename, 'wb')
+        cache.write(b'not a cache')
+        cache.close()
+        os.chmod(self.cache_filename, 0o666)
+        self.assertEqual(load_sections(self.config_filename, ['PLC 0']), {'PLC 0': self.config['PLC 0']})
+        self.assertEqual(os.stat(self.cache_filename).st_mode & 0o022, 0)
+
+    def test_invalid_config(self):
+        del self.config['PLC 1']
+        self.write_config(self.config)
+        self.assertRaises(ValueError, compile_config, self.config_filename)
+        self.assertRaises(ValueError, validate_config, {'MASTER': {'num_of_PLC': -1}})
+
+if __name__ == '__main__':
+    unittest.main()
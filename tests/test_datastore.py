@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+PLCSlaveContext: snapshots stay consistent under concurrent writes, and written ranges are handed to the backup writer once
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, unittest
+from threading import Thread, Event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+from datastore import PLCSlaveContext, merge_ranges, MAX_DIRTY_RANGES
+
+def slave(size=16):
+    return PLCSlaveContext(**dict((table, ModbusSequentialDataBlock(1, [0] * size)) for table in ('di', 'co', 'hr', 'ir')))
+
+class DirtyRangesTest(unittest.TestCase):
+
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([(5, 2), (0, 2), (2, 1), (6, 4)]), [(0, 3), (5, 5)])
+
+    def test_take_dirty_once(self):
+        context = slave()
+        context.setValues(3, 4, [1, 2])
+        context.setValues(3, 6, [3])
+        context.setValues(1, 0, [1])
+        self.assertEqual(context.take_dirty(), {'hr': [(4, 3)], 'co': [(0, 1)]})
+        self.assertEqual(context.take_dirty(), {})
+
+    def test_many_ranges_collapse(self):
+        context = slave(4 * MAX_DIRTY_RANGES)
+        for address in range(0, 4 * MAX_DIRTY_RANGES, 2):
+            context.setValues(3, address, [1])
+        # too many ranges to keep apart: they are collapsed, but every written address stays covered
+        ranges = context.take_dirty()['hr']
+        self.assertTrue(len(ranges) <= MAX_DIRTY_RANGES)
+        for address in range(0, 4 * MAX_DIRTY_RANGES, 2):
+            self.assertTrue([start for start, count in ranges if start <= address < start + count], address)
+
+    def test_update_is_atomic(self):
+        context = slave()
+        context.setValues(3, 0, [1, 2])
+        self.assertEqual(context.update(3, 0, 2, lambda values: [v * 10 for v in values]), [10, 20])
+        self.assertEqual(context.update(3, 0, 2, lambda values: None), None)
+        self.assertEqual(list(context.getValues(3, 0, 2)), [10, 20])
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_snapshot_ranges(self):
+        context = slave()
+        context.setValues(3, 2, [7, 8])
+        context.setValues(4, 0, [5])
+        self.assertEqual(context.snapshot({'hr': [(2, 2)], 'ir': [(0, 1), (3, 1)]}), {'hr': [(2, [7, 8])], 'ir': [(0, [5]), (3, [0])]})
+
+    def test_snapshot_never_sees_half_a_write(self):
+        context = slave()
+        done = Event()
+        def writer():
+            value = 0
+            while not done.is_set():
+                value = (value + 1) % 1000
+                # one write of two tables' worth of registers: hr and ir move together under the lock
+                with context.write_lock:
+                    context.setValues(3, 0, [value] * 8)
+                    context.setValues(4, 0, [value] * 8)
+        thread = Thread(target=writer)
+        thread.start()
+        try:
+            for i in range(2000):
+                snapshot = context.snapshot({'hr': [(0, 8)], 'ir': [(0, 8)]})
+                values = snapshot['hr'][0][1] + snapshot['ir'][0][1]
+                self.assertEqual(len(set(values)), 1, values)
+        finally:
+            done.set()
+            thread.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+Behaviors on a discrete clock start at the sim offsets their config gives them, however many are added
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, shutil, tempfile, logging, unittest, yaml
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from simclock import SimClock
+from scheduler import BehaviorScheduler
+
+START = 1500000000.0
+
+def wait_for(condition, timeout=5.0):
+    deadline = time() + timeout
+    while not condition() and time() < deadline:
+        sleep(0.01)
+    return condition()
+
+class DiscreteClockTest(unittest.TestCase):
+
+    '''
+    @brief a behavior that records the sim time of its first step, 'delay' after it was added, then steps every 'delay'
+    '''
+    def behavior(self, clock, fired, name, delay):
+        yield delay
+        fired[name] = clock.now()
+        while True:
+            yield delay
+
+    def test_scheduler_first_fire_times(self):
+        clock = SimClock('discrete', start=START)
+        scheduler = BehaviorScheduler(logging.getLogger('test'), report_interval=0, clock=clock)
+        fired = {}
+        delays = {'a': 90, 'b': 38, 'c': 5, 'd': 1}
+        for name in sorted(delays):
+            scheduler.add(name, self.behavior(clock, fired, name, delays[name]))
+        scheduler.start()
+        try:
+            self.assertTrue(wait_for(lambda: len(fired) == len(delays)))
+        finally:
+            scheduler.stop()
+        for name, delay in delays.items():
+            self.assertEqual(fired[name], START + delay)
+
+    def test_plc_behaviors_first_fire_times(self):
+        # start_plc_threads must add every behavior before its scheduler starts advancing the clock
+        from async_plc import build_plc_context, start_plc_threads
+        times = [5, 7, 11, 38, 90]
+        hr = {'start_addr': 1, 'values': [0] * len(times)}
+        for address, step in enumerate(times):
+            hr['behavior_' + str(address + 1)] = {'type': 'linear', 'variance': 1, 'address': address, 'count': 1, 'time': step}
+        config_list = {'DATASTORE': {'co': {'start_addr': 1, 'values': [0], 'behavior_1': {'type': 'none'}}, 'di': {'start_addr': 1, 'values': [0]}, 'hr': hr,
+                                     'ir': {'start_addr': 1, 'values': [0]}},
+                       'LOGGING': {'logging_level': 'WARNING'}}
+        backup_dir = tempfile.mkdtemp()
+        try:
+            backup_filename = os.path.join(backup_dir, 'backup_0.yaml')
+            backup = open(backup_filename, 'w')
+            yaml.safe_dump({'DATASTORE': dict((table, {'start_addr': 1, 'values': list(config_list['DATASTORE'][table]['values'])})
+                                              for table in ('co', 'di', 'hr', 'ir'))}, backup)
+            backup.close()
+            context = build_plc_context(config_list, backup_filename)
+            clock = SimClock('discrete', start=START)
+            first_writes = {}
+            def record(table, address, values):
+                if table == 'hr':
+                    first_writes.setdefault(address, clock.now())
+            context[0].write_hooks.append(record)
+            scheduler = start_plc_threads(context, config_list, backup_filename, logging.getLogger('test'), clock=clock)
+            try:
+                self.assertTrue(wait_for(lambda: len(first_writes) == len(times)))
+            finally:
+                scheduler.stop()
+            for address, step in enumerate(times):
+                self.assertEqual(first_writes[address], START + step)
+        finally:
+            shutil.rmtree(backup_dir)
+
+if __name__ == '__main__':
+    unittest.main()
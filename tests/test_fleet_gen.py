@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+fleet_gen.py writes a master config that loads with the YAML loader and passes the config validation of the PLC processes
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, shutil, tempfile, unittest, yaml
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'plc'))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'configs'))
+
+import fleet_gen
+from configcache import validate_config, load_sections
+
+SPEC_FILENAME = os.path.join(TESTS_DIR, '..', 'configs', 'fleet_spec_example.yaml')
+
+class FleetGenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_filename = os.path.join(self.dir, 'fleet_config.yaml')
+        spec_file = open(SPEC_FILENAME)
+        self.spec = yaml.safe_load(spec_file)
+        spec_file.close()
+        # a small fleet of the example templates
+        self.spec['FLEET'] = [{'template': 'tank', 'count': 3, 'base_port': 5020}, {'template': 'pump', 'count': 2, 'base_port': 7020}]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self):
+        config_file = open(self.config_filename)
+        config_yaml = yaml.safe_load(config_file)
+        config_file.close()
+        return config_yaml
+
+    def test_example_spec_validates(self):
+        backup_dir = os.path.join(self.dir, 'backups')
+        self.assertEqual(fleet_gen.generate(self.spec, self.config_filename, backup_dir), 5)
+        config_yaml = self.load()
+        validate_config(config_yaml)
+        self.assertEqual(config_yaml['MASTER']['num_of_PLC'], 5)
+        self.assertEqual([config_yaml['PLC ' + str(i)]['SERVER']['port'] for i in range(5)], [5020, 5021, 5022, 7020, 7021])
+        # the template expressions were evaluated per PLC device and register
+        tank = config_yaml['PLC 2']['DATASTORE']['hr']
+        self.assertEqual(tank['values'][:3], [98, 1, 2])
+        self.assertEqual(tank['behavior_2'], {'type': 'random', 'min': 0, 'max': 500, 'address': 1, 'count': 1, 'time': 1})
+        self.assertEqual(config_yaml['PLC 0']['DATASTORE']['co']['behavior_1'], {'type': 'none'})
+        self.assertEqual(config_yaml['PLC 0']['LOGGING']['file'], '/usr/local/bin/scadasim_pymodbus_plc/logging/logging_0.log')
+        # the config cache compiles it as well
+        self.assertEqual(load_sections(self.config_filename, ['PLC 4'])['PLC 4'], config_yaml['PLC 4'])
+        backup = open(os.path.join(backup_dir, 'backup_3.yaml'))
+        self.assertEqual(yaml.safe_load(backup)['DATASTORE']['hr'], {'start_addr': 1, 'values': [50]})
+        backup.close()
+
+    def test_emitter_matches_yaml(self):
+        # strings that need quoting survive the emitter's own scalar writer
+        section = {'DATASTORE': {'hr': {'values': [1], 'behavior_1': {'type': 'linear', 'note': 'yes', 'path': 'a: b', 'empty': '', 'n': None, 'f': 1.5}}}}
+        stream = open(self.config_filename, 'w')
+        fleet_gen.dump({'PLC 0': section}, stream)
+        stream.close()
+        self.assertEqual(self.load(), {'PLC 0': section})
+
+    def test_holding_register_needs_behavior(self):
+        del self.spec['TEMPLATES']['pump']['DATASTORE']['hr']['behavior_1']
+        self.assertRaises(ValueError, fleet_gen.generate, self.spec, self.config_filename)
+        self.assertFalse(os.path.exists(self.config_filename))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+The change journal restores the latest state, or the state at a --restore_ts, from checkpoints and writes
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, shutil, tempfile, unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+from datastore import PLCSlaveContext
+from journal import Journal, restore_datastore, parse_restore_time, list_segments, TABLES
+from simclock import SimClock
+
+START = 1500000000.0
+
+def slave():
+    return PLCSlaveContext(**dict((table, ModbusSequentialDataBlock(1, [0] * 4)) for table in TABLES))
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.clock = SimClock('discrete', start=START)
+        self.slave = slave()
+        self.journal = Journal(self.dir, 'plc_0', clock=self.clock)
+        self.journal.attach(0, self.slave)
+        self.journal.checkpoint()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_at(self, offset, address, value):
+        self.clock.advance_to(START + offset)
+        self.slave.setValues(3, address, [value])
+
+    def test_restore_latest(self):
+        self.write_at(10, 1, 7)
+        self.write_at(20, 2, 9)
+        self.journal.commit()
+        datastore = restore_datastore(self.dir, 0)
+        self.assertEqual(datastore['hr']['values'], [0, 7, 9, 0])
+        self.assertEqual(datastore['co']['values'], [0, 0, 0, 0])
+
+    def test_restore_at_time(self):
+        self.write_at(10, 1, 7)
+        self.write_at(20, 1, 9)
+        self.journal.commit()
+        self.assertEqual(restore_datastore(self.dir, 0, START + 15)['hr']['values'], [0, 7, 0, 0])
+        self.assertEqual(restore_datastore(self.dir, 0, START + 20)['hr']['values'], [0, 9, 0, 0])
+        # nothing journaled yet before the first checkpoint
+        self.assertEqual(restore_datastore(self.dir, 0, START - 1), -1)
+
+    def test_restore_ts_local_time(self):
+        self.write_at(10, 1, 7)
+        self.write_at(3600, 1, 9)
+        self.journal.commit()
+        restore_ts = datetime.fromtimestamp(START + 60).strftime('%Y-%m-%d %H:%M:%S')
+        self.assertEqual(parse_restore_time(restore_ts), START + 60)
+        self.assertEqual(parse_restore_time('latest'), None)
+        self.assertEqual(restore_datastore(self.dir, 0, parse_restore_time(restore_ts))['hr']['values'], [0, 7, 0, 0])
+
+    def test_checkpoint_covers_earlier_writes(self):
+        self.write_at(10, 0, 5)
+        self.journal.commit()
+        self.clock.advance_to(START + 20)
+        self.journal.checkpoint()
+        self.write_at(30, 3, 6)
+        self.journal.commit()
+        # the restore starts from the second checkpoint, which holds the first write
+        self.assertEqual(restore_datastore(self.dir, 0, START + 25)['hr']['values'], [5, 0, 0, 0])
+        self.assertEqual(restore_datastore(self.dir, 0)['hr']['values'], [5, 0, 0, 6])
+
+    def test_restore_ts_builds_context(self):
+        # what async_plc.py/plc_host.py do with --restore_ts on start
+        from async_plc import journal_datastore_config, build_plc_context
+        self.write_at(10, 1, 7)
+        self.write_at(20, 1, 9)
+        self.journal.commit()
+        master_config = {'journal': {'dir': self.dir}}
+        datastore_config = journal_datastore_config(master_config, 0, str(START + 15))
+        config_list = {'DATASTORE': dict((table, {'start_addr': 1, 'values': [0] * 4}) for table in TABLES)}
+        context = build_plc_context(config_list, os.path.join(self.dir, 'backup_0.yaml'), datastore_config)
+        self.assertEqual(list(context[0].getValues(3, 0, 4)), [0, 7, 0, 0])
+        # no checkpoint that early: fall back to the backup file
+        self.assertEqual(journal_datastore_config(master_config, 0, str(START - 1)), None)
+
+    def test_torn_tail_is_ignored(self):
+        self.write_at(10, 1, 7)
+        self.journal.commit()
+        self.write_at(20, 1, 9)
+        self.journal.commit()
+        segment = list_segments(self.dir)[-1]
+        size = os.path.getsize(segment)
+        # cut the last record in half, as a crash during a commit would
+        segment_file = open(segment, 'r+b')
+        segment_file.truncate(size - 3)
+        segment_file.close()
+        self.assertEqual(restore_datastore(self.dir, 0)['hr']['values'], [0, 7, 0, 0])
+
+    def test_compaction_keeps_newest_segments(self):
+        journal = Journal(self.dir, 'plc_0', segments=2, clock=self.clock)
+        journal.attach(0, self.slave)
+        for i in range(5):
+            self.clock.advance_to(START + i)
+            journal.checkpoint()
+        self.assertEqual(len(list_segments(self.dir)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+The read response cache answers repeated reads until a write to their table bumps its generation
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, struct, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext
+from twisted.test.proto_helpers import StringTransport
+from datastore import PLCSlaveContext
+from server import ResponseCache, PLCServerFactory, READ_REQUEST
+
+def read_request(transaction_id, fc, address, count, unit=0):
+    return READ_REQUEST.pack(transaction_id, 0, 6, unit, fc, address, count)
+
+def write_request(transaction_id, address, value, unit=0):
+    return struct.pack('>HHHBBHH', transaction_id, 0, 6, unit, 6, address, value)
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_generation_invalidates(self):
+        cache = ResponseCache(4)
+        cache.put((3, 0, 0, 1), 5, b'pdu')
+        self.assertEqual(cache.get((3, 0, 0, 1), 5), b'pdu')
+        self.assertEqual(cache.get((3, 0, 0, 1), 6), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(2)
+        cache.put('a', 0, b'a')
+        cache.put('b', 0, b'b')
+        cache.get('a', 0)
+        cache.put('c', 0, b'c')
+        self.assertEqual(cache.get('b', 0), None)
+        self.assertEqual(cache.get('a', 0), b'a')
+        self.assertEqual(cache.evictions, 1)
+
+    def test_writes_bump_their_table_generation(self):
+        slave = PLCSlaveContext(**dict((table, ModbusSequentialDataBlock(1, [0] * 4)) for table in ('di', 'co', 'hr', 'ir')))
+        generation = dict(slave.generation)
+        slave.setValues(3, 1, [7])
+        self.assertEqual(slave.generation['hr'], generation['hr'] + 1)
+        self.assertEqual(slave.generation['co'], generation['co'])
+
+class CachedServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.slave = PLCSlaveContext(**dict((table, ModbusSequentialDataBlock(1, [0] * 4)) for table in ('di', 'co', 'hr', 'ir')))
+        self.cache = ResponseCache(16)
+        factory = PLCServerFactory(ModbusServerContext(slaves=self.slave, single=True), cache=self.cache)
+        self.protocol = factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    '''
+    @brief send one request frame and return the register values of the response
+    '''
+    def read(self, transaction_id, address, count):
+        self.transport.clear()
+        self.protocol.dataReceived(read_request(transaction_id, 3, address, count))
+        response = self.transport.value()
+        self.assertEqual(struct.unpack('>H', response[:2])[0], transaction_id)
+        return list(struct.unpack('>' + 'H' * count, response[9:9 + 2 * count]))
+
+    def test_repeated_read_is_cached(self):
+        self.slave.setValues(3, 1, [7])
+        self.assertEqual(self.read(1, 0, 2), [0, 7])
+        self.assertEqual(self.read(2, 0, 2), [0, 7])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_behavior_write_invalidates(self):
+        self.assertEqual(self.read(1, 0, 2), [0, 0])
+        self.slave.setValues(3, 1, [9])
+        self.assertEqual(self.read(2, 0, 2), [0, 9])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_client_write_invalidates(self):
+        self.assertEqual(self.read(1, 0, 2), [0, 0])
+        self.protocol.dataReceived(write_request(2, 1, 5))
+        self.assertEqual(self.read(3, 0, 2), [0, 5])
+        self.assertEqual(self.read(4, 0, 2), [0, 5])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+if __name__ == '__main__':
+    unittest.main()
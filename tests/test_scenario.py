@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# SCADA Simulator
+#
+# Copyright 2018 Carnegie Mellon University. All Rights Reserved.
+#
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+#
+# Released under a MIT (SEI)-style license, please see license.txt or contact permission@sei.cmu.edu for full terms.
+#
+# [DISTRIBUTION STATEMENT A] This material has been approved for public release and unlimited distribution.  Please see Copyright notice for non-US Government use and distribution.
+# This Software includes and/or makes use of the following Third-Party Software subject to its own license:
+# 1. Packery (https://packery.metafizzy.co/license.html) Copyright 2018 metafizzy.
+# 2. Bootstrap (https://getbootstrap.com/docs/4.0/about/license/) Copyright 2011-2018  Twitter, Inc. and Bootstrap Authors.
+# 3. JIT/Spacetree (https://philogb.github.io/jit/demos.html) Copyright 2013 Sencha Labs.
+# 4. html5shiv (https://github.com/aFarkas/html5shiv/blob/master/MIT%20and%20GPL2%20licenses.md) Copyright 2014 Alexander Farkas.
+# 5. jquery (https://jquery.org/license/) Copyright 2018 jquery foundation.
+# 6. CanvasJS (https://canvasjs.com/license/) Copyright 2018 fenopix.
+# 7. Respond.js (https://github.com/scottjehl/Respond/blob/master/LICENSE-MIT) Copyright 2012 Scott Jehl.
+# 8. Datatables (https://datatables.net/license/) Copyright 2007 SpryMedia.
+# 9. jquery-bridget (https://github.com/desandro/jquery-bridget) Copyright 2018 David DeSandro.
+# 10. Draggabilly (https://draggabilly.desandro.com/) Copyright 2018 David DeSandro.
+# 11. Business Casual Bootstrap Theme (https://startbootstrap.com/template-overviews/business-casual/) Copyright 2013 Blackrock Digital LLC.
+# 12. Glyphicons Fonts (https://www.glyphicons.com/license/) Copyright 2010 - 2018 GLYPHICONS.
+# 13. Bootstrap Toggle (http://www.bootstraptoggle.com/) Copyright 2011-2014 Min Hur, The New York Times.
+# DM18-1351
+#
+
+
+'''
+The built-in fuel_tank scenario writes the same timeline as the fuel_tank_behavior generator it replaced
+- Run from the repository root: python -m unittest discover tests
+'''
+import os, sys, logging, unittest
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plc'))
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext
+from datastore import PLCSlaveContext, read_co_register, write_co_register, update_hr_register
+from scenario import scenario_for, scenario_behavior, compile_scenario
+from scheduler import BehaviorScheduler
+from simclock import SimClock
+
+START = 1500000000.0
+# two rounds of drain, drain, refill
+UNTIL = 2 * 2800
+
+def wait_for(condition, timeout=10.0):
+    deadline = time() + timeout
+    while not condition() and time() < deadline:
+        sleep(0.01)
+    return condition()
+
+'''
+@brief the fuel_tank_behavior generator of helper.py before scenarios, writing the coil at coil_address
+'''
+def fuel_tank_behavior(min, max, address, slave_id, count, context, coil_address):
+    def drain(values):
+        return [v - 1 for v in values] if any(v > min for v in values) else values
+    def refill(values):
+        return [v + 1 for v in values] if any(v < max for v in values) else values
+    while True:
+        for i in range(0, 2):
+            write_co_register(context, slave_id, coil_address, [1])
+            for j in range(0, 25):
+                update_hr_register(context, slave_id, address, count, drain)
+                yield 1
+            write_co_register(context, slave_id, coil_address, [0])
+            yield 875
+            if i == 1:
+                write_co_register(context, slave_id, coil_address, [1])
+                for k in range(0, 100):
+                    update_hr_register(context, slave_id, address, count, refill)
+                    yield 1
+                write_co_register(context, slave_id, coil_address, [0])
+                yield 900
+
+class FuelTankScenarioTest(unittest.TestCase):
+
+    '''
+    @brief [(sim offset, table, address, values)] of every write the behavior made from a full tank until UNTIL
+    '''
+    def timeline(self, make_behavior):
+        slave = PLCSlaveContext(di=ModbusSequentialDataBlock(1, [0]), co=ModbusSequentialDataBlock(1, [0]),
+                                hr=ModbusSequentialDataBlock(1, [100, 7]), ir=ModbusSequentialDataBlock(1, [0]))
+        context = ModbusServerContext(slaves=slave, single=True)
+        clock = SimClock('discrete', start=START)
+        writes = []
+        slave.write_hooks.append(lambda table, address, values: writes.append((clock.now() - START, table, address, list(values))))
+        scheduler = BehaviorScheduler(logging.getLogger('test'), report_interval=0, clock=clock)
+        scheduler.add('tank', make_behavior(context, scheduler), logging.getLogger('test'), wakeable=True)
+        scheduler.start()
+        try:
+            self.assertTrue(wait_for(lambda: clock.now() - START > UNTIL))
+        finally:
+            scheduler.stop()
+            scheduler._thread.join()
+        return [write for write in writes if write[0] < UNTIL]
+
+    def test_same_timeline_as_fuel_tank_behavior(self):
+        config = {'type': 'fuel_tank_behavior', 'min': 0, 'max': 100, 'address': 0, 'count': 1, 'time': 0, 'coil_address': 0}
+        expected = self.timeline(lambda context, scheduler: fuel_tank_behavior(0, 100, 0, 0x00, 1, context, 0))
+        actual = self.timeline(lambda context, scheduler: scenario_behavior(scenario_for(dict(config, scenario='fuel_tank')), 0, 0x00, 1, context,
+                                                                           logging.getLogger('test'), scheduler))
+        self.assertEqual(actual, expected)
+        levels = [values[0] for offset, table, address, values in actual if table == 'hr']
+        self.assertEqual((levels[24], levels[49], levels[149]), (75, 50, 100))
+
+    def test_invalid_scenarios(self):
+        self.assertRaises(ValueError, compile_scenario, 'empty', [], {}, False)
+        self.assertRaises(ValueError, compile_scenario, 'ramp', [{'type': 'ramp', 'rate': 1}], {}, False)
+        self.assertRaises(ValueError, compile_scenario, 'param', [{'type': 'hold', 'for': 'interval'}], {}, False)
+        self.assertRaises(ValueError, compile_scenario, 'next', [{'type': 'hold', 'for': 1, 'next': 'nowhere'}], {}, False)
+
+if __name__ == '__main__':
+    unittest.main()